@@ -10,6 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import sys
+import tempfile
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'sales_pipeline',
@@ -45,12 +50,15 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    # Đặt đầu tiên để đo cả thời gian/query của các middleware phía sau (session, auth...)
+    'sales_pipeline.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'sales_pipeline.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -86,10 +94,108 @@ DATABASES = {
         'PASSWORD': '0',  # Mật khẩu PostgreSQL của bạn
         'HOST': 'localhost',
         'PORT': '5432',
-    }
+        # Giữ kết nối giữa các request (mỗi thread một kết nối), kiểm tra còn sống trước khi dùng lại.
+        # Chạy dưới ASGI mỗi request ở một thread mới: đặt CONN_MAX_AGE = 0 (hoặc dùng pool của psycopg 3).
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Bản sao chỉ đọc (streaming replication), khai báo rồi thêm alias vào DATABASE_REPLICAS:
+    # 'replica': {
+    #     'ENGINE': 'django.db.backends.postgresql',
+    #     'NAME': 'sales_pipeline_db',
+    #     'USER': 'postgres',
+    #     'PASSWORD': '0',
+    #     'HOST': 'replica-host',
+    #     'PORT': '5432',
+    #     'CONN_MAX_AGE': 60,
+    #     'CONN_HEALTH_CHECKS': True,
+    #     'TEST': {'MIRROR': 'default'},
+    # },
+}
+# Chạy test: thêm alias 'replica' là TEST MIRROR của 'default' (cùng DB test, kết nối riêng)
+# để các test định tuyến bản sao / read-your-writes (ReplicaRoutingTests) chạy cùng bộ test mặc định.
+if sys.argv[1:2] == ['test'] and 'replica' not in DATABASES:
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+# Dashboard, xuất CSV và các API danh sách đọc từ bản sao; mọi thao tác ghi vào 'default'.
+# User vừa ghi dữ liệu đọc từ 'default' trong READ_YOUR_WRITES_SECONDS giây (xem sales_pipeline/replicas.py).
+DATABASE_ROUTERS = ['sales_pipeline.replicas.ReplicaRouter']
+DATABASE_REPLICAS = []
+READ_YOUR_WRITES_SECONDS = 5
+REPLICA_RETRY_SECONDS = 30
+DASHBOARD_REPLICA_CACHE_SECONDS = 30
+
+
+# Cache
+# Dashboard dùng alias riêng: LocMemCache loại bỏ theo LRU khi vượt MAX_ENTRIES,
+# TIMEOUT giới hạn độ trễ của các số liệu phụ thuộc thời gian (khách hàng mới 30 ngày).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dashboard': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    # Session và bản tóm tắt user/token (users/): phải dùng chung giữa các process để đăng xuất,
+    # đổi role, thu hồi token có hiệu lực ngay ở mọi worker. File chỉ dùng chung trong một máy:
+    # chạy nhiều máy thì đổi sang Redis/Memcached.
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'crm-auth-cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+DASHBOARD_CACHE_ALIAS = 'dashboard'
+# Số thread chạy song song các query của Dashboard async (mỗi thread giữ một kết nối DB khi dùng kết nối lâu dài)
+DASHBOARD_ASYNC_WORKERS = 8
+
+
+# Đo request (sales_pipeline.middleware): request chậm hơn ngưỡng (ms) được log WARNING
+# kèm N câu SQL tốn thời gian nhất. None để tắt log request chậm.
+REQUEST_METRICS_SLOW_MS = 500
+REQUEST_METRICS_TOP_QUERIES = 5
+
+# Metrics (/api/metrics/): chạy nhiều worker (gunicorn) thì đặt một thư mục chung để gộp số liệu
+# giữa các process, xóa thư mục này mỗi lần khởi động lại dịch vụ. None = chỉ số liệu của process hiện tại.
+METRICS_DIR = None
+METRICS_FLUSH_SECONDS = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # Mỗi request một dòng JSON; đặt WARNING để chỉ giữ request chậm
+        'sales_pipeline.requests': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 
+# Session đọc từ cache (ghi đồng thời vào DB), user của session đọc từ bản tóm tắt trong cache
+# (users/backends.py) nên request đã đăng nhập không cần query session/user.
+# Cả hai nằm trong cache dùng chung 'auth' (không dùng LocMemCache riêng từng process).
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'auth'
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
+AUTH_USER_CACHE_ALIAS = 'auth'
+AUTH_USER_CACHE_SECONDS = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,10 +250,11 @@ REST_FRAMEWORK = {
     'MAX_PAGE_SIZE': 1000,
 
 
-    # Xác thực: Chấp nhận Session (cho trình duyệt) và Basic Auth (cho Postman đơn giản)
+    # Xác thực: Session (trình duyệt/admin) và token (`Authorization: Bearer <token>`, cấp tại /api/auth/token/).
+    # Không dùng Basic Auth: mỗi request phải chạy lại hàm băm mật khẩu (PBKDF2), rất tốn CPU.
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     
     # Quyền hạn: Mặc định phải đăng nhập mới làm được mọi thứ
@@ -156,6 +263,10 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Token API: thời hạn và thời gian giữ trong bộ nhớ process (thu hồi báo cho mọi process qua cache 'auth')
+AUTH_TOKEN_TTL = timedelta(days=7)
+AUTH_TOKEN_CACHE_SECONDS = 60
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Customer, PipelineStage, Opportunity, Activity
+from django.utils import timezone
+
+from .models import Customer, PipelineStage, Opportunity, Activity, OpportunityChange, OutboxEmail
 
 @admin.register(PipelineStage)
 class StageAdmin(admin.ModelAdmin):
@@ -11,4 +13,30 @@ class OpportunityAdmin(admin.ModelAdmin):
     list_filter = ('stage', 'status', 'owner')
 
 admin.site.register(Customer)
-admin.site.register(Activity)
\ No newline at end of file
+admin.site.register(Activity)
+
+
+@admin.register(OpportunityChange)
+class OpportunityChangeAdmin(admin.ModelAdmin):
+    list_display = ('opportunity', 'field', 'old_value', 'new_value', 'user', 'created_at')
+    list_filter = ('field',)
+
+    # Chỉ ghi thêm: không sửa/xóa qua admin
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'last_error')
+    list_filter = ('status',)
+    actions = ['requeue']
+
+    @admin.action(description="Đưa lại vào hàng đợi")
+    def requeue(self, request, queryset):
+        queryset.exclude(status=OutboxEmail.Status.SENT).update(
+            status=OutboxEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now(),
+        )
@@ -0,0 +1,44 @@
+"""
+Lịch sử thay đổi Deal (OpportunityChange): mỗi trường thay đổi một dòng.
+
+Giá trị cũ lấy từ instance đã load sẵn (get_object() của view) trước khi
+serializer ghi đè, không SELECT lại. Khóa ngoại lưu id, giá trị khác lưu dạng chuỗi.
+"""
+from .models import Opportunity, OpportunityChange
+
+AUDITED_FIELDS = [
+    'title', 'value', 'expected_close_date', 'stage', 'status',
+    'lost_reason_code', 'lost_reason', 'owner', 'customer',
+]
+_ATTNAMES = {name: Opportunity._meta.get_field(name).attname for name in AUDITED_FIELDS}
+
+
+def as_text(value):
+    return None if value is None else str(value)
+
+
+def snapshot(instance):
+    return {name: getattr(instance, attname) for name, attname in _ATTNAMES.items()}
+
+
+def diff(before, after):
+    """[(trường, giá trị cũ, giá trị mới)] cho các trường có trong `after` và khác `before`."""
+    return [(name, before[name], after[name]) for name in AUDITED_FIELDS if name in after and before[name] != after[name]]
+
+
+def build_changes(opportunity_id, user, changes):
+    return [
+        OpportunityChange(
+            opportunity_id=opportunity_id, user=user, field=name,
+            old_value=as_text(old), new_value=as_text(new),
+        )
+        for name, old, new in changes
+    ]
+
+
+def record_changes(instance, user, before):
+    """Ghi các trường đã đổi so với snapshot `before` (một INSERT cho cả lô)."""
+    changes = build_changes(instance.pk, user, diff(before, snapshot(instance)))
+    if changes:
+        OpportunityChange.objects.bulk_create(changes)
+    return changes
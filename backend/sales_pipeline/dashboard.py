@@ -0,0 +1,336 @@
+"""
+Tính toán số liệu Dashboard.
+
+Mỗi hàm dưới đây là một nhóm query độc lập trên cùng phạm vi dữ liệu
+(`scope_opportunities`), để view đồng bộ có thể gọi lần lượt và các biến thể
+khác (cache, async) có thể tái sử dụng từng phần.
+
+Biến thể async (`aget_dashboard_stats`) chạy các nhóm còn thiếu trong cache song song
+trên một thread pool giới hạn (DASHBOARD_ASYNC_WORKERS): async ORM của Django chỉ bọc
+sync_to_async và chạy lần lượt trên một thread, còn ở đây mỗi thread có kết nối DB riêng,
+nên độ trễ xấp xỉ query chậm nhất thay vì tổng các query. Query trên các thread này
+được ghi vào QueryRecorder của request (Server-Timing, log request).
+
+Cache (`get_dashboard_stats`) chia payload thành 3 phần, mỗi phần có khóa và
+điều kiện vô hiệu hóa riêng (xem sales_pipeline/signals.py):
+- số liệu theo phạm vi (manager: toàn bảng, REP: theo user id) + `months`,
+  khóa có kèm version của phạm vi, version đổi khi Opportunity thay đổi;
+- số khách hàng mới (chung cho mọi người), xóa khi Customer thay đổi;
+- "việc của tôi" theo user, xóa khi Task (hoặc tên deal của task) thay đổi.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+from django.db.models import Sum, Count, Q, Case, When, DateTimeField
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .middleware import get_query_recorder
+from .models import Customer, Opportunity, Task
+from .serializers import TaskSerializer
+
+DEFAULT_MONTHS = 6
+DEFAULT_ASYNC_WORKERS = 8
+# Số liệu đọc từ bản sao (có thể trễ vài giây so với 'default') chỉ được cache trong thời gian ngắn
+DEFAULT_REPLICA_CACHE_SECONDS = 30
+
+# Map từ mã code sang tên hiển thị tiếng Việt
+LOST_REASON_LABELS = dict(Opportunity.LostReason.choices)
+UNCLASSIFIED_LOST_REASON = "Chưa phân loại/Khác"
+
+
+def parse_months(value):
+    try:
+        return int(value if value is not None else DEFAULT_MONTHS)
+    except (TypeError, ValueError):
+        return DEFAULT_MONTHS
+
+
+def scope_key(user):
+    return f"rep:{user.pk}" if user.role == 'REP' else "all"
+
+
+def scope_opportunities(user, using=DEFAULT_DB_ALIAS):
+    if user.role == 'REP':
+        return Opportunity.objects.using(using).filter(owner=user)
+    return Opportunity.objects.using(using).all()
+
+
+def compute_kpis(opps):
+    """Toàn bộ KPI dạng số trong một query (aggregate có điều kiện)."""
+    kpis = opps.aggregate(
+        expected_revenue=Sum('value', filter=Q(status__in=['OPEN', 'WON'])),
+        open_deals_count=Count('id', filter=Q(status='OPEN')),
+        won_count=Count('id', filter=Q(status='WON')),
+        lost_count=Count('id', filter=Q(status='LOST')),
+    )
+    won_count = kpis['won_count']
+    closed_count = won_count + kpis['lost_count']
+    return {
+        "expected_revenue": kpis['expected_revenue'] or 0,
+        "open_deals_count": kpis['open_deals_count'],
+        "win_rate": round((won_count / closed_count) * 100, 1) if closed_count > 0 else 0,
+    }
+
+
+def compute_new_customers_count(now, using=DEFAULT_DB_ALIAS):
+    return Customer.objects.using(using).filter(created_at__gte=now - timedelta(days=30)).count()
+
+
+def compute_series(opps, now, months):
+    """
+    Ba biểu đồ (doanh thu theo giai đoạn, doanh số WON theo tháng, lý do thua)
+    trong một query GROUP BY duy nhất. Số nhóm chỉ phụ thuộc số giai đoạn,
+    số tháng và số lý do thua, không phụ thuộc số dòng.
+    """
+    start_date = now - timedelta(days=months * 30)
+    rows = opps.filter(
+        Q(status__in=['OPEN', 'LOST']) | Q(status='WON', updated_at__gte=start_date)
+    ).annotate(
+        month=Case(
+            When(status='WON', then=TruncMonth('updated_at')),
+            output_field=DateTimeField(),
+        )
+    ).values('status', 'stage__name', 'lost_reason_code', 'month').annotate(
+        total=Sum('value'), count=Count('id'),
+    ).order_by()
+
+    stage_totals = {}
+    monthly_totals = {}
+    lost_counts = {}
+    for row in rows:
+        if row['status'] == 'OPEN':
+            stage_totals[row['stage__name']] = stage_totals.get(row['stage__name'], 0) + row['total']
+        elif row['status'] == 'WON':
+            monthly_totals[row['month']] = monthly_totals.get(row['month'], 0) + row['total']
+        else:
+            label = LOST_REASON_LABELS.get(row['lost_reason_code'], UNCLASSIFIED_LOST_REASON)
+            lost_counts[label] = lost_counts.get(label, 0) + row['count']
+
+    return {
+        "revenue_by_stage": [
+            {"name": name, "value": total}
+            for name, total in sorted(stage_totals.items(), key=lambda i: i[1])
+        ],
+        "rep_performance": [
+            {"month": month.strftime('%m/%Y'), "sales": total}
+            for month, total in sorted(monthly_totals.items())
+        ],
+        "lost_reason_data": [
+            {"name": label, "value": count}
+            for label, count in sorted(lost_counts.items(), key=lambda i: -i[1])
+        ],
+    }
+
+
+def compute_upcoming_deals(opps, now):
+    return list(
+        opps.filter(status='OPEN', expected_close_date__gte=now.date())
+        .order_by('expected_close_date')[:5]
+        .values('id', 'title', 'expected_close_date', 'value')
+    )
+
+
+def compute_my_tasks(user, using=DEFAULT_DB_ALIAS):
+    my_tasks = Task.objects.using(using).filter(assigned_to=user, is_completed=False).select_related('opportunity').order_by('due_date')[:5]
+    return TaskSerializer(my_tasks, many=True).data
+
+
+def assemble_payload(scoped, new_customers_count, my_tasks):
+    return {
+        "expected_revenue": scoped['expected_revenue'],
+        "open_deals_count": scoped['open_deals_count'],
+        "new_customers_count": new_customers_count,
+        "win_rate": scoped['win_rate'],
+        "revenue_by_stage": scoped['revenue_by_stage'],
+        "upcoming_deals": scoped['upcoming_deals'],
+        "my_tasks": my_tasks,
+        "rep_performance": scoped['rep_performance'],
+        "lost_reason_data": scoped['lost_reason_data'],
+    }
+
+
+# --- CACHE ---
+CACHE_PREFIX = 'dashboard'
+NEW_CUSTOMERS_KEY = f'{CACHE_PREFIX}:new_customers'
+HITS_KEY = f'{CACHE_PREFIX}:stats:hits'
+MISSES_KEY = f'{CACHE_PREFIX}:stats:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _version_key(scope):
+    return f'{CACHE_PREFIX}:version:{scope}'
+
+
+def tasks_key(user_id):
+    return f'{CACHE_PREFIX}:tasks:{user_id}'
+
+
+def get_scope_version(cache, scope):
+    """
+    Version của một phạm vi. Giá trị khởi tạo lấy theo thời gian (không phải 1)
+    để nếu khóa version bị LRU đẩy ra thì version mới không trùng với các entry cũ.
+    """
+    version = cache.get(_version_key(scope))
+    if version is None:
+        cache.add(_version_key(scope), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(scope), 0)
+    return version
+
+
+def bump_scope_versions(scopes):
+    cache = get_cache()
+    cache.set_many({_version_key(scope): time.time_ns() for scope in scopes}, timeout=None)
+
+
+def invalidate_opportunity_owners(owner_ids):
+    """Vô hiệu hóa số liệu toàn bảng và của các REP sở hữu deal vừa thay đổi."""
+    bump_scope_versions(['all', *(f"rep:{owner_id}" for owner_id in set(owner_ids) if owner_id)])
+
+
+def invalidate_tasks(user_ids):
+    get_cache().delete_many([tasks_key(user_id) for user_id in set(user_ids) if user_id])
+
+
+def invalidate_new_customers():
+    get_cache().delete(NEW_CUSTOMERS_KEY)
+
+
+def _count(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Khóa chưa tồn tại (hoặc vừa bị đẩy ra)
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def plan_dashboard_stats(user, months, using=DEFAULT_DB_ALIAS):
+    """
+    Đọc các phần đã cache; trả về (khóa số liệu theo phạm vi, các phần đã có, các nhóm query còn thiếu).
+    Các nhóm query độc lập với nhau: {tên: (hàm, *tham số)}, đọc từ DB `using`.
+    """
+    cache = get_cache()
+    scope = scope_key(user)
+    stats_key = f'{CACHE_PREFIX}:stats:{scope}:{get_scope_version(cache, scope)}:{months}'
+
+    cached = cache.get_many([stats_key, NEW_CUSTOMERS_KEY, tasks_key(user.pk)])
+
+    now = timezone.now()
+    jobs = {}
+    if stats_key in cached:
+        _count(cache, HITS_KEY)
+    else:
+        _count(cache, MISSES_KEY)
+        opps = scope_opportunities(user, using)
+        jobs['kpis'] = (compute_kpis, opps)
+        jobs['series'] = (compute_series, opps, now, months)
+        jobs['upcoming_deals'] = (compute_upcoming_deals, opps, now)
+    if NEW_CUSTOMERS_KEY not in cached:
+        jobs['new_customers'] = (compute_new_customers_count, now, using)
+    if tasks_key(user.pk) not in cached:
+        jobs['my_tasks'] = (compute_my_tasks, user, using)
+    return stats_key, cached, jobs
+
+
+def finish_dashboard_stats(user, stats_key, cached, results, using=DEFAULT_DB_ALIAS):
+    """Lưu các phần vừa tính (`results` theo tên nhóm của plan_dashboard_stats) vào cache và ghép payload."""
+    cache = get_cache()
+    # Bản sao có thể chưa có thay đổi vừa làm tăng version: không giữ số liệu đó tới lần ghi kế tiếp
+    timeout = DEFAULT_TIMEOUT if using == DEFAULT_DB_ALIAS else getattr(settings, 'DASHBOARD_REPLICA_CACHE_SECONDS', DEFAULT_REPLICA_CACHE_SECONDS)
+
+    scoped = cached.get(stats_key)
+    if scoped is None:
+        scoped = {**results['kpis'], **results['series'], "upcoming_deals": results['upcoming_deals']}
+        cache.set(stats_key, scoped, timeout)
+
+    new_customers_count = cached.get(NEW_CUSTOMERS_KEY)
+    if new_customers_count is None:
+        new_customers_count = results['new_customers']
+        cache.set(NEW_CUSTOMERS_KEY, new_customers_count, timeout)
+
+    my_tasks = cached.get(tasks_key(user.pk))
+    if my_tasks is None:
+        my_tasks = results['my_tasks']
+        cache.set(tasks_key(user.pk), my_tasks, timeout)
+
+    return assemble_payload(scoped, new_customers_count, my_tasks)
+
+
+def get_dashboard_stats(user, months, using=DEFAULT_DB_ALIAS):
+    stats_key, cached, jobs = plan_dashboard_stats(user, months, using)
+    results = {name: func(*args) for name, (func, *args) in jobs.items()}
+    return finish_dashboard_stats(user, stats_key, cached, results, using)
+
+
+# --- ASYNC ---
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DASHBOARD_ASYNC_WORKERS', DEFAULT_ASYNC_WORKERS),
+                thread_name_prefix='dashboard',
+            )
+        return _executor
+
+
+def _reset_executor():
+    # Process con sau fork không có các thread của pool: tạo pool mới khi cần
+    global _executor, _executor_lock
+    _executor, _executor_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_executor)
+
+
+def run_job(recorder, func, *args):
+    # Mỗi job như một request riêng với kết nối DB của thread trong pool:
+    # kết nối cũ/lỗi được đóng theo CONN_MAX_AGE trước và sau khi chạy
+    close_old_connections()
+    try:
+        if recorder is None:
+            return func(*args)
+        with recorder.instrument():
+            return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def aget_dashboard_stats(user, months, using=DEFAULT_DB_ALIAS):
+    stats_key, cached, jobs = await sync_to_async(plan_dashboard_stats)(user, months, using)
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    # Thread trong pool không nhận context của request: truyền recorder vào từng job
+    recorder = get_query_recorder()
+    values = await asyncio.gather(*(loop.run_in_executor(executor, run_job, recorder, *job) for job in jobs.values()))
+    return await sync_to_async(finish_dashboard_stats)(user, stats_key, cached, dict(zip(jobs, values)), using)
+
+
+def get_cache_stats():
+    cache = get_cache()
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = counters.get(HITS_KEY, 0)
+    misses = counters.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total * 100, 1) if total else 0,
+    }
@@ -0,0 +1,147 @@
+"""
+Giá trị deal (Opportunity.value) theo các dòng sản phẩm (OpportunityItem).
+
+Khi thêm/sửa/xóa dòng, chỉ cộng phần chênh lệch vào value bằng
+UPDATE ... SET value = value + delta (F()), nên hai request sửa cùng một deal
+không ghi đè lẫn nhau và không phải cộng lại toàn bộ dòng. Lệnh
+`reconcile_opportunity_values` đối chiếu lại value với tổng các dòng.
+Deal chưa có dòng sản phẩm nào giữ nguyên value nhập tay; khi có dòng đầu tiên,
+value được đặt bằng tổng các dòng (số nhập tay không phải là tổng để cộng chênh lệch vào).
+Mọi thay đổi value ở đây (kể cả reconcile) được ghi vào lịch sử OpportunityChange như khi sửa deal.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import audit
+from .dashboard import invalidate_opportunity_owners
+from .models import Opportunity, OpportunityChange, OpportunityItem
+
+MONEY = DecimalField(max_digits=15, decimal_places=2)
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('unit_price'), output_field=MONEY)
+CENT = Decimal('0.01')
+# Số deal đọc/ghi lịch sử mỗi lượt khi reconcile (không giữ cả bảng trong bộ nhớ)
+RECOMPUTE_CHUNK_SIZE = 2000
+
+
+def line_total(quantity, unit_price):
+    return Decimal(quantity) * Decimal(unit_price)
+
+
+def items_total():
+    """Subquery tổng tiền các dòng của deal ở query ngoài (NULL nếu deal không có dòng nào)."""
+    return Subquery(
+        OpportunityItem.objects.filter(opportunity=OuterRef('pk'))
+        .order_by().values('opportunity')
+        .annotate(total=Sum(LINE_TOTAL)).values('total'),
+        output_field=MONEY,
+    )
+
+
+def _invalidate_owners(owner_ids):
+    # queryset.update() không phát signal nên phải tự vô hiệu hóa cache Dashboard
+    owner_ids = list(owner_ids)
+    transaction.on_commit(lambda: invalidate_opportunity_owners(owner_ids))
+
+
+def _invalidate_dashboard(opportunity_ids):
+    _invalidate_owners(Opportunity.objects.filter(pk__in=opportunity_ids).values_list('owner_id', flat=True))
+
+
+def _save_value_changes(rows, user):
+    """rows: (id deal, value cũ, value mới). queryset.update() không qua serializer/audit: tự ghi lịch sử."""
+    changes = [
+        change
+        for pk, old, new in rows if new != old
+        for change in audit.build_changes(pk, user, [('value', old, new)])
+    ]
+    if changes:
+        OpportunityChange.objects.bulk_create(changes)
+
+
+def _record_value_changes(old_values, user):
+    new_values = dict(Opportunity.objects.filter(pk__in=old_values).values_list('pk', 'value'))
+    _save_value_changes(((pk, old, new_values[pk]) for pk, old in old_values.items() if pk in new_values), user)
+
+
+def lock_opportunities(opportunity_ids):
+    """
+    Khóa các deal trước khi ghi dòng sản phẩm (theo thứ tự id để hai transaction không deadlock).
+    Trả về id các deal chưa có dòng nào: value của chúng là số nhập tay.
+    """
+    ids = sorted({pk for pk in opportunity_ids if pk})
+    list(Opportunity.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', flat=True))
+    with_lines = OpportunityItem.objects.filter(opportunity_id__in=ids).order_by().values_list('opportunity_id', flat=True).distinct()
+    return set(ids) - set(with_lines)
+
+
+def apply_value_deltas(deltas, manual=(), user=None):
+    """
+    deltas: {opportunity_id: số tiền chênh lệch}. Gọi trong transaction của thao tác ghi dòng sản phẩm,
+    sau lock_opportunities() và sau khi ghi các dòng. Deal trong `manual` (trước đó chưa có dòng nào)
+    được đặt value = tổng các dòng thay vì cộng chênh lệch.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta and pk not in manual}
+    if not deltas and not manual:
+        return
+    # Các deal đã bị khóa (lock_opportunities) nên giá trị cũ không đổi tới khi UPDATE
+    old_values = dict(Opportunity.objects.filter(pk__in=[*deltas, *manual]).values_list('pk', 'value'))
+    now = timezone.now()
+    if deltas:
+        # Một UPDATE cho mọi deal: value = value + CASE id WHEN ... THEN delta END
+        Opportunity.objects.filter(pk__in=deltas).update(
+            value=F('value') + Case(*(When(pk=pk, then=Value(delta, output_field=MONEY)) for pk, delta in deltas.items()), output_field=MONEY),
+            updated_at=now,
+        )
+    if manual:
+        # Vẫn không có dòng nào (vd: chỉ xóa): giữ số nhập tay
+        Opportunity.objects.filter(pk__in=manual).update(value=Coalesce(items_total(), F('value')), updated_at=now)
+    _record_value_changes(old_values, user)
+    _invalidate_dashboard([*deltas, *manual])
+
+
+def item_deltas(before=(), after=()):
+    """Chênh lệch value theo deal giữa các dòng (opportunity_id, quantity, unit_price) trước và sau khi ghi."""
+    deltas = defaultdict(Decimal)
+    for opportunity_id, quantity, unit_price in before:
+        deltas[opportunity_id] -= line_total(quantity, unit_price)
+    for opportunity_id, quantity, unit_price in after:
+        deltas[opportunity_id] += line_total(quantity, unit_price)
+    return deltas
+
+
+def drifted_opportunities():
+    """Deal có dòng sản phẩm nhưng value khác tổng các dòng."""
+    return Opportunity.objects.annotate(items_total=items_total()).filter(
+        items_total__isnull=False,
+    ).exclude(value=F('items_total'))
+
+
+def recompute_values(queryset, user=None):
+    """
+    Tính lại value = tổng các dòng cho các deal trong queryset bằng một UPDATE lọc theo chính queryset
+    (subquery, không đưa danh sách id qua Python). Trả về số deal được cập nhật.
+    Gọi trong transaction: các deal bị khóa khi đọc, lịch sử (value cũ -> tổng các dòng) được ghi theo lô
+    RECOMPUTE_CHUNK_SIZE deal từ một iterator, rồi mới UPDATE.
+    """
+    targets = Opportunity.objects.filter(pk__in=queryset.values('pk'))
+    rows = (
+        targets.select_for_update().order_by('pk')
+        .annotate(new_value=items_total()).values_list('pk', 'value', 'new_value', 'owner_id')
+        .iterator(chunk_size=RECOMPUTE_CHUNK_SIZE)
+    )
+    owner_ids = set()
+    while chunk := list(islice(rows, RECOMPUTE_CHUNK_SIZE)):
+        # SQLite không làm tròn Decimal của biểu thức về 2 chữ số như cột value
+        _save_value_changes(((pk, old, new.quantize(CENT)) for pk, old, new, _ in chunk), user)
+        owner_ids.update(owner_id for *_, owner_id in chunk)
+    if not owner_ids:
+        return 0
+    updated = targets.update(value=items_total(), updated_at=timezone.now())
+    _invalidate_owners(owner_ids)
+    return updated
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from users.models import CustomUser
+
+from .benchmark_endpoints import PERCENTILES, git_commit, percentile
+
+MODES = {
+    'sync': '/api/dashboard/stats/',
+    'async': '/api/dashboard/stats/async/',
+}
+
+
+async def asgi_get(app, path, query_string, cookie):
+    """Một request GET qua ASGI handler của Django (như uvicorn/daphne gọi), trả về mã trạng thái."""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query_string.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    body_sent = False
+    status = None
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Client không ngắt kết nối: chờ tới khi handler hủy task nghe disconnect
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run_load(app, path, query_string, cookie, concurrency, total):
+    """Gửi `total` request, tối đa `concurrency` request cùng lúc; trả về (latency từng request (ms), tổng thời gian (s))."""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            status = await asgi_get(app, path, query_string, cookie)
+            timings.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                raise CommandError(f"{path}: HTTP {status}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return timings, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'So sánh Dashboard đồng bộ (/api/dashboard/stats/) và async (/api/dashboard/stats/async/) '
+        'khi có nhiều request đồng thời, cả hai chạy qua ASGI handler của Django trong cùng process. '
+        'Đo trên dữ liệu hiện có (chạy seed_data trước). Mặc định bỏ qua cache Dashboard để mọi request đều query DB.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4,16', help='Các mức request đồng thời, cách nhau bởi dấu phẩy')
+        parser.add_argument('--requests', type=int, default=40, help='Số request mỗi mức, mỗi chế độ')
+        parser.add_argument('--warmup', type=int, default=2, help='Số request khởi động mỗi chế độ (không tính)')
+        parser.add_argument('--months', type=int, default=6, help='Tham số months của Dashboard')
+        parser.add_argument('--user', default='manager', help='Username dùng để gọi API')
+        parser.add_argument('--cached', action='store_true', help='Dùng cache Dashboard như khi chạy thật')
+        parser.add_argument('--output', default='benchmark_dashboard.json', help='File JSON kết quả')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',') if level.strip()]
+        except ValueError:
+            raise CommandError('--concurrency phải là danh sách số nguyên, vd: 1,4,16')
+
+        user = CustomUser.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Không tìm thấy user '{options['user']}'")
+
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'], 'DEBUG': False}
+        if not options['cached']:
+            overrides['CACHES'] = {**settings.CACHES, 'dashboard_benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            overrides['DASHBOARD_CACHE_ALIAS'] = 'dashboard_benchmark'
+
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'started_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'requests': options['requests'],
+                'cached': options['cached'],
+                'async_workers': getattr(settings, 'DASHBOARD_ASYNC_WORKERS', None),
+                'user': options['user'],
+            },
+            'levels': [],
+        }
+
+        with override_settings(**overrides):
+            client = Client()
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            query_string = f"months={options['months']}"
+            app = ASGIHandler()
+
+            for path in MODES.values():
+                asyncio.run(run_load(app, path, query_string, cookie, 1, options['warmup']))
+
+            for concurrency in levels:
+                level = {'concurrency': concurrency}
+                self.stdout.write(f"Đồng thời {concurrency}:")
+                for mode, path in MODES.items():
+                    timings, elapsed = asyncio.run(run_load(app, path, query_string, cookie, concurrency, max(1, options['requests'])))
+                    timings.sort()
+                    latency = {f'p{pct}': round(percentile(timings, pct), 2) for pct in PERCENTILES}
+                    latency.update(min=round(timings[0], 2), max=round(timings[-1], 2), mean=round(sum(timings) / len(timings), 2))
+                    level[mode] = {'path': path, 'latency_ms': latency, 'throughput_rps': round(len(timings) / elapsed, 2)}
+                    self.stdout.write(
+                        f"  {mode:<6} p50 {latency['p50']:>9.1f}ms  p95 {latency['p95']:>9.1f}ms  "
+                        f"{level[mode]['throughput_rps']:>8.1f} req/s"
+                    )
+                results['levels'].append(level)
+
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2, ensure_ascii=False, sort_keys=True)
+            output.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi kết quả vào {options['output']}"))
@@ -0,0 +1,239 @@
+import csv
+import io
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Callable
+
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from sales_pipeline import dashboard
+from sales_pipeline.models import Activity, Customer, Opportunity, PipelineStage
+from users.models import CustomUser
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass
+class Scenario:
+    name: str
+    path: str
+    method: str = 'get'
+    params: dict = field(default_factory=dict)
+    # Sinh dữ liệu gửi lên (multipart) cho mỗi lần gọi
+    payload: Callable = None
+    # Chạy trước mỗi lần gọi, không tính vào thời gian (vd: xóa cache)
+    before: Callable = None
+    # Request có ghi dữ liệu: chạy trong transaction rồi rollback để dataset không đổi giữa các lần đo
+    writes: bool = False
+
+
+def percentile(sorted_values, pct):
+    """Nội suy tuyến tính giữa hai giá trị gần nhất (như numpy.percentile mặc định)."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def import_csv(rows):
+    def build():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Tên Khách hàng', 'Email', 'SĐT'])
+        for i in range(rows):
+            writer.writerow([f"Khách benchmark {i}", f"bench-{i}@example.com", f"09{i:08d}"])
+        return {'file': SimpleUploadedFile('customers.csv', buffer.getvalue().encode('utf-8'), content_type='text/csv')}
+    return build
+
+
+class Command(BaseCommand):
+    help = (
+        'Đo hiệu năng các API chính (gọi view DRF thật qua test Client, trong cùng process) trên các dataset '
+        'sinh bằng seed_data: latency p50/p90/p95/p99, số query SQL, bộ nhớ đỉnh (tracemalloc). Ghi kết quả ra JSON. '
+        'CHÚ Ý: mỗi kích thước trong --sizes sẽ XÓA và sinh lại dữ liệu (dùng --no-seed để đo trên dữ liệu hiện có).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,100000,1000000', help='Các kích thước dataset (số cơ hội), cách nhau bởi dấu phẩy')
+        parser.add_argument('--no-seed', action='store_true', help='Không sinh dữ liệu, đo một lượt trên dữ liệu hiện có')
+        parser.add_argument('--seed', type=int, default=42, help='Seed ngẫu nhiên truyền cho seed_data')
+        parser.add_argument('--repeat', type=int, default=20, help='Số lần đo mỗi API')
+        parser.add_argument('--warmup', type=int, default=2, help='Số lần gọi khởi động (không tính)')
+        parser.add_argument('--only', default='', help='Chỉ chạy các kịch bản có tên trong danh sách (cách nhau bởi dấu phẩy)')
+        parser.add_argument('--user', default='manager', help='Username dùng để gọi API')
+        parser.add_argument('--import-rows', type=int, default=1000, help='Số dòng của file CSV khi đo import khách hàng')
+        parser.add_argument('--output', default='benchmark_results.json', help='File JSON kết quả')
+
+    def handle(self, *args, **options):
+        only = {name.strip() for name in options['only'].split(',') if name.strip()}
+        if options['no_seed']:
+            sizes = [None]
+        else:
+            try:
+                sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+            except ValueError:
+                raise CommandError('--sizes phải là danh sách số nguyên, vd: 1000,100000')
+
+        results = {
+            'meta': {
+                'commit': git_commit(),
+                'started_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'repeat': options['repeat'],
+                'warmup': options['warmup'],
+                'user': options['user'],
+            },
+            'datasets': [],
+        }
+
+        # testserver cho Client; DEBUG=False để connection.queries không phình ra giữa các lần đo;
+        # email vào bộ nhớ để không gửi thật
+        with override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        ):
+            for size in sizes:
+                results['datasets'].append(self.run_dataset(size, only, options))
+
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2, ensure_ascii=False, sort_keys=True)
+            output.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"Đã ghi kết quả vào {options['output']}"))
+
+    def run_dataset(self, size, only, options):
+        dataset = {'size': size}
+        if size is not None:
+            self.stdout.write(f"=== Sinh dữ liệu: {size} cơ hội ===")
+            started = time.monotonic()
+            call_command('seed_data', scale=size, seed=options['seed'], stdout=io.StringIO())
+            dataset['seed_seconds'] = round(time.monotonic() - started, 1)
+        if connection.vendor == 'postgresql':
+            # Thống kê planner phải theo kịp dữ liệu vừa sinh, không đợi autovacuum
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        dataset['rows'] = {
+            'opportunities': Opportunity.objects.count(),
+            'customers': Customer.objects.count(),
+            'activities': Activity.objects.count(),
+        }
+
+        user = CustomUser.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Không tìm thấy user '{options['user']}'")
+        client = Client()
+        client.force_login(user)
+
+        dataset['scenarios'] = {}
+        self.stdout.write(f"--- {dataset['rows']['opportunities']} cơ hội ---")
+        for scenario in self.build_scenarios(user, dataset['rows']['opportunities'], options):
+            if only and scenario.name not in only:
+                continue
+            result = self.run_scenario(client, scenario, options['repeat'], options['warmup'])
+            dataset['scenarios'][scenario.name] = result
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"  {scenario.name:<28} p50 {latency['p50']:>9.1f}ms  p95 {latency['p95']:>9.1f}ms  "
+                f"{result['queries']:>4} query  {result['peak_memory_kb']:>9.0f} KB"
+            )
+        return dataset
+
+    def build_scenarios(self, user, opportunity_count, options):
+        """Tham số (stage, owner, deal có nhiều hoạt động...) lấy từ dữ liệu hiện có để kịch bản chạy được trên mọi dataset."""
+        stage_id = PipelineStage.objects.filter(type='OPEN').order_by('order').values_list('id', flat=True).first()
+        owner_id = Opportunity.objects.order_by('-id').values_list('owner_id', flat=True).first()
+        activity = Activity.objects.order_by('-id').values('opportunity_id', 'opportunity__customer_id').first() or {}
+
+        # Trang ở giữa danh sách (10 dòng/trang): chi phí OFFSET tăng theo kích thước dataset
+        middle_page = max(1, opportunity_count // 20)
+
+        def cold_dashboard():
+            dashboard.invalidate_opportunity_owners([user.pk])
+            dashboard.invalidate_tasks([user.pk])
+            dashboard.invalidate_new_customers()
+
+        return [
+            Scenario('opportunity_list', '/api/opportunities/'),
+            Scenario('opportunity_list_deep_page', '/api/opportunities/', params={'page': middle_page}),
+            Scenario('opportunity_list_cursor', '/api/opportunities/', params={'pagination': 'cursor'}),
+            Scenario('opportunity_search', '/api/opportunities/', params={'search': 'Gia hạn'}),
+            Scenario('opportunity_filter', '/api/opportunities/', params={'status': 'OPEN', 'stage': stage_id, 'owner': owner_id}),
+            Scenario('dashboard_stats', '/api/dashboard/stats/', before=cold_dashboard),
+            Scenario('dashboard_stats_cached', '/api/dashboard/stats/'),
+            Scenario('kanban_board', '/api/board/'),
+            Scenario('opportunity_export', '/api/opportunities/export/'),
+            Scenario('customer_import', '/api/customers/import/', method='post',
+                     payload=import_csv(options['import_rows']), writes=True),
+            Scenario('customer_list', '/api/customers/'),
+            Scenario('customer_search', '/api/customers/', params={'search': 'Trần'}),
+            Scenario('activity_timeline', '/api/activities/', params={'opportunity': activity.get('opportunity_id')}),
+            Scenario('customer_activity_timeline', '/api/activities/', params={'customer': activity.get('opportunity__customer_id')}),
+        ]
+
+    def call(self, client, scenario):
+        if scenario.before:
+            scenario.before()
+        data = scenario.payload() if scenario.payload else {key: value for key, value in scenario.params.items() if value is not None}
+        started = time.perf_counter()
+        with transaction.atomic() if scenario.writes else nullcontext():
+            response = getattr(client, scenario.method)(scenario.path, data)
+            # Response dạng stream (export CSV): chỉ tính xong khi đọc hết nội dung
+            size = sum(len(chunk) for chunk in response.streaming_content) if response.streaming else len(response.content)
+            if scenario.writes:
+                transaction.set_rollback(True)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise CommandError(f"{scenario.name}: HTTP {response.status_code} {response.content[:200]!r}")
+        return elapsed, size
+
+    def run_scenario(self, client, scenario, repeat, warmup):
+        for _ in range(warmup):
+            self.call(client, scenario)
+        # Đo thời gian không bật tracemalloc/đếm query (tracemalloc làm chậm vài lần);
+        # query và bộ nhớ đỉnh đo ở một lần gọi riêng sau đó
+        timings = sorted(self.call(client, scenario)[0] for _ in range(max(1, repeat)))
+
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                _, size = self.call(client, scenario)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        latency = {f'p{pct}': round(percentile(timings, pct), 2) for pct in PERCENTILES}
+        latency.update(min=round(timings[0], 2), max=round(timings[-1], 2), mean=round(sum(timings) / len(timings), 2))
+        return {
+            'method': scenario.method.upper(),
+            'path': scenario.path,
+            'params': {key: value for key, value in scenario.params.items() if value is not None},
+            'latency_ms': latency,
+            'queries': len(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'response_bytes': size,
+        }
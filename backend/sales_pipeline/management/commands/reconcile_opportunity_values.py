@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Abs
+
+from sales_pipeline.items import drifted_opportunities, recompute_values
+
+
+class Command(BaseCommand):
+    help = 'Đối chiếu giá trị deal với tổng các dòng sản phẩm (thêm --fix để sửa các deal bị lệch)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Ghi lại value = tổng các dòng cho các deal bị lệch')
+        parser.add_argument('--show', type=int, default=20, help='Số deal bị lệch in ra màn hình (mặc định 20)')
+
+    def handle(self, *args, **options):
+        drifted = drifted_opportunities()
+        summary = drifted.aggregate(count=Count('id'), total_drift=Sum(Abs(F('value') - F('items_total'))))
+
+        if not summary['count']:
+            self.stdout.write(self.style.SUCCESS('Không có deal nào bị lệch giá trị.'))
+            return
+
+        for opp in drifted.order_by('id').values('id', 'title', 'value', 'items_total')[:options['show']]:
+            self.stdout.write(f"#{opp['id']} {opp['title']}: value={opp['value']:,.2f}, tổng dòng={opp['items_total']:,.2f}")
+        self.stdout.write(self.style.WARNING(
+            f"{summary['count']} deal bị lệch, tổng chênh lệch {summary['total_drift']:,.2f}."
+        ))
+
+        if options['fix']:
+            with transaction.atomic():
+                updated = recompute_values(drifted)
+            self.stdout.write(self.style.SUCCESS(f'Đã tính lại giá trị cho {updated} deal.'))
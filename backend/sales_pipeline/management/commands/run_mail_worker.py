@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sales_pipeline.outbox import (
+    DEFAULT_BACKOFF_SECONDS, DEFAULT_BATCH_SIZE, DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, MailDelivery,
+)
+
+
+class Command(BaseCommand):
+    help = 'Gửi email trong hàng đợi (OutboxEmail) theo lô qua một kết nối dùng lại'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Số thư mỗi lô')
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Số lần thử trước khi chuyển sang DEAD')
+        parser.add_argument('--backoff', type=int, default=DEFAULT_BACKOFF_SECONDS, help='Số giây chờ lần thử lại đầu tiên (gấp đôi mỗi lần)')
+        parser.add_argument('--lease', type=int, default=DEFAULT_LEASE_SECONDS, help='Số giây giữ lô đã nhận; quá hạn thì worker khác gửi lại')
+        parser.add_argument('--interval', type=float, default=5, help='Số giây nghỉ khi hàng đợi trống')
+        parser.add_argument('--once', action='store_true', help='Gửi hết thư đến hạn rồi thoát (dùng cho cron)')
+
+    def handle(self, *args, **options):
+        delivery = MailDelivery(max_attempts=options['max_attempts'], backoff_seconds=options['backoff'], lease_seconds=options['lease'])
+        total_sent = total_failed = 0
+        try:
+            while True:
+                sent, failed = delivery.deliver_batch(options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'Đã gửi {sent} thư, lỗi {failed} thư.')
+                    continue
+                if options['once']:
+                    break
+                # Hàng đợi trống: đóng kết nối để server mail không phải giữ phiên rảnh
+                delivery.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            delivery.close()
+        self.stdout.write(self.style.SUCCESS(f'Tổng cộng: đã gửi {total_sent} thư, lỗi {total_failed} thư.'))
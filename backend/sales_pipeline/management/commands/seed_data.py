@@ -1,111 +1,244 @@
 import random
+import time
+from contextlib import contextmanager
 from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
 from django.utils import timezone
-from sales_pipeline.models import Customer, PipelineStage, Opportunity, Product, OpportunityItem, Activity, Task
+from sales_pipeline import dashboard, versioning
+from sales_pipeline.models import (
+    Customer, PipelineStage, Opportunity, Product, OpportunityItem, Activity, Task, OpportunityChange,
+)
 from users.models import CustomUser
 
+DEMO_PASSWORD = 'password123'
+
+STAGES_DATA = [
+    (1, "Mới (New)", "OPEN"), (2, "Đang liên hệ", "OPEN"),
+    (3, "Trình bày giải pháp", "OPEN"), (4, "Đàm phán", "OPEN"),
+    (5, "Chốt thành công (Won)", "WON"), (6, "Thất bại (Lost)", "LOST"),
+]
+PRODUCTS_DATA = [("Gói Basic", "SP1", 5e6), ("Gói Pro", "SP2", 15e6), ("Gói Enterprise", "SP3", 50e6)]
+
+# Phân bố dữ liệu sinh ra
+STATUS_WEIGHTS = {'OPEN': 50, 'WON': 30, 'LOST': 20}
+# Deal đang mở dồn nhiều ở các giai đoạn đầu phễu
+OPEN_STAGE_WEIGHTS = [40, 30, 20, 10]
+# None = chưa phân loại
+LOST_REASON_WEIGHTS = {'PRICE': 30, 'COMPETITOR': 25, 'BUDGET': 15, 'FEATURES': 12, 'TIMING': 8, 'OTHER': 5, None: 5}
+PRODUCT_WEIGHTS = [60, 30, 10]
+HISTORY_DAYS = 730
+CUSTOMERS_PER_OPPORTUNITY = 0.5
+MAX_ITEMS = 3
+MAX_ACTIVITIES = 4
+TASK_PROBABILITY = 0.5
+# Số deal mỗi nhân viên kinh doanh khi chạy --scale lớn
+OPPORTUNITIES_PER_REP = 5000
+
+FAMILY_NAMES = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ", "Hồ", "Ngô", "Dương", "Lý"]
+GIVEN_NAMES = ["An", "Bình", "Cường", "Dũng", "Đức", "Giang", "Hà", "Hải", "Hạnh", "Hoa", "Hùng", "Khánh", "Linh", "Minh", "Nam", "Phúc", "Quang", "Sơn", "Thảo", "Trang", "Tuấn", "Vy"]
+COMPANY_PREFIXES = ["Công ty TNHH", "Công ty CP", "Tập đoàn", "Cửa hàng", "Doanh nghiệp tư nhân", "Anh", "Chị"]
+DEAL_PREFIXES = ["Triển khai CRM", "Gia hạn hợp đồng", "Mua license", "Tư vấn chuyển đổi số", "Nâng cấp gói", "Đào tạo nhân sự"]
+ACTIVITY_SUMMARIES = {
+    'CALL': ["Gọi điện giới thiệu sản phẩm", "Gọi lại hỏi nhu cầu", "Trao đổi về báo giá"],
+    'EMAIL': ["Gửi báo giá", "Gửi tài liệu giới thiệu", "Gửi hợp đồng"],
+    'MEETING': ["Demo sản phẩm", "Họp chốt yêu cầu", "Gặp trực tiếp đàm phán"],
+    'NOTE': ["Khách hàng quan tâm gói Pro", "Cần xin thêm ngân sách", "Đang so sánh với đối thủ"],
+}
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """Tạm tắt auto_now/auto_now_add để bulk_create giữ ngày tạo/cập nhật sinh ngẫu nhiên."""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
 class Command(BaseCommand):
-    help = 'Tự động sinh dữ liệu mẫu (Đã sửa lỗi tính tổng tiền Deal)'
-
-    def handle(self, *args, **kwargs):
-        self.stdout.write("--- 1. XÓA DỮ LIỆU CŨ ---")
-        Task.objects.all().delete()
-        Activity.objects.all().delete()
-        OpportunityItem.objects.all().delete()
-        Opportunity.objects.all().delete()
-        Customer.objects.all().delete()
-        Product.objects.all().delete()
-        PipelineStage.objects.all().delete()
-        CustomUser.objects.exclude(is_superuser=True).delete()
+    help = 'Sinh dữ liệu mẫu bằng bulk_create theo lô (--scale để sinh hàng triệu deal cho benchmark)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=100, help='Số cơ hội cần sinh (mặc định 100)')
+        parser.add_argument('--seed', type=int, default=42, help='Seed ngẫu nhiên: cùng seed + scale thì cùng dữ liệu')
+        parser.add_argument('--append', action='store_true', help='Thêm vào dữ liệu hiện có, không xóa')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Số cơ hội mỗi lô bulk_create')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.now = timezone.now()
+        scale, chunk_size = options['scale'], options['chunk_size']
+        started = time.monotonic()
+
+        if not options['append']:
+            self.stdout.write("--- 1. XÓA DỮ LIỆU CŨ ---")
+            self.wipe()
 
         self.stdout.write("--- 2. TẠO USER & DANH MỤC ---")
+        owners, owner_weights = self.create_users(scale)
+        stages_map = self.create_stages()
+        products = self.create_products()
 
-        # Tạo User
-        manager = CustomUser.objects.create_user(username='manager', email='manager@test.com', password='password123', role='MANAGER')
-        rep1 = CustomUser.objects.create_user(username='sales_a', email='a@test.com', password='password123', role='REP')
-        rep2 = CustomUser.objects.create_user(username='sales_b', email='b@test.com', password='password123', role='REP')
-        owners = [manager, rep1, rep2]
-
-        # Tạo Giai đoạn
-        stages_data = [
-            (1, "Mới (New)", "OPEN"), (2, "Đang liên hệ", "OPEN"),
-            (3, "Trình bày giải pháp", "OPEN"), (4, "Đàm phán", "OPEN"),
-            (5, "Chốt thành công (Won)", "WON"), (6, "Thất bại (Lost)", "LOST"),
-        ]
+        with keep_timestamps(Customer, Opportunity, OpportunityItem, Activity, Task):
+            self.stdout.write(f"--- 3. TẠO {int(scale * CUSTOMERS_PER_OPPORTUNITY) or 1} KHÁCH HÀNG ---")
+            customer_ids = self.create_customers(max(1, int(scale * CUSTOMERS_PER_OPPORTUNITY)), chunk_size * 2)
+
+            self.stdout.write(f"--- 4. TẠO {scale} CƠ HỘI & DOANH SỐ ---")
+            for start in range(0, scale, chunk_size):
+                with transaction.atomic():
+                    self.tune_bulk_load()
+                    self.create_opportunity_chunk(
+                        min(chunk_size, scale - start), owners, owner_weights, stages_map, products, customer_ids,
+                    )
+                done = min(start + chunk_size, scale)
+                self.stdout.write(f"    {done}/{scale} cơ hội ({time.monotonic() - started:.0f}s)")
+
+        # bulk_create không phát signal: tự vô hiệu hóa cache Dashboard
+        dashboard.invalidate_opportunity_owners([owner.pk for owner in owners])
+        dashboard.invalidate_tasks([owner.pk for owner in owners])
+        dashboard.invalidate_new_customers()
+        # bulk_create/TRUNCATE không phát signal: tự tăng phiên bản (ETag) của dữ liệu tham chiếu
+        versioning.bump(CustomUser, PipelineStage, Product)
+
+        self.stdout.write(self.style.SUCCESS(f"--- HOÀN TẤT TRONG {time.monotonic() - started:.1f}s! ---"))
+        self.stdout.write(f"Tài khoản Manager: manager / {DEMO_PASSWORD}")
+        self.stdout.write(f"Tài khoản Sales: sales_a / {DEMO_PASSWORD}")
+
+    def wipe(self):
+        # TRUNCATE (PostgreSQL) / DELETE toàn bảng: nhanh hơn nhiều so với .delete() qua ORM ở hàng triệu dòng
+        models = [OpportunityChange, Task, Activity, OpportunityItem, Opportunity, Customer, Product, PipelineStage]
+        connection.ops.execute_sql_flush(
+            connection.ops.sql_flush(no_style(), [model._meta.db_table for model in models], allow_cascade=True)
+        )
+        CustomUser.objects.exclude(is_superuser=True).delete()
+
+    def tune_bulk_load(self):
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            # Chỉ trong transaction của lô: không chờ flush WAL mỗi lần commit,
+            # gom thay đổi của các index GIN (tìm kiếm) vào pending list lớn hơn
+            cursor.execute("SET LOCAL synchronous_commit = off")
+            cursor.execute("SET LOCAL gin_pending_list_limit = '32MB'")
+
+    def create_users(self, scale):
+        password = make_password(DEMO_PASSWORD)  # Hash một lần cho mọi user mẫu
+        demo = [('manager', 'manager@test.com', 'MANAGER'), ('sales_a', 'a@test.com', 'REP'), ('sales_b', 'b@test.com', 'REP')]
+        extra_reps = max(0, scale // OPPORTUNITIES_PER_REP - 2)
+        wanted = demo + [(f'sales_{i + 1}', f'sales{i + 1}@test.com', 'REP') for i in range(extra_reps)]
+
+        existing = set(CustomUser.objects.filter(username__in=[u for u, _, _ in wanted]).values_list('username', flat=True))
+        CustomUser.objects.bulk_create([
+            CustomUser(username=username, email=email, role=role, password=password)
+            for username, email, role in wanted if username not in existing
+        ])
+        owners = list(CustomUser.objects.filter(username__in=[u for u, _, _ in wanted]).order_by('id'))
+        # Phân bố lệch kiểu Zipf: vài người làm nhiều deal, đa số làm ít
+        return owners, [1 / (rank + 1) ** 0.7 for rank in range(len(owners))]
+
+    def create_stages(self):
         stages_map = {'OPEN': [], 'WON': [], 'LOST': []}
-        for order, name, s_type in stages_data:
-            s = PipelineStage.objects.create(name=name, order=order, type=s_type)
-            stages_map[s_type].append(s)
-
-        # Tạo Sản phẩm & Khách hàng
-        products_data = [("Gói Basic", "SP1", 5e6), ("Gói Pro", "SP2", 15e6), ("Gói Enterprise", "SP3", 50e6)]
-        product_objs = [Product.objects.create(name=n, code=c, price=p) for n, c, p in products_data]
-        
-        customers = []
-        for i in range(50):
-            customers.append(Customer.objects.create(name=f"Khách hàng {i+1}", email=f"kh{i}@test.com", phone=f"090{i:07d}"))
-
-        self.stdout.write("--- 3. TẠO CƠ HỘI & DOANH SỐ ---")
-        
-        # Cấu hình số lượng cố định
-        status_list = ['WON'] * 30 + ['LOST'] * 20 + ['OPEN'] * 50
-        random.shuffle(status_list)
-
-        for i, target_status in enumerate(status_list):
-            owner = owners[i % len(owners)] # Chia đều deal
-            customer = random.choice(customers)
-            stage = random.choice(stages_map[target_status])
-            
-            # Logic lý do thua
-            lost_code = random.choice(['PRICE', 'COMPETITOR']) if target_status == 'LOST' else None
-            lost_reason = "Giá cao hơn đối thủ" if lost_code == 'PRICE' else None
-
-            # Random ngày
-            days_ago = random.randint(0, 180)
-            created_date = timezone.now() - timedelta(days=days_ago)
-            
-            opp = Opportunity.objects.create(
-                title=f"Deal #{i+1} - {customer.name}",
-                value=0, # Giá trị tạm thời
-                expected_close_date=timezone.now().date() + timedelta(days=random.randint(5, 30)),
-                status=target_status, stage=stage, owner=owner, customer=customer,
-                lost_reason=lost_reason, lost_reason_code=lost_code
-            )
-            # Hack ngày tạo để test biểu đồ
-            opp.created_at = created_date
-            opp.updated_at = created_date
-            opp.save()
-
-            # --- [ĐÃ SỬA] THÊM SẢN PHẨM & TÍNH TỔNG TIỀN ---
-            prod = random.choice(product_objs)
-            qty = random.randint(1, 3) # Random số lượng từ 1 đến 3
-            
-            OpportunityItem.objects.create(
-                opportunity=opp, 
-                product=prod, 
-                quantity=qty, 
-                unit_price=prod.price
-            )
-            
-            # Cập nhật Value = Đơn giá * Số lượng
-            opp.value = prod.price * qty 
-            opp.save()
-            # -----------------------------------------------
-
-        self.stdout.write("--- 4. TẠO VIỆC GẤP (CHO DASHBOARD) ---")
-        
-        for user in owners:
-            my_open_opps = Opportunity.objects.filter(owner=user, status='OPEN')
-            # 5 việc gấp
-            for idx, opp in enumerate(my_open_opps[:5]):
-                Task.objects.create(
-                    opportunity=opp, assigned_to=user, 
-                    title=f"🔥 GẤP: Gọi lại chốt đơn #{opp.id}", 
-                    due_date=timezone.now() + timedelta(hours=idx*2), 
-                    priority='HIGH', is_completed=False
-                )
-
-        self.stdout.write(self.style.SUCCESS("--- HOÀN TẤT! DỮ LIỆU ĐÃ CHUẨN ---"))
-        self.stdout.write("Tài khoản Manager: manager / password123")
-        self.stdout.write("Tài khoản Sales: sales_a / password123")
\ No newline at end of file
+        for order, name, s_type in STAGES_DATA:
+            stage, _ = PipelineStage.objects.get_or_create(name=name, defaults={'order': order, 'type': s_type})
+            stages_map[stage.type].append(stage)
+        return stages_map
+
+    def create_products(self):
+        return [
+            Product.objects.get_or_create(code=code, defaults={'name': name, 'price': Decimal(price)})[0]
+            for name, code, price in PRODUCTS_DATA
+        ]
+
+    def random_past(self, days):
+        # Dữ liệu gần đây dày hơn (công ty tăng trưởng): lệch về phía hiện tại
+        return self.now - timedelta(seconds=int(days * 86400 * self.rng.random() ** 2))
+
+    def create_customers(self, count, chunk_size):
+        rng = self.rng
+        offset = Customer.objects.count()
+        ids = []
+        for start in range(0, count, chunk_size):
+            batch = []
+            for i in range(offset + start, offset + min(start + chunk_size, count)):
+                created = self.random_past(HISTORY_DAYS)
+                batch.append(Customer(
+                    name=f"{rng.choice(COMPANY_PREFIXES)} {rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES)} {i + 1}",
+                    email=f"kh{i}@test.com", phone=f"09{i:08d}", created_at=created,
+                ))
+            ids += [customer.pk for customer in Customer.objects.bulk_create(batch)]
+        return ids
+
+    def create_opportunity_chunk(self, count, owners, owner_weights, stages_map, products, customer_ids):
+        rng = self.rng
+        today = self.now.date()
+        statuses = rng.choices(list(STATUS_WEIGHTS), weights=list(STATUS_WEIGHTS.values()), k=count)
+        chosen_owners = rng.choices(owners, weights=owner_weights, k=count)
+
+        opps, lines = [], []
+        for status, owner in zip(statuses, chosen_owners):
+            created = self.random_past(HISTORY_DAYS)
+            if status == 'OPEN':
+                stage = rng.choices(stages_map['OPEN'], weights=OPEN_STAGE_WEIGHTS[:len(stages_map['OPEN'])])[0]
+                updated = created + (self.now - created) * rng.random()
+                close_date = today + timedelta(days=rng.randint(-30, 90))
+                lost_code = None
+            else:
+                stage = rng.choice(stages_map[status])
+                # Ngày chốt (updated_at) trong vòng 120 ngày sau khi tạo
+                updated = min(self.now, created + timedelta(days=rng.randint(1, 120)))
+                close_date = updated.date()
+                lost_code = rng.choices(list(LOST_REASON_WEIGHTS), weights=list(LOST_REASON_WEIGHTS.values()))[0] if status == 'LOST' else None
+
+            deal_lines = [
+                (product, rng.randint(1, 5))
+                for product in rng.choices(products, weights=PRODUCT_WEIGHTS[:len(products)], k=rng.randint(1, MAX_ITEMS))
+            ]
+            lines.append(deal_lines)
+            customer_id = rng.choice(customer_ids)
+            opps.append(Opportunity(
+                title=f"{rng.choice(DEAL_PREFIXES)} #{customer_id}-{rng.randint(1000, 9999)}",
+                value=sum(product.price * qty for product, qty in deal_lines),
+                expected_close_date=close_date, status=status, stage=stage, owner=owner,
+                customer_id=customer_id, lost_reason_code=lost_code,
+                lost_reason="Giá cao hơn đối thủ" if lost_code == 'PRICE' else None,
+                created_at=created, updated_at=updated,
+            ))
+        opps = Opportunity.objects.bulk_create(opps)
+
+        items, activities, tasks = [], [], []
+        for opp, deal_lines in zip(opps, lines):
+            for product, qty in deal_lines:
+                items.append(OpportunityItem(
+                    opportunity=opp, product=product, quantity=qty, unit_price=product.price, created_at=opp.created_at,
+                ))
+            for _ in range(rng.randint(0, MAX_ACTIVITIES)):
+                activity_type = rng.choice(list(ACTIVITY_SUMMARIES))
+                activities.append(Activity(
+                    opportunity=opp, user=opp.owner, type=activity_type,
+                    summary=rng.choice(ACTIVITY_SUMMARIES[activity_type]),
+                    created_at=opp.created_at + (opp.updated_at - opp.created_at) * rng.random(),
+                ))
+            if rng.random() < TASK_PROBABILITY:
+                due = self.now + timedelta(hours=rng.randint(-72, 24 * 14)) if opp.status == 'OPEN' else opp.updated_at
+                tasks.append(Task(
+                    opportunity=opp, assigned_to=opp.owner, title=f"Gọi lại chốt đơn #{opp.pk}", due_date=due,
+                    priority=rng.choice(['LOW', 'MEDIUM', 'HIGH']),
+                    is_completed=opp.status != 'OPEN' or (due < self.now and rng.random() < 0.7),
+                    created_at=opp.created_at,
+                ))
+        OpportunityItem.objects.bulk_create(items)
+        Activity.objects.bulk_create(activities)
+        Task.objects.bulk_create(tasks)
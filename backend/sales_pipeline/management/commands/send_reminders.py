@@ -1,28 +1,126 @@
-from django.core.management.base import BaseCommand
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+from itertools import groupby, islice
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from django.core.mail import send_mail
 from sales_pipeline.models import Opportunity
 
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
 class Command(BaseCommand):
-    help = 'Gửi email nhắc nhở cho các cơ hội sắp hết hạn hôm nay'
+    help = 'Gửi email nhắc nhở cho các cơ hội sắp hết hạn (mặc định: hôm nay)'
 
-    def handle(self, *args, **kwargs):
-        today = timezone.now().date()
-        # Tìm các deal có ngày đóng là hôm nay hoặc mai và chưa xong
-        opps = Opportunity.objects.filter(
-            expected_close_date=today,
-            status='OPEN'
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=0, help='Nhìn trước bao nhiêu ngày: 0 = chỉ hôm nay, 1 = hôm nay và ngày mai...')
+        parser.add_argument('--digest', action='store_true', help='Gộp các deal của mỗi người phụ trách vào một email')
+        parser.add_argument('--workers', type=int, default=1, help='Số luồng gửi song song (mỗi luồng một kết nối SMTP)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Số email gửi mỗi lượt trên một kết nối')
+
+    def due_opportunities(self, today, days):
+        # Một query, owner JOIN sẵn, đọc dần theo owner để gom nhóm không cần giữ cả kết quả trong bộ nhớ.
+        # values() thay vì model instance: tạo instance cho hàng trăm nghìn dòng chiếm phần lớn thời gian.
+        return (
+            Opportunity.objects.filter(
+                status='OPEN',
+                expected_close_date__range=(today, today + timedelta(days=days)),
+                owner__email__gt='',
+            )
+            .values('owner_id', 'owner__username', 'owner__email', 'title', 'value', 'expected_close_date')
+            .order_by('owner_id', 'expected_close_date', 'id')
+            .iterator(chunk_size=2000)
+        )
+
+    def single_message(self, opp, today):
+        close_date = opp['expected_close_date']
+        return EmailMessage(
+            subject=f"Nhắc nhở: Deal '{opp['title']}' đến hạn {'hôm nay' if close_date == today else close_date.strftime('%d/%m/%Y')}!",
+            body=f"Xin chào {opp['owner__username']},\n\nCơ hội bán hàng '{opp['title']}' có ngày đóng dự kiến là {close_date}.\nVui lòng kiểm tra và cập nhật trạng thái.\n\nTrân trọng,\nCore CRM",
+            to=[opp['owner__email']],
         )
 
-        for opp in opps:
-            if opp.owner and opp.owner.email:
-                print(f"Gửi mail cho {opp.owner.email} về deal {opp.title}")
-                send_mail(
-                    subject=f"Nhắc nhở: Deal '{opp.title}' đến hạn hôm nay!",
-                    message=f"Xin chào {opp.owner.username},\n\nCơ hội bán hàng '{opp.title}' có ngày đóng dự kiến là hôm nay ({today}).\nVui lòng kiểm tra và cập nhật trạng thái.\n\nTrân trọng,\nCore CRM",
-                    from_email=None,
-                    recipient_list=[opp.owner.email],
-                    fail_silently=True
-                )
-        
-        self.stdout.write(self.style.SUCCESS(f'Đã gửi nhắc nhở cho {opps.count()} giao dịch.')) 
\ No newline at end of file
+    def digest_message(self, opps):
+        lines = "\n".join(
+            f"- {opp['title']} ({opp['expected_close_date'].strftime('%d/%m/%Y')}): {opp['value']:,.0f}"
+            for opp in opps
+        )
+        return EmailMessage(
+            subject=f"Nhắc nhở: {len(opps)} deal sắp đến hạn",
+            body=f"Xin chào {opps[0]['owner__username']},\n\nCác cơ hội bán hàng sau sắp đến ngày đóng dự kiến:\n{lines}\n\nVui lòng kiểm tra và cập nhật trạng thái.\n\nTrân trọng,\nCore CRM",
+            to=[opps[0]['owner__email']],
+        )
+
+    def build_messages(self, opps, today, digest, counter):
+        if digest:
+            for _, group in groupby(opps, key=lambda opp: opp['owner_id']):
+                group = list(group)
+                counter['deals'] += len(group)
+                yield self.digest_message(group)
+        else:
+            for opp in opps:
+                counter['deals'] += 1
+                yield self.single_message(opp, today)
+
+    def deliver(self, messages, workers, batch_size):
+        """
+        Gửi theo lượt qua kết nối dùng lại: 1 luồng = 1 kết nối cho cả lệnh.
+        Chỉ giữ tối đa workers * 2 lượt đang chờ gửi: email được tạo dần theo tốc độ gửi,
+        không đọc hết kết quả query vào bộ nhớ.
+        Lượt gửi lỗi được đếm (kèm lỗi đầu tiên) rồi gửi tiếp lượt sau qua kết nối mới.
+        Trả về (số email đã gửi, số email lỗi, lỗi đầu tiên).
+        """
+        connections = []
+        local = threading.local()
+        errors = []
+
+        def send(batch):
+            try:
+                if getattr(local, 'connection', None) is None:
+                    local.connection = get_connection()
+                    connections.append(local.connection)
+                    local.connection.open()
+                return local.connection.send_messages(batch) or 0
+            except Exception as e:
+                # Kết nối có thể đã hỏng: lượt sau của luồng này mở kết nối mới
+                if getattr(local, 'connection', None) is not None:
+                    local.connection.close()
+                    local.connection = None
+                errors.append((len(batch), f"{type(e).__name__}: {e}"))
+                return 0
+
+        try:
+            if workers <= 1:
+                sent = sum(send(batch) for batch in chunked(messages, batch_size))
+            else:
+                sent = 0
+                pending = set()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    for batch in chunked(messages, batch_size):
+                        if len(pending) >= workers * 2:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            sent += sum(future.result() for future in done)
+                        pending.add(executor.submit(send, batch))
+                    sent += sum(future.result() for future in wait(pending).done)
+        finally:
+            for connection in connections:
+                connection.close()
+        return sent, sum(count for count, _ in errors), errors[0][1] if errors else None
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        opps = self.due_opportunities(today, options['days'])
+        counter = {'deals': 0}
+        messages = self.build_messages(opps, today, options['digest'], counter)
+        sent, failed, error = self.deliver(messages, options['workers'], options['batch_size'])
+
+        if failed:
+            # Mã thoát khác 0 để cron/giám sát thấy máy chủ mail lỗi
+            raise CommandError(f"Đã gửi {sent} email, lỗi {failed} email ({counter['deals']} giao dịch). Lỗi đầu tiên: {error}")
+        self.stdout.write(self.style.SUCCESS(f"Đã gửi {sent} email nhắc nhở cho {counter['deals']} giao dịch."))
@@ -0,0 +1,218 @@
+"""
+Metrics trong process (counter + histogram bucket cố định), xuất theo định dạng text của Prometheus.
+
+- Ghi số liệu chỉ là cộng vào dict trong bộ nhớ dưới một Lock (vài micro giây mỗi request).
+- Nhiều worker (gunicorn): đặt METRICS_DIR, mỗi process định kỳ (METRICS_FLUSH_SECONDS)
+  ghi snapshot của mình ra `<METRICS_DIR>/metrics-<pid>.json`; endpoint cộng dồn mọi file.
+  Counter chỉ tăng nên file của worker đã chết vẫn được cộng (như chế độ multiprocess của
+  prometheus_client); xóa thư mục khi khởi động lại dịch vụ.
+- Sau fork, process con bắt đầu lại từ 0 để không cộng trùng số liệu của process cha.
+"""
+import atexit
+import copy
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+DEFAULT_FLUSH_SECONDS = 5
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    def __init__(self, name, documentation, labelnames):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.values = {}
+
+    def copy_empty(self):
+        clone = copy.copy(self)
+        clone.values = {}
+        return clone
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dump(self):
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+    def merge(self, samples):
+        for labels, value in samples:
+            self.inc(tuple(labels), value)
+
+    def render(self):
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        # values: labels -> [số mẫu trong từng bucket (không cộng dồn) + bucket +Inf, tổng giá trị]
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def dump(self):
+        return [[list(labels), counts, total] for labels, (counts, total) in self.values.items()]
+
+    def merge(self, samples):
+        for labels, counts, total in samples:
+            entry = self.values.setdefault(tuple(labels), [[0] * (len(self.buckets) + 1), 0.0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+
+    def render(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else format_value(bound)
+                yield f'{self.name}_bucket{format_labels((*self.labelnames, "le"), (*labels, le))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.flusher = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        # Gọi trong process con ngay sau fork: lock cũ có thể đang bị một luồng của process cha giữ
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.values.clear()
+        self.flusher = None
+
+    # --- ghi (trên đường đi của request) ---
+    def observe_request(self, view, method, status, seconds):
+        with self.lock:
+            REQUESTS.inc((view, method, str(status)))
+            LATENCY.observe((view,), seconds)
+        if self.flusher is None and get_metrics_dir():
+            self.start_flusher()
+
+    # --- gộp giữa các process ---
+    def dump(self):
+        with self.lock:
+            return {name: metric.dump() for name, metric in self.metrics.items()}
+
+    def flush(self):
+        """Ghi snapshot của process này (ghi file tạm rồi os.replace để endpoint không đọc file ghi dở)."""
+        directory = get_metrics_dir()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.dump(), f)
+        os.replace(path, os.path.join(directory, f'metrics-{os.getpid()}.json'))
+
+    def start_flusher(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self.flush_loop, name='metrics-flush', daemon=True)
+        self.flusher.start()
+        # Worker tắt bình thường: ghi nốt số liệu chưa flush
+        atexit.register(self.flush)
+
+    def flush_loop(self):
+        me = threading.current_thread()
+        while self.flusher is me:
+            time.sleep(getattr(settings, 'METRICS_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS))
+            try:
+                self.flush()
+            except OSError:
+                # Lỗi ghi đĩa tạm thời: thử lại ở lượt sau, không dừng luồng flush
+                continue
+
+    def collect(self):
+        """Số liệu đã gộp: của mọi process nếu có METRICS_DIR, nếu không thì của process hiện tại."""
+        directory = get_metrics_dir()
+        if directory:
+            self.flush()
+            snapshots = []
+            for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        else:
+            snapshots = [self.dump()]
+
+        merged = {name: metric.copy_empty() for name, metric in self.metrics.items()}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                if name in merged:
+                    merged[name].merge(samples)
+        return merged.values()
+
+    def render(self):
+        lines = []
+        for metric in self.collect():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+registry = MetricsRegistry()
+os.register_at_fork(after_in_child=registry.reset)
+
+REQUESTS = registry.register(Counter(
+    'http_requests_total', 'Số request theo view, method và mã trạng thái.', ['view', 'method', 'status'],
+))
+LATENCY = registry.register(Histogram(
+    'http_request_duration_seconds', 'Thời gian xử lý request theo view (giây).', ['view'],
+))
+
+
+def view_label(request):
+    """`OpportunityViewSet.list`, `DashboardStatsView`... theo view DRF đã xử lý request."""
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    func = match.func
+    cls = getattr(func, 'cls', None)
+    if cls is None:
+        return match.view_name
+    action = (getattr(func, 'actions', None) or {}).get(request.method.lower())
+    return f'{cls.__name__}.{action}' if action else cls.__name__
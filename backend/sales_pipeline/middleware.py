@@ -0,0 +1,157 @@
+"""
+Đo mỗi request: view, tổng thời gian, số query SQL, thời gian SQL, kích thước response.
+
+Query được đếm qua connection.execute_wrapper (không cần DEBUG=True như connection.queries).
+Kết quả gửi về client trong header Server-Timing và ghi một dòng log JSON vào logger
+`sales_pipeline.requests`. Request chậm hơn REQUEST_METRICS_SLOW_MS được log ở mức WARNING
+kèm REQUEST_METRICS_TOP_QUERIES câu SQL tốn thời gian nhất (đã chuẩn hóa, gộp các câu
+giống nhau) để thấy ngay N+1. Số request và latency theo view được cộng vào
+metrics (sales_pipeline.metrics, endpoint /api/metrics/).
+
+Query chạy trên thread khác của request (Dashboard async) cũng được đếm: code đó lấy
+recorder của request qua `get_query_recorder()` và bọc kết nối của thread bằng `recorder.instrument()`.
+"""
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import registry, view_label
+
+logger = logging.getLogger('sales_pipeline.requests')
+
+DEFAULT_SLOW_MS = 500
+DEFAULT_TOP_QUERIES = 5
+MAX_SQL_LENGTH = 1000
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|%\(\w+\)s')
+_VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+# Recorder của request đang xử lý, None ngoài request (management command...)
+_current_recorder = contextvars.ContextVar('query_recorder', default=None)
+
+
+def normalize_sql(sql):
+    """Bỏ giá trị cụ thể khỏi câu SQL: các query chỉ khác tham số (N+1) thành cùng một câu."""
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _VALUE_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()[:MAX_SQL_LENGTH]
+
+
+class QueryRecorder:
+    """execute_wrapper ghi lại (sql, thời gian) của mọi query; chỉ chuẩn hóa SQL khi cần log."""
+
+    def __init__(self):
+        self.queries = []
+        self.total = 0.0
+        # Nhiều thread của cùng request có thể ghi cùng lúc
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.total += duration
+                self.queries.append((sql, duration))
+
+    def top_queries(self, limit):
+        grouped = defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        for sql, duration in self.queries:
+            entry = grouped[normalize_sql(sql)]
+            entry['count'] += 1
+            entry['total_ms'] += duration * 1000
+            entry['max_ms'] = max(entry['max_ms'], duration * 1000)
+        ranked = sorted(grouped.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:limit]
+        return [
+            {'sql': sql, 'count': entry['count'], 'total_ms': round(entry['total_ms'], 2), 'max_ms': round(entry['max_ms'], 2)}
+            for sql, entry in ranked
+        ]
+
+    def instrument(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+def get_query_recorder():
+    return _current_recorder.get()
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        token = _current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            with recorder.instrument():
+                response = self.get_response(request)
+        finally:
+            _current_recorder.reset(token)
+        elapsed = time.perf_counter() - started
+
+        response['Server-Timing'] = self.server_timing(elapsed, recorder)
+        if response.streaming and not response.is_async:
+            # Response dạng stream (export CSV): query và dữ liệu sinh ra khi server đọc nội dung,
+            # nên header chỉ có phần trước khi stream, còn log ghi khi stream xong
+            response.streaming_content = self.measure_stream(response.streaming_content, request, response, recorder, started)
+        else:
+            self.record(request, response, recorder, elapsed, None if response.streaming else len(response.content))
+        return response
+
+    def measure_stream(self, content, request, response, recorder, started):
+        size = 0
+        try:
+            with recorder.instrument():
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            self.record(request, response, recorder, time.perf_counter() - started, size)
+
+    def server_timing(self, elapsed, recorder):
+        return (
+            f'total;dur={elapsed * 1000:.1f}, '
+            f'db;dur={recorder.total * 1000:.1f};desc="{len(recorder.queries)} queries", '
+            # Query song song trên nhiều thread: tổng thời gian SQL có thể lớn hơn thời gian request
+            f'app;dur={max(elapsed - recorder.total, 0) * 1000:.1f}'
+        )
+
+    def record(self, request, response, recorder, elapsed, size):
+        registry.observe_request(view_label(request), request.method, response.status_code, elapsed)
+        match = request.resolver_match
+        metrics = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'db_queries': len(recorder.queries),
+            'db_ms': round(recorder.total * 1000, 2),
+            'response_bytes': size,
+        }
+        slow_ms = getattr(settings, 'REQUEST_METRICS_SLOW_MS', DEFAULT_SLOW_MS)
+        if slow_ms is not None and metrics['duration_ms'] >= slow_ms:
+            metrics['slow'] = True
+            metrics['top_queries'] = recorder.top_queries(getattr(settings, 'REQUEST_METRICS_TOP_QUERIES', DEFAULT_TOP_QUERIES))
+            logger.warning(json.dumps(metrics, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(metrics, ensure_ascii=False))
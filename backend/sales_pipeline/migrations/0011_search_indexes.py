@@ -0,0 +1,57 @@
+from django.db import migrations
+
+EXTENSIONS = ('pg_trgm', 'unaccent')
+
+# unaccent() chỉ là STABLE (phụ thuộc search_path) nên không dùng được trong index;
+# gói lại với dictionary chỉ định rõ để khai báo IMMUTABLE.
+CREATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text
+AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+"""
+
+INDEXES = {
+    'customer_name_trgm_idx': "sales_pipeline_customer USING gin (immutable_unaccent(lower(name)) gin_trgm_ops)",
+    'customer_name_fts_idx': "sales_pipeline_customer USING gin (to_tsvector('simple'::regconfig, immutable_unaccent(lower(name))))",
+    'customer_email_trgm_idx': "sales_pipeline_customer USING gin (lower(email) gin_trgm_ops)",
+    'customer_phone_trgm_idx': "sales_pipeline_customer USING gin (phone gin_trgm_ops)",
+    'opportunity_title_trgm_idx': "sales_pipeline_opportunity USING gin (immutable_unaccent(lower(title)) gin_trgm_ops)",
+    'opportunity_title_fts_idx': "sales_pipeline_opportunity USING gin (to_tsvector('simple'::regconfig, immutable_unaccent(lower(title))))",
+}
+
+
+def create_search_objects(apps, schema_editor):
+    """
+    Chỉ chạy trên PostgreSQL có sẵn pg_trgm và unaccent (gói contrib).
+    Nếu thiếu, bỏ qua: sales_pipeline/search.py sẽ quay về icontains.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_available_extensions WHERE name = ANY(%s)", [list(EXTENSIONS)])
+        if cursor.fetchone()[0] < len(EXTENSIONS):
+            return
+    for extension in EXTENSIONS:
+        schema_editor.execute(f"CREATE EXTENSION IF NOT EXISTS {extension} SCHEMA public")
+    schema_editor.execute(CREATE_FUNCTION)
+    for name, definition in INDEXES.items():
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+def drop_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+    schema_editor.execute("DROP FUNCTION IF EXISTS immutable_unaccent(text)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_pipeline', '0010_customer_email_lower_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_objects, drop_search_objects),
+    ]
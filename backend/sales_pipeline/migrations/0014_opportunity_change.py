@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_pipeline', '0013_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpportunityChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=50, verbose_name='Trường')),
+                ('old_value', models.TextField(blank=True, null=True, verbose_name='Giá trị cũ')),
+                ('new_value', models.TextField(blank=True, null=True, verbose_name='Giá trị mới')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('opportunity', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='changes', to='sales_pipeline.opportunity')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['opportunity', 'created_at', 'id'], name='oppchange_opp_created_idx'), models.Index(fields=['created_at', 'id'], name='oppchange_created_idx')],
+            },
+        ),
+    ]
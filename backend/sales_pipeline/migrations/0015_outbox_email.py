@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:50
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_pipeline', '0014_opportunity_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.TextField(verbose_name='Tiêu đề')),
+                ('body', models.TextField(verbose_name='Nội dung')),
+                ('from_email', models.CharField(blank=True, max_length=254, null=True)),
+                ('recipients', models.JSONField(verbose_name='Người nhận')),
+                ('status', models.CharField(choices=[('PENDING', 'Chờ gửi'), ('SENT', 'Đã gửi'), ('DEAD', 'Gửi lỗi (bỏ qua)')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Số lần thử')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Thử lại lúc')),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'PENDING')), fields=['next_attempt_at', 'id'], name='outbox_pending_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_pipeline', '0016_table_version'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outboxemail',
+            name='outbox_pending_due_idx',
+        ),
+        migrations.AlterField(
+            model_name='outboxemail',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Chờ gửi'), ('SENDING', 'Đang gửi'), ('SENT', 'Đã gửi'), ('DEAD', 'Gửi lỗi (bỏ qua)')], default='PENDING', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(condition=models.Q(('status__in', ['PENDING', 'SENDING'])), fields=['next_attempt_at', 'id'], name='outbox_due_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales_pipeline', '0017_outbox_sending'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='opportunity',
+            index=models.Index(fields=['stage', 'created_at', 'id'], name='opp_stage_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='opportunity',
+            index=models.Index(fields=['owner', 'stage', 'created_at', 'id'], name='opp_owner_stage_created_idx'),
+        ),
+    ]
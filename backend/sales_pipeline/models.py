@@ -1,7 +1,7 @@
 from django.db import models
-
-from django.db import models
+from django.db.models.functions import Lower
 from django.conf import settings
+from django.utils import timezone
 
 # 1. Bảng Khách hàng
 class Customer(models.Model):
@@ -10,6 +10,14 @@ class Customer(models.Model):
     phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Tra cứu email không phân biệt hoa thường khi import theo lô
+            models.Index(Lower('email'), name='customer_email_lower_idx'),
+            # Phân trang keyset (?pagination=cursor) theo mới nhất
+            models.Index(fields=['created_at', 'id'], name='customer_created_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -62,7 +70,22 @@ class Opportunity(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+
+    class Meta:
+        indexes = [
+            # REP chỉ xem deal của mình + lọc theo trạng thái (danh sách, dashboard)
+            models.Index(fields=['owner', 'status'], name='opp_owner_status_idx'),
+            # Deal sắp đến hạn (dashboard) và send_reminders: chỉ deal đang mở
+            models.Index(fields=['expected_close_date'], condition=models.Q(status='OPEN'), name='opp_open_close_date_idx'),
+            # Biểu đồ doanh số WON theo tháng
+            models.Index(fields=['status', 'updated_at'], name='opp_status_updated_idx'),
+            # Phân trang keyset theo mới nhất: toàn bảng (manager) và theo REP
+            models.Index(fields=['created_at', 'id'], name='opp_created_id_idx'),
+            models.Index(fields=['owner', 'created_at', 'id'], name='opp_owner_created_id_idx'),
+            # Kanban: thẻ mới nhất của từng cột, toàn bảng và theo REP/?owner=
+            models.Index(fields=['stage', 'created_at', 'id'], name='opp_stage_created_id_idx'),
+            models.Index(fields=['owner', 'stage', 'created_at', 'id'], name='opp_owner_stage_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.value}"
@@ -83,6 +106,12 @@ class Activity(models.Model):
 
     class Meta:
         ordering = ['-created_at'] # Mới nhất lên đầu
+        indexes = [
+            # Timeline hoạt động của một deal, mới nhất trước
+            models.Index(fields=['opportunity', '-created_at'], name='activity_opp_created_idx'),
+            # Phân trang keyset toàn bộ hoạt động theo mới nhất
+            models.Index(fields=['created_at', 'id'], name='activity_created_id_idx'),
+        ]
 
         
 
@@ -104,6 +133,12 @@ class Task(models.Model):
 
     class Meta:
         ordering = ['due_date'] # Sắp xếp việc nào gấp làm trước
+        indexes = [
+            # "Việc của tôi" chưa hoàn thành, gấp trước
+            models.Index(fields=['assigned_to', 'is_completed', 'due_date'], name='task_assignee_open_due_idx'),
+            # Phân trang keyset danh sách task của tôi (due_date, id)
+            models.Index(fields=['assigned_to', 'due_date', 'id'], name='task_assignee_due_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -134,4 +169,74 @@ class OpportunityItem(models.Model):
         return self.quantity * self.unit_price
 
     def __str__(self):
-        return f"{self.opportunity.title} - {self.product.name}"
\ No newline at end of file
+        return f"{self.opportunity.title} - {self.product.name}"
+
+
+# 8. Lịch sử thay đổi Deal: mỗi trường thay đổi một dòng, chỉ ghi thêm
+class OpportunityChange(models.Model):
+    # Không ràng buộc FK ở DB để lịch sử còn lại sau khi deal bị xóa
+    opportunity = models.ForeignKey(Opportunity, on_delete=models.DO_NOTHING, db_constraint=False, related_name='changes')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    field = models.CharField(max_length=50, verbose_name="Trường")
+    old_value = models.TextField(null=True, blank=True, verbose_name="Giá trị cũ")
+    new_value = models.TextField(null=True, blank=True, verbose_name="Giá trị mới")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Lịch sử của một deal và toàn hệ thống, phân trang keyset (created_at, id)
+            models.Index(fields=['opportunity', 'created_at', 'id'], name='oppchange_opp_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='oppchange_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Lịch sử thay đổi chỉ được ghi thêm, không sửa")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Lịch sử thay đổi chỉ được ghi thêm, không xóa")
+
+    def __str__(self):
+        return f"{self.opportunity_id} {self.field}: {self.old_value} -> {self.new_value}"
+
+
+# 9. Hàng đợi email (outbox): request chỉ ghi vào bảng, lệnh run_mail_worker gửi đi
+class OutboxEmail(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Chờ gửi'
+        SENDING = 'SENDING', 'Đang gửi'
+        SENT = 'SENT', 'Đã gửi'
+        DEAD = 'DEAD', 'Gửi lỗi (bỏ qua)'
+
+    subject = models.TextField(verbose_name="Tiêu đề")
+    body = models.TextField(verbose_name="Nội dung")
+    from_email = models.CharField(max_length=254, blank=True, null=True)
+    recipients = models.JSONField(verbose_name="Người nhận")
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Số lần thử")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Thử lại lúc")
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Worker lấy thư đến hạn gửi (hoặc đang gửi nhưng quá hạn nhận) theo thứ tự
+            models.Index(fields=['next_attempt_at', 'id'], condition=models.Q(status__in=['PENDING', 'SENDING']), name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"[{self.status}] {self.subject}"
+
+
+# 10. Phiên bản dữ liệu tham chiếu (giai đoạn, sản phẩm, nhân viên): tăng mỗi lần ghi, dùng làm ETag
+class TableVersion(models.Model):
+    table = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
@@ -0,0 +1,123 @@
+"""
+Hàng đợi email trong DB (OutboxEmail).
+
+Request chỉ gọi `enqueue_mail` (một INSERT, cùng transaction với dữ liệu vừa
+tạo) thay vì send_mail đồng bộ. Lệnh `run_mail_worker` dùng `MailDelivery.deliver_batch`
+để gửi theo lô qua một kết nối SMTP dùng lại; gửi lỗi thì thử lại với thời
+gian chờ tăng dần (backoff), quá số lần thử thì chuyển sang DEAD.
+
+Không giữ transaction/khóa dòng trong lúc chờ SMTP: worker nhận lô trong một transaction
+ngắn (chuyển sang SENDING, hạn nhận tới next_attempt_at = now + lease), gửi ngoài transaction,
+rồi ghi kết quả trong một transaction ngắn khác. Worker chết giữa chừng (hoặc ghi kết quả lỗi)
+thì thư SENDING quá hạn được nhận lại và gửi lại (ít nhất một lần), không bị kẹt.
+"""
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 5
+# Chờ 1, 2, 4, 8... phút giữa các lần thử
+DEFAULT_BACKOFF_SECONDS = 60
+# Thời gian một worker giữ lô đã nhận; phải dài hơn thời gian gửi cả lô
+DEFAULT_LEASE_SECONDS = 15 * 60
+
+
+def enqueue_mail(subject, message, recipient_list, from_email=None):
+    recipients = [address for address in recipient_list if address]
+    if not recipients:
+        return None
+    return OutboxEmail.objects.create(subject=subject, body=message, from_email=from_email, recipients=recipients)
+
+
+def retry_delay(attempts, backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+    return timedelta(seconds=backoff_seconds * 2 ** (attempts - 1))
+
+
+class MailDelivery:
+    """Giữ một kết nối email mở cho nhiều lô, mở lại khi bị ngắt."""
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_seconds=DEFAULT_BACKOFF_SECONDS, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.connection = None
+
+    def open(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def send(self, outbox_email):
+        message = EmailMessage(
+            subject=outbox_email.subject, body=outbox_email.body,
+            from_email=outbox_email.from_email, to=outbox_email.recipients,
+            connection=self.open(),
+        )
+        message.send()
+
+    def claim(self, batch_size):
+        """Nhận tối đa batch_size thư đến hạn (hoặc SENDING quá hạn nhận) trong một transaction ngắn."""
+        now = timezone.now()
+        with transaction.atomic():
+            # SKIP LOCKED: nhiều worker chạy song song không nhận trùng lô
+            batch = list(
+                OutboxEmail.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=OutboxEmail.Status.PENDING) | Q(status=OutboxEmail.Status.SENDING), next_attempt_at__lte=now)
+                .order_by('next_attempt_at', 'id')[:batch_size]
+            )
+            lease_until = now + timedelta(seconds=self.lease_seconds)
+            OutboxEmail.objects.filter(pk__in=[outbox_email.pk for outbox_email in batch]).update(
+                status=OutboxEmail.Status.SENDING, next_attempt_at=lease_until,
+            )
+        for outbox_email in batch:
+            outbox_email.status, outbox_email.next_attempt_at = OutboxEmail.Status.SENDING, lease_until
+        return batch
+
+    def record(self, sent, failed):
+        with transaction.atomic():
+            OutboxEmail.objects.filter(pk__in=sent).update(
+                status=OutboxEmail.Status.SENT, sent_at=timezone.now(), last_error=None,
+            )
+            OutboxEmail.objects.bulk_update(failed, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    def deliver_batch(self, batch_size=DEFAULT_BATCH_SIZE):
+        """Gửi tối đa batch_size thư đến hạn. Trả về (số đã gửi, số lỗi)."""
+        batch = self.claim(batch_size)
+        if not batch:
+            return 0, 0
+
+        sent, failed = [], []
+        for outbox_email in batch:
+            try:
+                self.send(outbox_email)
+            except Exception as e:
+                # Kết nối có thể đã hỏng: thư sau sẽ mở kết nối mới
+                self.close()
+                outbox_email.attempts += 1
+                outbox_email.last_error = f"{type(e).__name__}: {e}"
+                if outbox_email.attempts >= self.max_attempts:
+                    outbox_email.status = OutboxEmail.Status.DEAD
+                else:
+                    outbox_email.status = OutboxEmail.Status.PENDING
+                    outbox_email.next_attempt_at = timezone.now() + retry_delay(outbox_email.attempts, self.backoff_seconds)
+                failed.append(outbox_email)
+            else:
+                sent.append(outbox_email.pk)
+
+        self.record(sent, failed)
+        return len(sent), len(failed)
@@ -0,0 +1,129 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Số dòng ước lượng của planner (EXPLAIN), không chạy COUNT(*). None nếu không phải PostgreSQL."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Phân trang keyset (cursor) theo `ordering` của view (hoặc Meta.ordering của model) + id:
+    trang sau lọc "sau dòng cuối trang trước" thay vì OFFSET, không chạy COUNT(*),
+    nên trang thứ N tốn như trang đầu và không bị trùng/sót dòng khi có dữ liệu mới chèn vào.
+    ?count=approx để trả kèm tổng số ước lượng từ thống kê của planner.
+    """
+    cursor_query_param = 'cursor'
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def get_ordering(self, view, queryset):
+        ordering = list(getattr(view, 'ordering', None) or queryset.model._meta.ordering or ['-id'])
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            # Khóa phụ cùng chiều với trường đầu tiên để (trường, id) dùng chung một index
+            ordering.append('-id' if ordering[0].startswith('-') else 'id')
+        return ordering
+
+    def encode_cursor(self, obj):
+        position = [self.fields[name].value_to_string(obj) for name, _ in self.keys]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return [self.fields[name].to_python(value) for (name, _), value in zip(self.keys, position, strict=True)]
+        except (ValueError, TypeError, DjangoValidationError):
+            raise ParseError({"error": "Cursor không hợp lệ"})
+
+    def filter_after(self, queryset, position):
+        """
+        (k1, k2, ...) đứng sau position theo thứ tự đã chọn:
+        k1 >= v1 AND (k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...).
+        Điều kiện đầu là khoảng trên trường dẫn đầu của index nên planner bắt đầu quét đúng chỗ.
+        """
+        (first, first_desc), first_value = self.keys[0], position[0]
+        queryset = queryset.filter(**{f"{first}__{'lte' if first_desc else 'gte'}": first_value})
+        condition = None
+        for i, ((name, desc), value) in enumerate(zip(self.keys, position)):
+            clause = {f"{name}__{'lt' if desc else 'gt'}": value}
+            clause.update({prev: prev_value for (prev, _), prev_value in zip(self.keys[:i], position[:i])})
+            q = Q(**clause)
+            condition = q if condition is None else condition | q
+        return queryset.filter(condition)
+
+    def prepare(self, queryset, view):
+        """Chọn thứ tự và các khóa của cursor; trả về ordering để order_by()."""
+        ordering = self.get_ordering(view, queryset)
+        self.keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        self.keys = [('id' if name == 'pk' else name, desc) for name, desc in self.keys]
+        self.fields = {name: queryset.model._meta.get_field(name) for name, _ in self.keys}
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = self.prepare(queryset, view)
+
+        self.count = estimate_count(queryset) if request.query_params.get('count') == 'approx' else None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = self.filter_after(queryset, self.decode_cursor(cursor))
+
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        self.next_cursor = self.encode_cursor(rows[self.page_size - 1]) if len(rows) > self.page_size else None
+        return rows[:self.page_size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        payload = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return Response(payload)
+
+
+class FlexiblePagination(PageNumberPagination):
+    page_size = 10                  # Mặc định là 10
+    page_size_query_param = 'page_size' # Cho phép client chỉnh qua ?page_size=...
+    max_page_size = 1000            # Giới hạn tối đa 1000
+
+    # ?pagination=cursor (hoặc có ?cursor=...) để dùng phân trang keyset thay cho số trang
+    mode_query_param = 'pagination'
+
+    def use_keyset(self, request):
+        return request.query_params.get(self.mode_query_param) == 'cursor' or KeysetPagination.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = KeysetPagination(self.get_page_size(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class KeysetOnlyPagination(FlexiblePagination):
+    """Luôn phân trang keyset: cho các bảng chỉ ghi thêm, rất lớn (không OFFSET, không COUNT)."""
+
+    def use_keyset(self, request):
+        return True
@@ -0,0 +1,147 @@
+"""
+Đọc từ bản sao (read replica) cho các request chỉ đọc nặng: Dashboard, xuất CSV, các API danh sách.
+
+- DATABASE_REPLICAS: các alias trong DATABASES là bản sao chỉ đọc (rỗng: mọi query vào 'default').
+- View chọn alias một lần cho cả request (ReplicaReadMixin, sau khi xác thực) rồi dùng .using(alias):
+  vẫn đúng khi query chạy sau khi view trả về (export stream) hoặc trên thread khác (Dashboard async).
+- ReplicaRouter đưa mọi thao tác ghi về 'default', kể cả object đọc từ bản sao.
+- Read-your-writes: request có ghi DB thì user được ghim vào 'default' READ_YOUR_WRITES_SECONDS giây
+  (khóa trong cache, dùng chung giữa các process khi cache dùng chung), để không đọc phải bản sao chưa kịp đồng bộ.
+- Bản sao không kết nối được thì bị bỏ qua REPLICA_RETRY_SECONDS giây, request đọc từ 'default'.
+"""
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULT_PIN_SECONDS = 5
+DEFAULT_RETRY_SECONDS = 30
+
+
+class RequestState:
+    def __init__(self):
+        self.wrote = False
+
+
+# Trạng thái của request đang xử lý (ReplicaPinMiddleware đặt), None ngoài request (management command...)
+_request_state = contextvars.ContextVar('replica_request_state', default=None)
+# alias -> time.monotonic() được thử kết nối lại
+_unavailable = {}
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_pin_cache():
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE_ALIAS', 'default')]
+
+
+def pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    get_pin_cache().set(pin_key(user_id), True, getattr(settings, 'READ_YOUR_WRITES_SECONDS', DEFAULT_PIN_SECONDS))
+
+
+def is_pinned(user_id):
+    return bool(get_pin_cache().get(pin_key(user_id)))
+
+
+def replica_available(alias):
+    if _unavailable.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        _unavailable[alias] = time.monotonic() + getattr(settings, 'REPLICA_RETRY_SECONDS', DEFAULT_RETRY_SECONDS)
+        return False
+    return True
+
+
+def read_db(request):
+    """
+    Alias cho các query chỉ đọc của request: một bản sao còn kết nối được; 'default' nếu không có bản sao,
+    request không phải GET/HEAD/OPTIONS, request đã ghi DB hoặc user vừa ghi dữ liệu gần đây.
+    """
+    replicas = get_replicas()
+    if not replicas or request.method not in SAFE_METHODS:
+        return DEFAULT_DB_ALIAS
+    state = _request_state.get()
+    if state is not None and state.wrote:
+        return DEFAULT_DB_ALIAS
+    user = request.user
+    if user.is_authenticated and is_pinned(user.pk):
+        return DEFAULT_DB_ALIAS
+    for alias in random.sample(replicas, len(replicas)):
+        if replica_available(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """Theo dõi request có ghi DB (qua ReplicaRouter.db_for_write); nếu có thì ghim user vào 'default'."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = RequestState()
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote and get_replicas():
+            # Token (DRF) được xác thực trong view, DRF gán lại request.user khi xác thực xong
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.pk)
+        return response
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Không chọn: object liên quan (prefetch, khóa ngoại) đọc cùng DB với object gốc, còn lại 'default'
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Bản sao nhận schema qua replication
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Cho view DRF: self.read_db là alias cho các query chỉ đọc của request.
+    ViewSet chỉ đọc từ bản sao ở các action trong replica_actions (mặc định: list).
+    """
+    replica_actions = {'list'}
+    read_db = DEFAULT_DB_ALIAS
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        action = getattr(self, 'action', None)
+        if action is None or action in self.replica_actions:
+            self.read_db = read_db(request)
+
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset).using(self.read_db)
@@ -0,0 +1,109 @@
+"""
+Tìm kiếm khách hàng / cơ hội cho tham số `?search=`.
+
+Trên PostgreSQL có pg_trgm + unaccent (migration 0011):
+- LIKE '%...%' trên immutable_unaccent(lower(cột)) dùng index GIN trigram,
+  khớp một phần và không phân biệt dấu ("nguyen" khớp "Nguyễn");
+- to_tsvector('simple', ...) @@ websearch_to_tsquery(...) dùng index GIN full-text,
+  khớp các từ không cần liền nhau / đúng thứ tự;
+- kết quả xếp hạng theo ts_rank + độ tương đồng trigram (chỉ SEARCH_RANK_LIMIT kết quả mới nhất).
+Gọi sau khi đã áp các bộ lọc khác của danh sách: phần giới hạn xếp hạng tính trên kết quả đã lọc.
+Nếu DB không có các đối tượng này (SQLite, chưa cài extension) thì quay về icontains.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import Case, F, FloatField, Func, Q, TextField, Value, When
+from django.db.models.functions import Lower
+
+from .models import Customer, Opportunity
+
+# PostgreSQL không có bộ tách từ tiếng Việt, dùng 'simple' (không stemming)
+SEARCH_CONFIG = 'simple'
+# Chỉ xếp hạng chừng này kết quả mới nhất, phần còn lại (cũ hơn) sắp theo mới nhất: với từ khóa quá chung,
+# tính ts_rank/word_similarity cho hàng trăm nghìn dòng tốn vài giây mà thứ hạng cũng vô nghĩa.
+SEARCH_RANK_LIMIT = 5000
+
+_backend_available = {}
+
+
+class ImmutableUnaccent(Func):
+    """Hàm SQL tạo trong migration 0011 (unaccent() gốc không IMMUTABLE nên không index được)."""
+    function = 'immutable_unaccent'
+    output_field = TextField()
+
+
+class SimpleTsVector(Func):
+    """Phải trùng biểu thức của index *_fts_idx trong migration 0011."""
+    template = "to_tsvector('simple'::regconfig, %(expressions)s)"
+    output_field = SearchVectorField()
+
+
+def normalized(expression):
+    return ImmutableUnaccent(Lower(expression))
+
+
+def search_backend_available(using='default'):
+    """Kiểm tra (một lần cho mỗi DB) xem migration 0011 đã tạo hàm immutable_unaccent chưa."""
+    if using not in _backend_available:
+        connection = connections[using]
+        available = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT to_regproc('immutable_unaccent') IS NOT NULL")
+                available = cursor.fetchone()[0]
+        _backend_available[using] = available
+    return _backend_available[using]
+
+
+def _matching(queryset, text_field, query, extra_filter=Q()):
+    term = normalized(Value(query))
+    ts_query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.annotate(
+        search_text=normalized(text_field),
+        search_document=SimpleTsVector(normalized(text_field)),
+    ).filter(
+        Q(search_text__contains=term) | Q(search_document=ts_query) | extra_filter
+    )
+
+
+def _ranked(queryset, query):
+    # Cùng một câu SQL: subquery LIMIT lấy SEARCH_RANK_LIMIT id khớp mới nhất (PostgreSQL băm một lần),
+    # chỉ các dòng đó mới tính rank
+    newest = queryset.order_by('-id').values('id')[:SEARCH_RANK_LIMIT]
+    term = normalized(Value(query))
+    ts_query = SearchQuery(term, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.annotate(
+        rank=Case(
+            When(id__in=newest, then=SearchRank(F('search_document'), ts_query) + TrigramWordSimilarity(term, 'search_text')),
+            default=Value(-1.0),
+            output_field=FloatField(),
+        ),
+    ).order_by('-rank', '-id')
+
+
+def search_customers(queryset, query):
+    if not search_backend_available(queryset.db):
+        return queryset.filter(Q(name__icontains=query) | Q(email__icontains=query) | Q(phone__icontains=query))
+
+    queryset = _matching(
+        queryset.annotate(email_lower=Lower('email')), 'name', query,
+        Q(email_lower__contains=Lower(Value(query))) | Q(phone__contains=query),
+    )
+    return _ranked(queryset, query)
+
+
+def search_opportunities(queryset, query):
+    if not search_backend_available(queryset.db):
+        return queryset.filter(Q(title__icontains=query) | Q(customer__name__icontains=query))
+
+    # "tên deal khớp" UNION "khách hàng khớp tên": mỗi nhánh dùng index riêng
+    # (OR trực tiếp với subquery khiến PostgreSQL phải quét cả bảng).
+    matching_customers = _matching(Customer.objects.all(), 'name', query).values('id')
+    matching_ids = _matching(Opportunity.objects.all(), 'title', query).values('id').union(
+        Opportunity.objects.filter(customer_id__in=matching_customers).values('id'), all=True,
+    )
+    queryset = queryset.annotate(
+        search_text=normalized('title'),
+        search_document=SimpleTsVector(normalized('title')),
+    ).filter(id__in=matching_ids)
+    return _ranked(queryset, query)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Customer, PipelineStage, Opportunity, Activity, Task, Product, OpportunityItem
+from .models import Customer, PipelineStage, Opportunity, Activity, Task, Product, OpportunityItem, OpportunityChange
 from users.models import CustomUser
 
 # 1. Serializer cho User
@@ -34,6 +34,15 @@ class OpportunitySerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['owner', 'created_at', 'updated_at']
 
+    def update(self, instance, validated_data):
+        # Chỉ ghi các cột thực sự thay đổi (không đổi gì thì không UPDATE)
+        changed = [attr for attr, value in validated_data.items() if getattr(instance, attr) != value]
+        for attr in changed:
+            setattr(instance, attr, validated_data[attr])
+        if changed:
+            instance.save(update_fields=[*changed, 'updated_at'])
+        return instance
+
 # 5. Serializer cho Hoạt động
 class ActivitySerializer(serializers.ModelSerializer):
     user_name = serializers.ReadOnlyField(source='user.username')
@@ -66,4 +75,20 @@ class OpportunityItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = OpportunityItem
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+# 9. Một dòng trong API thêm/sửa/xóa hàng loạt dòng sản phẩm của deal
+class OpportunityItemLineSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=False)
+    # Chỉ nhận id, view kiểm tra sản phẩm tồn tại bằng một query cho cả lô
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(default=1)
+    unit_price = serializers.DecimalField(max_digits=15, decimal_places=2)
+
+# 10. Lịch sử thay đổi Deal
+class OpportunityChangeSerializer(serializers.ModelSerializer):
+    user_name = serializers.ReadOnlyField(source='user.username')
+
+    class Meta:
+        model = OpportunityChange
+        fields = ['id', 'opportunity', 'user', 'user_name', 'field', 'old_value', 'new_value', 'created_at']
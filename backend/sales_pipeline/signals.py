@@ -0,0 +1,77 @@
+"""
+Vô hiệu hóa cache Dashboard khi dữ liệu nguồn thay đổi.
+
+Việc vô hiệu hóa chạy sau khi transaction commit, để một request khác không
+kịp tính lại (và cache) dữ liệu cũ trước khi thay đổi được ghi xuống DB.
+Các thao tác bỏ qua signal (queryset.update, bulk_create) phải tự gọi các hàm
+invalidate_* trong sales_pipeline/dashboard.py.
+
+Ghi vào dữ liệu tham chiếu (giai đoạn, sản phẩm, nhân viên) tăng phiên bản bảng
+(ETag của các API list, xem sales_pipeline/versioning.py) trong cùng transaction.
+"""
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from users.models import CustomUser
+from users.serializers import UserSerializer
+
+from . import dashboard, versioning
+from .models import Customer, Opportunity, PipelineStage, Product, Task
+
+# Chỉ các trường hiển thị trong danh sách mới làm đổi phiên bản (không tính last_login khi đăng nhập)
+VERSIONED_FIELDS = {CustomUser: set(UserSerializer.Meta.fields)}
+
+
+@receiver(post_init, sender=Opportunity)
+def remember_opportunity_state(sender, instance, **kwargs):
+    # Lưu giá trị lúc load để biết owner/tên deal cũ khi lưu.
+    # Trường bị defer (only(), refresh_from_db(fields=...)) không có trong __dict__: bỏ qua, không query thêm.
+    if 'owner_id' in instance.__dict__:
+        instance._dashboard_owner_id = instance.owner_id
+    if 'title' in instance.__dict__:
+        instance._dashboard_title = instance.title
+
+
+@receiver(post_init, sender=Task)
+def remember_task_state(sender, instance, **kwargs):
+    if 'assigned_to_id' in instance.__dict__:
+        instance._dashboard_assigned_to_id = instance.assigned_to_id
+
+
+@receiver([post_save, post_delete], sender=Opportunity)
+def invalidate_opportunity(sender, instance, **kwargs):
+    owner_ids = [instance.owner_id, getattr(instance, '_dashboard_owner_id', None)]
+    title_changed = kwargs.get('created') is False and instance.title != getattr(instance, '_dashboard_title', instance.title)
+
+    def invalidate():
+        dashboard.invalidate_opportunity_owners(owner_ids)
+        if title_changed:
+            # "Việc của tôi" hiển thị tên deal
+            dashboard.invalidate_tasks(Task.objects.filter(opportunity_id=instance.pk).values_list('assigned_to_id', flat=True))
+
+    transaction.on_commit(invalidate)
+    instance._dashboard_owner_id = instance.owner_id
+    instance._dashboard_title = instance.title
+
+
+@receiver([post_save, post_delete], sender=Task)
+def invalidate_task(sender, instance, **kwargs):
+    user_ids = [instance.assigned_to_id, getattr(instance, '_dashboard_assigned_to_id', None)]
+    transaction.on_commit(lambda: dashboard.invalidate_tasks(user_ids))
+    instance._dashboard_assigned_to_id = instance.assigned_to_id
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidate_customer(sender, instance, **kwargs):
+    transaction.on_commit(dashboard.invalidate_new_customers)
+
+
+@receiver([post_save, post_delete], sender=PipelineStage)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=CustomUser)
+def bump_table_version(sender, instance, update_fields=None, **kwargs):
+    tracked = VERSIONED_FIELDS.get(sender)
+    if update_fields and tracked and not tracked & set(update_fields):
+        return
+    versioning.bump(sender)
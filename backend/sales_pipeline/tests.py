@@ -1,3 +1,1333 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import random
+import re
+import tempfile
+from smtplib import SMTPException
+from types import SimpleNamespace
+from datetime import date, timedelta
+from decimal import Decimal
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F, Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APITestCase
+
+from users.models import CustomUser
+from .models import Customer, PipelineStage, Opportunity, Activity, Task, Product, OpportunityItem, OpportunityChange, OutboxEmail
+from . import dashboard, replicas
+from .metrics import registry
+from .middleware import normalize_sql
+from .outbox import MailDelivery, enqueue_mail
+from .search import search_backend_available
+from .views import KanbanBoardView
+from .items import apply_value_deltas, lock_opportunities
+from .management.commands.send_reminders import Command as SendRemindersCommand
+
+
+class QueryBudgetMixin:
+    """Assert a hard ceiling on SQL queries so N+1 regressions fail CI."""
+
+    def assertMaxQueries(self, ceiling, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(
+            len(ctx), ceiling,
+            f"{len(ctx)} queries > budget {ceiling}:\n" + "\n".join(q['sql'] for q in ctx.captured_queries),
+        )
+        return result
+
+
+def seed_pipeline(n, owner):
+    """Tạo n khách hàng / cơ hội (mỗi cơ hội 1 item, 1 activity, 1 task) bằng bulk_create."""
+    stages = [
+        PipelineStage.objects.create(name="Mới", order=1, type='OPEN'),
+        PipelineStage.objects.create(name="Thắng", order=2, type='WON'),
+        PipelineStage.objects.create(name="Thua", order=3, type='LOST'),
+    ]
+    product = Product.objects.create(name="Gói Basic", code=f"SP-{n}", price=100)
+    customers = Customer.objects.bulk_create(
+        [Customer(name=f"Khách hàng {i}", email=f"kh{i}@test.com") for i in range(n)]
+    )
+    opps = Opportunity.objects.bulk_create([
+        Opportunity(
+            title=f"Deal #{i}", value=100, expected_close_date=date.today() + timedelta(days=i % 30),
+            status=stages[i % 3].type, stage=stages[i % 3], owner=owner, customer=customers[i],
+        )
+        for i in range(n)
+    ])
+    OpportunityItem.objects.bulk_create(
+        [OpportunityItem(opportunity=opp, product=product, quantity=1, unit_price=100) for opp in opps]
+    )
+    Activity.objects.bulk_create(
+        [Activity(opportunity=opp, user=owner, type='NOTE', summary="Ghi chú") for opp in opps]
+    )
+    Task.objects.bulk_create(
+        [Task(opportunity=opp, assigned_to=owner, title=f"Gọi lại #{opp.id}", due_date=timezone.now()) for opp in opps]
+    )
+    return opps
+
+
+class EndpointQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    """Số query của mỗi endpoint phải cố định, không tăng theo số dòng."""
+
+    # Trần cho phép (đã gồm SAVEPOINT của test + COUNT của phân trang)
+    LIST_BUDGET = 4
+    DETAIL_BUDGET = 2
+
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+
+    def check_endpoints(self, n):
+        opps = seed_pipeline(n, self.manager)
+        opp = opps[0]
+        for url in [
+            '/api/opportunities/?page_size=1000',
+            '/api/customers/?page_size=1000',
+            f'/api/activities/?opportunity={opp.id}',
+            '/api/activities/',
+            f'/api/tasks/?opportunity={opp.id}',
+            '/api/tasks/',
+            f'/api/opportunity-items/?opportunity={opp.id}',
+            '/api/opportunity-items/',
+            '/api/board/',
+        ]:
+            with self.subTest(url=url, rows=n):
+                response = self.assertMaxQueries(self.LIST_BUDGET, self.client.get, url)
+                self.assertEqual(response.status_code, 200)
+
+        for url in [
+            f'/api/opportunities/{opp.id}/',
+            f'/api/customers/{opp.customer_id}/',
+            f'/api/activities/{opp.activities.first().id}/',
+            f'/api/tasks/{opp.tasks.first().id}/',
+            f'/api/opportunity-items/{opp.items.first().id}/',
+        ]:
+            with self.subTest(url=url, rows=n):
+                response = self.assertMaxQueries(self.DETAIL_BUDGET, self.client.get, url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_query_budget_10_rows(self):
+        self.check_endpoints(10)
+
+    def test_query_budget_100_rows(self):
+        self.check_endpoints(100)
+
+    def test_query_budget_1000_rows(self):
+        self.check_endpoints(1000)
+
+
+class KanbanBoardTests(APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.rep = CustomUser.objects.create_user(username='rep', password='password123', role='REP')
+        self.client.force_authenticate(self.manager)
+        self.opps = seed_pipeline(30, self.manager)
+        self.stages = list(PipelineStage.objects.order_by('order'))
+        # Cùng created_at: thứ tự (và cursor) phải dựa vào khóa phụ id
+        Opportunity.objects.update(created_at=timezone.now())
+        Opportunity.objects.filter(pk=self.opps[0].pk).update(value=250)
+        # Deal #0..#3 của REP: 2 ở cột "Mới", 1 "Thắng", 1 "Thua"
+        Opportunity.objects.filter(pk__in=[opp.pk for opp in self.opps[:4]]).update(owner=self.rep)
+
+    def stage_ids(self, stage, owner=None):
+        queryset = Opportunity.objects.filter(stage=stage).order_by('-id')
+        if owner:
+            queryset = queryset.filter(owner=owner)
+        return list(queryset.values_list('id', flat=True))
+
+    def walk_column(self, column, limit):
+        ids = [card['id'] for card in column['cards']]
+        cursor = column['next_cursor']
+        while cursor:
+            response = self.client.get(f"/api/board/?stage={column['stage']['id']}&cursor={cursor}&limit={limit}")
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['cards']), limit)
+            ids += [card['id'] for card in response.data['cards']]
+            cursor = response.data['next_cursor']
+        return ids
+
+    def test_columns_have_totals_of_whole_stage(self):
+        columns = self.client.get('/api/board/?limit=4').data['columns']
+        self.assertEqual([column['stage']['id'] for column in columns], [stage.id for stage in self.stages])
+        self.assertEqual([column['count'] for column in columns], [10, 10, 10])
+        # Tổng của cả cột, không chỉ các thẻ đang hiển thị
+        self.assertEqual([column['total_value'] for column in columns], [1150, 1000, 1000])
+        for column, stage in zip(columns, self.stages):
+            self.assertEqual([card['id'] for card in column['cards']], self.stage_ids(stage)[:4])
+            self.assertIsNotNone(column['next_cursor'])
+
+    def test_stage_cursor_pages_through_column(self):
+        columns = self.client.get('/api/board/?limit=3').data['columns']
+        for column, stage in zip(columns, self.stages):
+            with self.subTest(stage=stage.name):
+                self.assertEqual(self.walk_column(column, 3), self.stage_ids(stage))
+
+    def test_rep_sees_only_own_deals(self):
+        self.client.force_authenticate(self.rep)
+        columns = self.client.get('/api/board/?limit=1').data['columns']
+        self.assertEqual([column['count'] for column in columns], [2, 1, 1])
+        self.assertEqual([column['total_value'] for column in columns], [350, 100, 100])
+        self.assertTrue(all(card['owner_name'] == 'rep' for column in columns for card in column['cards']))
+        self.assertEqual(self.walk_column(columns[0], 1), self.stage_ids(self.stages[0], self.rep))
+        # Tải thêm một cột cũng chỉ trả deal của REP
+        response = self.client.get(f'/api/board/?stage={self.stages[0].id}&limit=50')
+        self.assertEqual([card['id'] for card in response.data['cards']], self.stage_ids(self.stages[0], self.rep))
+
+    def test_invalid_stage_or_cursor(self):
+        self.assertEqual(self.client.get('/api/board/?stage=abc').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/board/?stage={self.stages[0].id}&cursor=hong').status_code, 400)
+
+
+class DashboardStatsTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        caches['dashboard'].clear()
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+
+    def test_dashboard_kpis_and_series(self):
+        seed_pipeline(30, self.manager)
+        Opportunity.objects.filter(status='LOST').update(lost_reason_code='PRICE')
+
+        response = self.assertMaxQueries(5, self.client.get, '/api/dashboard/stats/?months=3')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['open_deals_count'], 10)
+        self.assertEqual(data['expected_revenue'], 2000)
+        self.assertEqual(data['win_rate'], 50.0)
+        self.assertEqual(data['revenue_by_stage'], [{"name": "Mới", "value": 1000}])
+        self.assertEqual(data['lost_reason_data'], [{"name": "Giá quá cao", "value": 10}])
+        self.assertEqual(sum(m['sales'] for m in data['rep_performance']), 1000)
+        self.assertEqual(len(data['upcoming_deals']), 5)
+        self.assertEqual(len(data['my_tasks']), 5)
+
+    def test_cache_hit_and_invalidation(self):
+        rep = CustomUser.objects.create_user(username='sales_a', password='password123', role='REP')
+        opps = seed_pipeline(6, rep)
+
+        self.client.get('/api/dashboard/stats/')
+        response = self.assertMaxQueries(0, self.client.get, '/api/dashboard/stats/')
+        self.assertEqual(response.data['open_deals_count'], 2)
+
+        # Cập nhật deal của REP -> số liệu toàn bảng (manager) và của REP đó bị vô hiệu hóa
+        self.client.force_authenticate(rep)
+        self.client.get('/api/dashboard/stats/')
+        with self.captureOnCommitCallbacks(execute=True):
+            opp = Opportunity.objects.get(pk=opps[1].pk)
+            opp.status = 'OPEN'
+            opp.save()
+        self.assertEqual(self.client.get('/api/dashboard/stats/').data['open_deals_count'], 3)
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.get('/api/dashboard/stats/').data['open_deals_count'], 3)
+
+        # Task và Customer chỉ làm mới phần tương ứng
+        with self.captureOnCommitCallbacks(execute=True):
+            Task.objects.create(opportunity=opp, assigned_to=self.manager, title="Gọi lại", due_date=timezone.now())
+            Customer.objects.create(name="Khách hàng mới")
+        data = self.client.get('/api/dashboard/stats/').data
+        self.assertEqual(len(data['my_tasks']), 1)
+        self.assertEqual(data['new_customers_count'], 7)
+
+        stats = self.client.get('/api/dashboard/cache-stats/').data
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 4)
+
+
+class ExportOpportunityTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_streams_csv_in_constant_queries(self):
+        seed_pipeline(300, self.manager)
+        response = self.client.get('/api/opportunities/export/')
+        body = self.assertMaxQueries(2, self.read, response).decode('utf-8-sig')
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 301)
+        self.assertTrue(lines[0].startswith('ID,Tên Giao dịch'))
+        self.assertIn('Khách hàng 0,100.00', lines[1])
+
+    def test_gzip(self):
+        seed_pipeline(10, self.manager)
+        plain = self.read(self.client.get('/api/opportunities/export/'))
+        response = self.client.get('/api/opportunities/export/?gzip=1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(gzip.decompress(self.read(response)), plain)
+
+
+class RequestMetricsTests(APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        seed_pipeline(5, self.manager)
+
+    def metrics(self, logs):
+        return json.loads(logs.records[-1].getMessage())
+
+    def test_server_timing_header_and_log_line(self):
+        with self.assertLogs('sales_pipeline.requests', 'INFO') as logs:
+            response = self.client.get('/api/opportunities/')
+        metrics = self.metrics(logs)
+        self.assertEqual(logs.records[-1].levelname, 'INFO')
+        self.assertEqual((metrics['view'], metrics['status']), ('opportunity-list', 200))
+        self.assertEqual(metrics['response_bytes'], len(response.content))
+        self.assertGreater(metrics['db_queries'], 0)
+        self.assertIn(f'desc="{metrics["db_queries"]} queries"', response['Server-Timing'])
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;')
+
+    @override_settings(REQUEST_METRICS_SLOW_MS=0, REQUEST_METRICS_TOP_QUERIES=2)
+    def test_slow_request_logs_top_normalized_queries(self):
+        with self.assertLogs('sales_pipeline.requests', 'WARNING') as logs:
+            self.client.get('/api/opportunities/')
+        metrics = self.metrics(logs)
+        self.assertTrue(metrics['slow'])
+        self.assertEqual(len(metrics['top_queries']), 2)
+        self.assertLessEqual(sum(q['count'] for q in metrics['top_queries']), metrics['db_queries'])
+        self.assertNotIn(str(self.manager.pk), ''.join(q['sql'] for q in metrics['top_queries']).replace('?', ''))
+
+    def test_streaming_response_logged_after_body(self):
+        with self.assertLogs('sales_pipeline.requests', 'INFO') as logs:
+            response = self.client.get('/api/opportunities/export/')
+            self.assertEqual(logs.records, [])
+            body = b''.join(response.streaming_content)
+        metrics = self.metrics(logs)
+        self.assertEqual(metrics['response_bytes'], len(body))
+        self.assertGreaterEqual(metrics['db_queries'], 1)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql('SELECT "t"."id" FROM "t"  WHERE "t"."id" IN (%s, %s, %s) AND name = \'x\' LIMIT 21'),
+            'SELECT "t"."id" FROM "t" WHERE "t"."id" IN (...) AND name = ? LIMIT ?',
+        )
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        registry.reset()
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+
+    def scrape(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode().splitlines()
+
+    def test_requests_and_latency_per_view(self):
+        self.client.get('/api/opportunities/')
+        self.client.get('/api/opportunities/')
+        self.client.get('/api/opportunities/999999/')
+        self.client.get('/api/dashboard/stats/')
+        lines = self.scrape()
+        self.assertIn('http_requests_total{view="OpportunityViewSet.list",method="GET",status="200"} 2', lines)
+        self.assertIn('http_requests_total{view="OpportunityViewSet.retrieve",method="GET",status="404"} 1', lines)
+        self.assertIn('http_requests_total{view="DashboardStatsView",method="GET",status="200"} 1', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="OpportunityViewSet.list",le="+Inf"} 2', lines)
+        self.assertIn('http_request_duration_seconds_count{view="OpportunityViewSet.list"} 2', lines)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+
+    def test_requires_manager(self):
+        rep = CustomUser.objects.create_user(username='rep', password='password123', role='REP')
+        self.client.force_authenticate(rep)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    @skipUnless(hasattr(os, 'fork'), 'Cần os.fork')
+    def test_aggregates_across_processes(self):
+        with tempfile.TemporaryDirectory() as tmp, override_settings(METRICS_DIR=tmp):
+            registry.observe_request('DashboardStatsView', 'GET', 200, 0.02)
+            pid = os.fork()
+            if pid == 0:
+                # Process con (như một worker gunicorn) bắt đầu từ 0, không mang theo số liệu của cha
+                registry.observe_request('DashboardStatsView', 'GET', 200, 0.3)
+                registry.flush()
+                os._exit(0)
+            os.waitpid(pid, 0)
+            lines = self.scrape()
+        self.assertIn('http_requests_total{view="DashboardStatsView",method="GET",status="200"} 2', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="DashboardStatsView",le="0.025"} 1', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="DashboardStatsView",le="0.5"} 2', lines)
+
+
+class ImportCustomerTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+
+    def upload(self, content, name='customers.csv'):
+        return self.client.post('/api/customers/import/', {'file': SimpleUploadedFile(name, content.encode('utf-8-sig'))})
+
+    def test_import_dedupes_and_reports_errors(self):
+        Customer.objects.create(name="Đã có", email="Old@Test.com")
+        response = self.upload(
+            "Tên Khách hàng,Email,SĐT\n"
+            "Khách A, A@Test.com ,0901\n"
+            "Khách A lặp,a@test.com,0902\n"
+            "Khách cũ,old@test.com,0903\n"
+            ",b@test.com,0904\n"
+            "Khách sai email,not-an-email,0905\n"
+            f"Khách SĐT dài,c@test.com,{'9' * 30}\n"
+            "Khách không email,,0906\n"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], "Đã nhập thành công 2 khách hàng.")
+        self.assertEqual(len(response.data['errors']), 2)
+        self.assertTrue(response.data['errors'][0].startswith("Dòng 6:"))
+        self.assertEqual(Customer.objects.get(name="Khách A").email, "a@test.com")
+        self.assertTrue(Customer.objects.filter(name="Khách không email").exists())
+
+    def test_import_queries_scale_with_batches_not_rows(self):
+        rows = "".join(f"Khách {i},kh{i}@test.com,090{i}\n" for i in range(2500))
+        response = self.assertMaxQueries(30, self.upload, "name,email,phone\n" + rows)
+        self.assertEqual(response.data['message'], "Đã nhập thành công 2500 khách hàng.")
+        self.assertEqual(Customer.objects.count(), 2500)
+
+    def test_rejects_non_csv(self):
+        self.assertEqual(self.upload("x", name='customers.xlsx').status_code, 400)
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        stage = PipelineStage.objects.create(name="Mới", order=1)
+        self.nguyen = Customer.objects.create(name="Công ty Nguyễn Đức", email="contact@nguyenduc.vn", phone="0901234567")
+        self.other = Customer.objects.create(name="Tập đoàn Hòa Phát", email="info@hoaphat.vn")
+        self.deal = Opportunity.objects.create(
+            title="Triển khai CRM", value=100, expected_close_date=date.today(),
+            stage=stage, owner=self.manager, customer=self.nguyen,
+        )
+        Opportunity.objects.create(
+            title="Gói Nguyễn Văn A", value=100, expected_close_date=date.today(),
+            stage=stage, owner=self.manager, customer=self.other,
+        )
+
+    def search(self, url):
+        return [row['id'] for row in self.client.get(url).data['results']]
+
+    def test_search_contract(self):
+        self.assertEqual(self.search('/api/customers/?search=Nguyễn'), [self.nguyen.id])
+        self.assertEqual(self.search('/api/customers/?search=0901'), [self.nguyen.id])
+        self.assertEqual(self.search('/api/customers/?search=hoaphat'), [self.other.id])
+        self.assertEqual(len(self.search('/api/opportunities/?search=Nguyễn')), 2)
+        self.assertEqual(self.search('/api/opportunities/?search=CRM'), [self.deal.id])
+
+    def test_accent_insensitive_and_ranked(self):
+        if not search_backend_available():
+            self.skipTest("Cần PostgreSQL có pg_trgm + unaccent")
+        self.assertEqual(self.search('/api/customers/?search=nguyen duc'), [self.nguyen.id])
+        self.assertEqual(self.search('/api/customers/?search=duc nguyen'), [self.nguyen.id])
+        # Deal có tên khớp trực tiếp xếp trên deal chỉ khớp qua tên khách hàng
+        results = self.search('/api/opportunities/?search=nguyen van')
+        self.assertEqual(results[0], Opportunity.objects.get(title="Gói Nguyễn Văn A").id)
+
+    def test_ranking_decided_in_same_query(self):
+        if not search_backend_available():
+            self.skipTest("Cần PostgreSQL có pg_trgm + unaccent")
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get('/api/opportunities/?status=OPEN')
+        with CaptureQueriesContext(connection) as searched:
+            results = self.search('/api/opportunities/?search=nguyen&status=OPEN')
+        # Không có query dò số kết quả trước khi chọn cách sắp xếp
+        self.assertEqual(len(searched), len(plain))
+        self.assertEqual(len(results), 2)
+
+        # Chỉ xếp hạng kết quả mới nhất (đã lọc); phần còn lại theo mới nhất
+        older = Opportunity.objects.create(
+            title="Nguyễn Văn Nguyễn Văn", value=100, expected_close_date=date.today(),
+            stage=self.deal.stage, owner=self.manager, customer=self.other, status='WON',
+        )
+        Opportunity.objects.filter(pk=older.pk).update(id=0)
+        with mock.patch('sales_pipeline.search.SEARCH_RANK_LIMIT', 1):
+            self.assertEqual(self.search('/api/opportunities/?search=nguyen van&status=WON'), [0])
+            ranked = self.search('/api/opportunities/?search=nguyen van')
+        # "Nguyễn Văn Nguyễn Văn" khớp hơn nhưng cũ hơn, ngoài phần được xếp hạng
+        self.assertEqual(ranked, [Opportunity.objects.get(title="Gói Nguyễn Văn A").id, 0])
+
+
+class OpportunityValueTests(APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        self.opp = seed_pipeline(1, self.manager)[0]
+        self.product = Product.objects.get()
+        self.item = OpportunityItem.objects.get()
+        Opportunity.objects.filter(pk=self.opp.pk).update(value=100)
+
+    def value(self):
+        self.opp.refresh_from_db()
+        return self.opp.value
+
+    def test_item_changes_apply_deltas(self):
+        response = self.client.post('/api/opportunity-items/', {
+            'opportunity': self.opp.id, 'product': self.product.id, 'quantity': 3, 'unit_price': '50.00',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.value(), 250)
+
+        self.client.patch(f'/api/opportunity-items/{self.item.id}/', {'quantity': 2})
+        self.assertEqual(self.value(), 350)
+
+        self.client.delete(f'/api/opportunity-items/{response.data["id"]}/')
+        self.assertEqual(self.value(), 200)
+
+        # Mỗi lần value đổi qua dòng sản phẩm đều có trong lịch sử deal
+        changes = OpportunityChange.objects.filter(opportunity=self.opp, field='value').order_by('id')
+        self.assertEqual(
+            [(c.old_value, c.new_value, c.user_id) for c in changes],
+            [('100.00', '250.00', self.manager.id), ('250.00', '350.00', self.manager.id), ('350.00', '200.00', self.manager.id)],
+        )
+
+    def test_deltas_for_many_deals_in_one_update(self):
+        opps = [self.opp]
+        for i in range(3):
+            opp = Opportunity.objects.create(
+                title=f"Deal {i}", value=100, expected_close_date=date.today(),
+                stage=self.opp.stage, owner=self.manager, customer=self.opp.customer,
+            )
+            OpportunityItem.objects.create(opportunity=opp, product=self.product, quantity=1, unit_price=100)
+            opps.append(opp)
+        deltas = {opp.pk: Decimal(delta) for opp, delta in zip(opps, ['10', '-20.50', '0', '300'])}
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            apply_value_deltas(deltas, lock_opportunities(deltas), self.manager)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "sales_pipeline_opportunity"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(Opportunity.objects.filter(pk__in=deltas).order_by('pk').values_list('value', flat=True)),
+            [Decimal('110'), Decimal('79.50'), Decimal('100'), Decimal('400')],
+        )
+
+    def test_first_line_replaces_manual_value(self):
+        # Deal tạo từ form: value nhập tay, chưa có dòng sản phẩm
+        manual = Opportunity.objects.create(
+            title="Deal nhập tay", value=5000, expected_close_date=date.today(),
+            stage=self.opp.stage, owner=self.manager, customer=self.opp.customer,
+        )
+        response = self.client.post('/api/opportunity-items/', {
+            'opportunity': manual.id, 'product': self.product.id, 'quantity': 1, 'unit_price': '200.00',
+        })
+        self.assertEqual(response.status_code, 201)
+        manual.refresh_from_db()
+        self.assertEqual(manual.value, 200)
+        # Các dòng sau cộng chênh lệch như bình thường
+        self.client.post('/api/opportunity-items/', {
+            'opportunity': manual.id, 'product': self.product.id, 'quantity': 2, 'unit_price': '50.00',
+        })
+        manual.refresh_from_db()
+        self.assertEqual(manual.value, 300)
+        out = io.StringIO()
+        call_command('reconcile_opportunity_values', stdout=out)
+        self.assertIn('Không có deal nào bị lệch', out.getvalue())
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        Opportunity.objects.filter(pk=self.opp.pk).update(value=999)
+        out = io.StringIO()
+        call_command('reconcile_opportunity_values', stdout=out)
+        self.assertIn('1 deal bị lệch', out.getvalue())
+        self.assertEqual(self.value(), 999)
+
+        call_command('reconcile_opportunity_values', '--fix', stdout=io.StringIO())
+        self.assertEqual(self.value(), 100)
+        change = OpportunityChange.objects.get(opportunity=self.opp, field='value')
+        self.assertEqual((change.old_value, change.new_value, change.user), ('999.00', '100.00', None))
+        out = io.StringIO()
+        call_command('reconcile_opportunity_values', stdout=out)
+        self.assertIn('Không có deal nào bị lệch', out.getvalue())
+
+
+class ReconcileValuesTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.opps = seed_pipeline(7, self.manager)
+
+    def reconcile(self, chunk_size=2):
+        with mock.patch('sales_pipeline.items.RECOMPUTE_CHUNK_SIZE', chunk_size), CaptureQueriesContext(connection) as queries:
+            call_command('reconcile_opportunity_values', '--fix', stdout=io.StringIO())
+        return [q['sql'] for q in queries]
+
+    def test_update_filters_by_drift_subquery(self):
+        drifted = self.opps[:5]
+        Opportunity.objects.filter(pk__in=[opp.pk for opp in drifted]).update(value=F('value') + 1)
+        queries = self.reconcile()
+        updates = [sql for sql in queries if sql.startswith('UPDATE "sales_pipeline_opportunity"')]
+        self.assertEqual(len(updates), 1)
+        # Không có danh sách id deal trong câu UPDATE
+        self.assertIn('SELECT', updates[0])
+        self.assertNotIn(f'IN ({drifted[0].pk}, {drifted[1].pk}', updates[0])
+        self.assertEqual(set(Opportunity.objects.values_list('value', flat=True)), {100})
+        # Lịch sử ghi theo lô 2 deal
+        self.assertEqual(sum(sql.startswith('INSERT INTO "sales_pipeline_opportunitychange"') for sql in queries), 3)
+        self.assertEqual(
+            sorted(OpportunityChange.objects.filter(field='value').values_list('opportunity_id', 'old_value', 'new_value')),
+            [(opp.pk, '101.00', '100.00') for opp in drifted],
+        )
+
+    def test_query_count_does_not_grow_with_drift(self):
+        Opportunity.objects.filter(pk=self.opps[0].pk).update(value=1)
+        few = len(self.reconcile(100))
+        Opportunity.objects.update(value=1)
+        self.assertEqual(len(self.reconcile(100)), few)
+
+
+class BulkItemsTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        self.opp = seed_pipeline(1, self.manager)[0]
+        self.product = Product.objects.get()
+        self.item = OpportunityItem.objects.get()
+        Opportunity.objects.filter(pk=self.opp.pk).update(value=100)
+        self.url = f'/api/opportunities/{self.opp.id}/items/bulk/'
+
+    def test_create_update_delete_in_one_request(self):
+        extra = OpportunityItem.objects.create(opportunity=self.opp, product=self.product, quantity=1, unit_price=30)
+        Opportunity.objects.filter(pk=self.opp.pk).update(value=130)
+        response = self.client.post(self.url, {
+            'create': [{'product': self.product.id, 'quantity': 2, 'unit_price': '10.00'}],
+            'update': [{'id': self.item.id, 'quantity': 3}],
+            'delete': [extra.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['value'], 320)
+        self.assertEqual(len(response.data['items']), 2)
+        self.opp.refresh_from_db()
+        self.assertEqual(self.opp.value, 320)
+
+    def test_first_lines_replace_manual_value(self):
+        OpportunityItem.objects.all().delete()
+        Opportunity.objects.filter(pk=self.opp.pk).update(value=5000)
+        response = self.client.post(self.url, {
+            'create': [{'product': self.product.id, 'quantity': 1, 'unit_price': '200.00'},
+                       {'product': self.product.id, 'quantity': 2, 'unit_price': '10.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['value'], 220)
+
+    def test_invalid_lines_write_nothing(self):
+        response = self.client.post(self.url, {
+            'create': [{'product': self.product.id, 'unit_price': '10.00'}, {'product': 999999, 'unit_price': '1'}],
+            'update': [{'id': self.item.id, 'quantity': 'x'}],
+            'delete': [self.item.id, 123456],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            sorted((e['op'], e['index']) for e in response.data['errors']),
+            [('create', 1), ('delete', 1), ('update', 0)],
+        )
+        self.assertEqual(OpportunityItem.objects.count(), 1)
+        self.opp.refresh_from_db()
+        self.assertEqual(self.opp.value, 100)
+
+    def test_queries_do_not_scale_with_lines(self):
+        for n in (10, 200):
+            with self.subTest(lines=n):
+                lines = [{'product': self.product.id, 'quantity': 1, 'unit_price': '1.00'} for _ in range(n)]
+                # Gồm khóa deal, đọc value trước/sau và ghi lịch sử thay đổi value
+                response = self.assertMaxQueries(15, self.client.post, self.url, {'create': lines}, format='json')
+                self.assertEqual(response.status_code, 200)
+
+    def test_rep_cannot_edit_others_deal(self):
+        rep = CustomUser.objects.create_user(username='sales_a', password='password123', role='REP')
+        self.client.force_authenticate(rep)
+        response = self.client.post(self.url, {'delete': [self.item.id]}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkMoveTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        self.opps = seed_pipeline(30, self.manager)
+        self.open_stage, self.won_stage, self.lost_stage = PipelineStage.objects.order_by('order')
+
+    def move(self, ids, stage):
+        return self.client.post('/api/opportunities/bulk-move/', {'ids': ids, 'stage': stage.id}, format='json')
+
+    def test_moves_and_syncs_status(self):
+        ids = [opp.id for opp in self.opps]
+        response = self.assertMaxQueries(8, self.move, ids, self.won_stage)
+        self.assertEqual(response.status_code, 200)
+        # 1/3 số deal đã ở giai đoạn WON
+        self.assertEqual((response.data['moved'], response.data['unchanged']), (20, 10))
+        self.assertEqual(Opportunity.objects.filter(stage=self.won_stage, status='WON').count(), 30)
+        # Mỗi deal thay đổi ghi 2 dòng lịch sử (stage, status)
+        self.assertEqual(OpportunityChange.objects.count(), 40)
+
+        self.move(ids[:5], self.open_stage)
+        self.assertEqual(Opportunity.objects.filter(pk__in=ids[:5], status='OPEN').count(), 5)
+
+    def test_rep_ownership_checked(self):
+        rep = CustomUser.objects.create_user(username='sales_a', password='password123', role='REP')
+        own = self.opps[0]
+        Opportunity.objects.filter(pk=own.pk).update(owner=rep)
+        self.client.force_authenticate(rep)
+        response = self.move([own.id, self.opps[1].id], self.lost_stage)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['ids'], [self.opps[1].id])
+        own.refresh_from_db()
+        self.assertEqual(own.stage, self.open_stage)
+        self.assertEqual(self.move([own.id], self.lost_stage).data['moved'], 1)
+
+    def test_invalid_payload(self):
+        self.assertEqual(self.move('abc', self.open_stage).status_code, 400)
+        response = self.client.post('/api/opportunities/bulk-move/', {'ids': [self.opps[0].id], 'stage': 999}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class OpportunityAuditTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        self.opp = seed_pipeline(3, self.manager)[0]
+        self.open_stage, self.won_stage, _ = PipelineStage.objects.order_by('order')
+
+    def test_update_records_one_row_per_changed_field(self):
+        response = self.client.patch(f'/api/opportunities/{self.opp.id}/', {'stage': self.won_stage.id, 'value': '150.00', 'title': self.opp.title})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'WON')
+        changes = {c.field: (c.old_value, c.new_value, c.user_id) for c in OpportunityChange.objects.all()}
+        self.assertEqual(changes, {
+            'stage': (str(self.open_stage.id), str(self.won_stage.id), self.manager.id),
+            'status': ('OPEN', 'WON', self.manager.id),
+            'value': ('100.00', '150.00', self.manager.id),
+        })
+
+    def test_update_without_changes_writes_nothing(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(f'/api/opportunities/{self.opp.id}/', {'title': self.opp.title})
+        self.assertFalse(any(q['sql'].startswith(('UPDATE', 'INSERT')) for q in ctx.captured_queries))
+        self.assertFalse(OpportunityChange.objects.exists())
+
+    def test_history_api_pages_and_scopes(self):
+        for i in range(5):
+            self.client.patch(f'/api/opportunities/{self.opp.id}/', {'title': f'Tên {i}'})
+        url = f'/api/opportunity-changes/?opportunity={self.opp.id}&page_size=2'
+        titles = []
+        while url:
+            data = self.assertMaxQueries(3, self.client.get, url).data
+            titles += [row['new_value'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(titles, [f'Tên {i}' for i in reversed(range(5))])
+
+        rep = CustomUser.objects.create_user(username='sales_a', password='password123', role='REP')
+        self.client.force_authenticate(rep)
+        self.assertEqual(self.client.get('/api/opportunity-changes/').data['results'], [])
+
+    def test_append_only(self):
+        self.client.patch(f'/api/opportunities/{self.opp.id}/', {'title': 'Tên mới'})
+        change = OpportunityChange.objects.get()
+        with self.assertRaises(ValueError):
+            change.save()
+        with self.assertRaises(ValueError):
+            change.delete()
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise SMTPException("Máy chủ mail không phản hồi")
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """Lần gửi đầu lỗi, các lần sau gửi được; ghi lại trạng thái transaction/thư lúc gửi."""
+    calls = []
+
+    def send_messages(self, email_messages):
+        FlakyEmailBackend.calls.append((connection.in_atomic_block, list(OutboxEmail.objects.values_list('status', flat=True))))
+        if len(FlakyEmailBackend.calls) == 1:
+            raise SMTPException("Máy chủ mail không phản hồi")
+        return super().send_messages(email_messages)
+
+
+class OpportunityDetailEndpointTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.rep = CustomUser.objects.create_user(username='rep', password='password123', role='REP')
+        self.other = CustomUser.objects.create_user(username='other', password='password123', role='REP')
+        self.opp = seed_pipeline(1, self.rep)[0]
+        Activity.objects.bulk_create([
+            Activity(opportunity=self.opp, user=self.rep, type='CALL', summary=f"Gọi lần {i}") for i in range(24)
+        ])
+        Task.objects.create(opportunity=self.opp, assigned_to=self.other, title="Việc của người khác", due_date=timezone.now())
+        OpportunityChange.objects.bulk_create([
+            OpportunityChange(opportunity=self.opp, user=self.rep, field='value', old_value=str(i), new_value=str(i + 1))
+            for i in range(3)
+        ])
+        self.client.force_authenticate(self.rep)
+        self.url = f'/api/opportunities/{self.opp.id}/detail/'
+
+    def test_all_sections_in_one_query_each(self):
+        # deal + hoạt động + lịch sử + công việc + dòng sản phẩm
+        response = self.assertMaxQueries(5, self.client.get, self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['opportunity']['id'], self.opp.id)
+        self.assertEqual([task['title'] for task in data['tasks']], [f"Gọi lại #{self.opp.id}"])
+        self.assertEqual(len(data['items']), 1)
+        self.assertEqual((len(data['changes']['results']), data['changes']['next']), (3, None))
+
+        self.assertEqual(len(data['activities']['results']), 20)
+        rest = self.client.get(data['activities']['next']).data
+        ids = [a['id'] for a in data['activities']['results']] + [a['id'] for a in rest['results']]
+        self.assertEqual(ids, list(Activity.objects.filter(opportunity=self.opp).order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_include_and_limit(self):
+        response = self.assertMaxQueries(2, self.client.get, self.url, {'include': 'items'})
+        self.assertEqual(set(response.data), {'opportunity', 'items'})
+        response = self.client.get(self.url, {'include': 'activities', 'limit': 5})
+        self.assertEqual(len(response.data['activities']['results']), 5)
+        self.assertIn('page_size=5', response.data['activities']['next'])
+        self.assertEqual(self.client.get(self.url, {'include': 'items,bogus'}).status_code, 400)
+
+    def test_rep_cannot_open_other_reps_deal(self):
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ConditionalListTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.rep = CustomUser.objects.create_user(username='rep', password='password123', role='REP')
+        self.stage = PipelineStage.objects.create(name="Mới", order=1)
+        self.client.force_authenticate(self.manager)
+
+    def test_not_modified_without_running_queryset(self):
+        first = self.client.get('/api/stages/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+        # Chỉ còn query đọc phiên bản bảng
+        response = self.assertMaxQueries(1, self.client.get, '/api/stages/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+        self.assertEqual(self.client.get('/api/stages/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_serves_cached_list_until_next_write(self):
+        first = self.client.get('/api/stages/')
+        cached = self.assertMaxQueries(1, self.client.get, '/api/stages/')
+        self.assertEqual(cached.json(), first.json())
+        # Khác trang/tham số: ETag khác
+        self.assertNotEqual(self.client.get('/api/stages/?page_size=5')['ETag'], first['ETag'])
+
+        self.client.patch(f'/api/stages/{self.stage.id}/', {'name': "Tiềm năng"})
+        response = self.client.get('/api/stages/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.data['results'][0]['name'], "Tiềm năng")
+
+    def test_users_version_ignores_login(self):
+        etag = self.client.get('/api/auth/users/')['ETag']
+        self.rep.last_login = timezone.now()
+        self.rep.save(update_fields=['last_login'])
+        self.assertEqual(self.client.get('/api/auth/users/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.rep.email = 'rep@test.com'
+        self.rep.save(update_fields=['email'])
+        self.assertEqual(self.client.get('/api/auth/users/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_permissions_checked_before_etag(self):
+        etag = self.client.get('/api/auth/users/')['ETag']
+        self.client.force_authenticate(self.rep)
+        self.assertEqual(self.client.get('/api/auth/users/', HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+    def test_product_list(self):
+        first = self.client.get('/api/products/')
+        Product.objects.create(name="Gói Pro", code="SP2", price=200)
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((response.status_code, response.data['count']), (200, 1))
+
+
+class OutboxTests(APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', email='manager@test.com', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        self.opp = seed_pipeline(1, self.manager)[0]
+
+    def create_task(self, title="Gọi lại"):
+        return self.client.post('/api/tasks/', {'opportunity': self.opp.id, 'title': title, 'due_date': timezone.now().isoformat()})
+
+    def test_requests_only_enqueue(self):
+        self.assertEqual(self.create_task().status_code, 201)
+        self.client.force_authenticate(None)
+        self.client.post('/api/auth/password-reset/', {'email': 'manager@test.com'})
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.filter(status='PENDING').count(), 2)
+
+        call_command('run_mail_worker', '--once', stdout=io.StringIO())
+        self.assertEqual(sorted(m.subject for m in mail.outbox), ["Công việc mới: Gọi lại", "Yêu cầu đặt lại mật khẩu - Core CRM"])
+        self.assertEqual(OutboxEmail.objects.filter(status='SENT').count(), 2)
+
+    @override_settings(EMAIL_BACKEND='sales_pipeline.tests.CountingEmailBackend')
+    def test_batches_share_one_connection(self):
+        CountingEmailBackend.opened = 0
+        for i in range(25):
+            self.create_task(f"Việc {i}")
+        call_command('run_mail_worker', '--once', '--batch-size', '10', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+
+    @override_settings(EMAIL_BACKEND='sales_pipeline.tests.FailingEmailBackend')
+    def test_retry_with_backoff_then_dead_letter(self):
+        self.create_task()
+        call_command('run_mail_worker', '--once', '--max-attempts', '2', '--backoff', '60', stdout=io.StringIO())
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), ('PENDING', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+        self.assertIn('SMTPException', email.last_error)
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        call_command('run_mail_worker', '--once', '--max-attempts', '2', stdout=io.StringIO())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('DEAD', 2))
+
+
+class OutboxDeliveryTests(TransactionTestCase):
+    # Kiểm tra transaction thật: lúc gửi SMTP không còn transaction/khóa dòng nào mở
+    def setUp(self):
+        FlakyEmailBackend.calls = []
+        self.email = enqueue_mail("Nhắc việc", "Nội dung", ['rep@test.com'])
+
+    @override_settings(EMAIL_BACKEND='sales_pipeline.tests.FlakyEmailBackend')
+    def test_failed_send_is_retried_outside_transaction(self):
+        self.assertEqual(MailDelivery(backoff_seconds=60).deliver_batch(), (0, 1))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts), ('PENDING', 1))
+        self.assertGreater(self.email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+        self.assertIn('SMTPException', self.email.last_error)
+        # Chưa đến hạn thử lại
+        self.assertEqual(MailDelivery().deliver_batch(), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(MailDelivery().deliver_batch(), (1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual((self.email.status, self.email.attempts, self.email.last_error), ('SENT', 1, None))
+        self.assertEqual(len(mail.outbox), 1)
+        # Thư đã được nhận (SENDING, đã commit) trước khi gửi, và gửi ngoài transaction
+        self.assertEqual(FlakyEmailBackend.calls, [(False, ['SENDING'])] * 2)
+
+    def test_unrecorded_claim_is_resent_after_lease(self):
+        delivery = MailDelivery(lease_seconds=600)
+        with mock.patch.object(MailDelivery, 'record', side_effect=OperationalError("mất kết nối DB")):
+            with self.assertRaises(OperationalError):
+                delivery.deliver_batch()
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, 'SENDING')
+        self.assertGreater(self.email.next_attempt_at, timezone.now() + timedelta(seconds=590))
+        # Còn trong hạn nhận: worker khác không gửi trùng
+        self.assertEqual(MailDelivery().deliver_batch(), (0, 0))
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(MailDelivery().deliver_batch(), (1, 0))
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.status, 'SENT')
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class SendRemindersTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reps = [
+            CustomUser.objects.create_user(username=f'sales_{i}', email=f'sales{i}@test.com', password='password123', role='REP')
+            for i in range(3)
+        ]
+        no_email = CustomUser.objects.create_user(username='no_email', password='password123', role='REP')
+        stage = PipelineStage.objects.create(name="Mới", order=1)
+        customer = Customer.objects.create(name="Khách hàng")
+        today = timezone.now().date()
+        Opportunity.objects.bulk_create([
+            Opportunity(title=f"Deal {i}", value=100, stage=stage, customer=customer, owner=owner,
+                        expected_close_date=today + timedelta(days=(i // 3) % 3))
+            for i, owner in enumerate([*cls.reps * 10, no_email])
+        ])
+
+    def run_reminders(self, *args):
+        out = io.StringIO()
+        self.assertMaxQueries(1, call_command, 'send_reminders', *args, stdout=out)
+        return out.getvalue()
+
+    def test_one_email_per_deal_due_today(self):
+        self.run_reminders()
+        self.assertEqual(len(mail.outbox), 12)
+
+    def test_digest_per_owner_with_look_ahead(self):
+        output = self.run_reminders('--digest', '--days', '1')
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('21 giao dịch', output)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [rep.email for rep in self.reps])
+        self.assertTrue(all(m.body.count('\n- ') == m.body.count('Deal') for m in mail.outbox))
+
+    def test_thread_pool(self):
+        self.run_reminders('--days', '2', '--workers', '3', '--batch-size', '5')
+        self.assertEqual(len(mail.outbox), 30)
+
+    @override_settings(EMAIL_BACKEND='sales_pipeline.tests.FailingEmailBackend')
+    def test_mail_server_down_fails_command(self):
+        with self.assertRaisesMessage(CommandError, 'lỗi 12 email'):
+            call_command('send_reminders', '--workers', '2', '--batch-size', '5', stdout=io.StringIO())
+
+    @override_settings(EMAIL_BACKEND='sales_pipeline.tests.FlakyEmailBackend')
+    def test_failed_batch_reported_others_sent(self):
+        FlakyEmailBackend.calls = []
+        with self.assertRaisesMessage(CommandError, 'Đã gửi 7 email, lỗi 5 email'):
+            call_command('send_reminders', '--batch-size', '5', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 7)
+
+    def test_thread_pool_builds_messages_as_it_sends(self):
+        outstanding = []
+        build = SendRemindersCommand.single_message
+
+        def single_message(command, opp, today):
+            # Email đã tạo nhưng chưa gửi
+            outstanding.append(len(outstanding) - len(mail.outbox))
+            return build(command, opp, today)
+
+        with mock.patch.object(SendRemindersCommand, 'single_message', single_message):
+            self.run_reminders('--days', '2', '--workers', '2', '--batch-size', '1')
+        self.assertEqual(len(mail.outbox), 30)
+        # Tối đa workers * 2 lượt chờ gửi + lượt đang tạo
+        self.assertLessEqual(max(outstanding), 5)
+
+
+class BenchmarkEndpointsTests(TransactionTestCase):
+    # seed_data xóa dữ liệu bằng TRUNCATE: không chạy được trong transaction bao ngoài của TestCase (PostgreSQL)
+    def test_writes_results_for_each_dataset(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark_endpoints', '--sizes', '20,40', '--repeat', '2', '--warmup', '0',
+                         '--import-rows', '5', '--output', output, stdout=io.StringIO())
+            with open(output, encoding='utf-8') as f:
+                results = json.load(f)
+
+        self.assertEqual([dataset['size'] for dataset in results['datasets']], [20, 40])
+        self.assertEqual(results['datasets'][1]['rows']['opportunities'], 40)
+        scenarios = results['datasets'][1]['scenarios']
+        self.assertIn('opportunity_export', scenarios)
+        self.assertLessEqual(scenarios['kanban_board']['latency_ms']['p50'], scenarios['kanban_board']['latency_ms']['max'])
+        self.assertGreater(scenarios['opportunity_list']['queries'], 0)
+        self.assertGreater(scenarios['opportunity_export']['peak_memory_kb'], 0)
+        # Import đo trong transaction rồi rollback: dataset không đổi
+        self.assertFalse(Customer.objects.filter(email__startswith='bench-').exists())
+
+
+class AsyncDashboardTests(TransactionTestCase):
+    # Query của view async chạy trên kết nối riêng của từng thread: chỉ thấy dữ liệu đã commit
+    def setUp(self):
+        caches['dashboard'].clear()
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+        seed_pipeline(12, self.manager)
+
+    def test_same_payload_as_sync_view(self):
+        sync = self.client.get('/api/dashboard/stats/?months=3')
+        caches['dashboard'].clear()
+        response = self.client.get('/api/dashboard/stats/async/?months=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(sync.content))
+        # Lần sau lấy từ cache chung với view đồng bộ
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(json.loads(self.client.get('/api/dashboard/stats/async/?months=3').content), json.loads(sync.content))
+        self.assertEqual(len(queries), 0)
+
+    def test_pool_queries_in_request_metrics(self):
+        sync = self.client.get('/api/dashboard/stats/?months=3')
+        caches['dashboard'].clear()
+        with self.assertLogs('sales_pipeline.requests', 'INFO') as logs:
+            response = self.client.get('/api/dashboard/stats/async/?months=3')
+        metrics = json.loads(logs.records[-1].getMessage())
+        # Cùng số query với view đồng bộ: query chạy trên thread của pool cũng được đếm
+        sync_queries = re.search(r'desc="(\d+) queries"', sync['Server-Timing']).group(1)
+        self.assertGreater(int(sync_queries), 0)
+        self.assertIn(f'desc="{sync_queries} queries"', response['Server-Timing'])
+        self.assertEqual(metrics['db_queries'], int(sync_queries))
+
+    def test_query_groups_run_concurrently(self):
+        def slow(func):
+            def wrapper(*args):
+                time.sleep(0.2)
+                return func(*args)
+            return wrapper
+
+        names = ['compute_kpis', 'compute_series', 'compute_upcoming_deals', 'compute_new_customers_count', 'compute_my_tasks']
+        with mock.patch.multiple(dashboard, **{name: slow(getattr(dashboard, name)) for name in names}):
+            started = time.perf_counter()
+            response = self.client.get('/api/dashboard/stats/async/')
+            elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code, 200)
+        # Chạy lần lượt sẽ mất >= 1 giây
+        self.assertLess(elapsed, 0.6)
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get('/api/dashboard/stats/async/').status_code, 403)
+        self.assertEqual(self.client.post('/api/dashboard/stats/async/').status_code, 405)
+
+    def test_benchmark_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark_dashboard', '--concurrency', '1,3', '--requests', '3', '--warmup', '0',
+                         '--output', output, stdout=io.StringIO())
+            with open(output, encoding='utf-8') as f:
+                results = json.load(f)
+        self.assertEqual([level['concurrency'] for level in results['levels']], [1, 3])
+        for mode in ('sync', 'async'):
+            self.assertGreater(results['levels'][1][mode]['throughput_rps'], 0)
+
+
+class KeysetPaginationTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        self.opps = seed_pipeline(25, self.manager)
+        # Cùng created_at/due_date để thứ tự phải dựa vào khóa phụ id
+        now = timezone.now()
+        for model in (Customer, Opportunity, Activity):
+            model.objects.update(created_at=now)
+        Task.objects.update(due_date=now)
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.assertMaxQueries(3, self.client.get, url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_walks_every_row_once_in_order(self):
+        for endpoint, model, desc in [
+            ('opportunities', Opportunity, True), ('customers', Customer, True),
+            ('activities', Activity, True), ('tasks', Task, False),
+        ]:
+            with self.subTest(endpoint=endpoint):
+                ids, pages = self.walk(f'/api/{endpoint}/?pagination=cursor&page_size=10')
+                self.assertEqual(ids, sorted(model.objects.values_list('id', flat=True), reverse=desc))
+                self.assertEqual(pages, 3)
+
+    def test_no_duplicates_when_rows_inserted_between_pages(self):
+        first = self.client.get('/api/opportunities/?pagination=cursor&page_size=10').data
+        Opportunity.objects.create(
+            title="Deal mới", value=100, expected_close_date=date.today(),
+            stage=self.opps[0].stage, owner=self.manager, customer=self.opps[0].customer,
+        )
+        second = self.client.get(first['next']).data
+        first_ids = {row['id'] for row in first['results']}
+        self.assertFalse(first_ids & {row['id'] for row in second['results']})
+        self.assertEqual(len(second['results']), 10)
+
+    def test_filters_and_approximate_count(self):
+        response = self.client.get('/api/opportunities/?pagination=cursor&status=WON&count=approx')
+        self.assertTrue(all(row['status'] == 'WON' for row in response.data['results']))
+        if connection.vendor == 'postgresql':
+            self.assertIsInstance(response.data['count'], int)
+        else:
+            self.assertNotIn('count', response.data)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/opportunities/?cursor=abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.data)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Kế hoạch thực thi phụ thuộc planner của PostgreSQL")
+class IndexUsageTests(TestCase):
+    """
+    Chạy EXPLAIN cho các query "nóng" trên dữ liệu mẫu (đã ANALYZE) và kiểm tra
+    planner dùng đúng index đã thiết kế trong migration 0012.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        cls.reps = CustomUser.objects.bulk_create(
+            [CustomUser(username=f'sales_{i}', role='REP') for i in range(40)]
+        )
+        stages = [
+            PipelineStage.objects.create(name="Mới", order=1, type='OPEN'),
+            PipelineStage.objects.create(name="Thắng", order=2, type='WON'),
+            PipelineStage.objects.create(name="Thua", order=3, type='LOST'),
+        ]
+        customer = Customer.objects.create(name="Khách hàng")
+        today = date.today()
+        opps = []
+        for i in range(8000):
+            stage = rng.choices(stages, weights=[2, 5, 3])[0]
+            opps.append(Opportunity(
+                title=f"Deal #{i}", value=100, stage=stage, status=stage.type, customer=customer,
+                owner=rng.choice(cls.reps),
+                expected_close_date=today + timedelta(days=rng.randint(-720, 60)),
+            ))
+        opps = Opportunity.objects.bulk_create(opps, batch_size=1000)
+        # Phần lớn deal WON đã chốt từ lâu, chỉ một ít trong cửa sổ biểu đồ
+        Opportunity.objects.filter(status='WON').update(updated_at=timezone.now() - timedelta(days=720))
+        Opportunity.objects.filter(status='WON', id__in=[o.id for o in opps[:400]]).update(updated_at=timezone.now())
+        cls.opportunity = opps[0]
+        Activity.objects.bulk_create([
+            Activity(opportunity=rng.choice(opps), user=cls.reps[0], type='NOTE', summary="Ghi chú")
+            for _ in range(8000)
+        ], batch_size=1000)
+        Task.objects.bulk_create([
+            Task(opportunity=rng.choice(opps), assigned_to=rng.choice(cls.reps), title="Gọi lại",
+                 due_date=timezone.now() + timedelta(days=rng.randint(-30, 30)), is_completed=rng.random() < 0.8)
+            for _ in range(8000)
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f"Không dùng {index_name}:\n{plan}")
+
+    def test_rep_scope_by_status(self):
+        self.assertUsesIndex(Opportunity.objects.filter(owner=self.reps[3], status='OPEN'), 'opp_owner_status_idx')
+
+    def test_upcoming_open_deals(self):
+        queryset = Opportunity.objects.filter(
+            status='OPEN', expected_close_date__gte=date.today(),
+        ).order_by('expected_close_date')[:5]
+        self.assertUsesIndex(queryset, 'opp_open_close_date_idx')
+
+    def test_send_reminders_due_today(self):
+        self.assertUsesIndex(Opportunity.objects.filter(expected_close_date=date.today(), status='OPEN'), 'opp_open_close_date_idx')
+
+    def test_monthly_won_chart(self):
+        queryset = Opportunity.objects.filter(status='WON', updated_at__gte=timezone.now() - timedelta(days=180))
+        self.assertUsesIndex(queryset, 'opp_status_updated_idx')
+
+    def test_my_open_tasks(self):
+        queryset = Task.objects.filter(assigned_to=self.reps[5], is_completed=False).order_by('due_date')[:5]
+        self.assertUsesIndex(queryset, 'task_assignee_open_due_idx')
+
+    def test_activity_timeline(self):
+        self.assertUsesIndex(Activity.objects.filter(opportunity=self.opportunity)[:10], 'activity_opp_created_idx')
+
+    def test_keyset_page(self):
+        last = Opportunity.objects.order_by('-created_at', '-id')[4000]
+        queryset = Opportunity.objects.filter(
+            Q(created_at__lt=last.created_at) | Q(created_at=last.created_at, id__lt=last.id),
+            created_at__lte=last.created_at,
+        ).order_by('-created_at', '-id')[:20]
+        self.assertUsesIndex(queryset, 'opp_created_id_idx')
+
+    def test_kanban_first_page(self):
+        stage_ids = list(PipelineStage.objects.values_list('id', flat=True))
+        board = KanbanBoardView()
+        # Mỗi cột một lần quét index có LIMIT, không đánh số/sắp xếp cả bảng
+        queryset = board.first_page(Opportunity.objects.all(), stage_ids, 20)
+        self.assertUsesIndex(queryset, 'opp_stage_created_id_idx')
+        self.assertNotIn('WindowAgg', queryset.explain())
+        self.assertUsesIndex(board.first_page(Opportunity.objects.filter(owner=self.reps[3]), stage_ids, 20), 'opp_owner_stage_created_idx')
+
+    def test_kanban_column_page(self):
+        stage = PipelineStage.objects.get(type='WON')
+        last = Opportunity.objects.filter(stage=stage).order_by('-created_at', '-id')[1000]
+        queryset = Opportunity.objects.filter(
+            Q(created_at__lt=last.created_at) | Q(created_at=last.created_at, id__lt=last.id), stage=stage,
+        ).order_by('-created_at', '-id')[:21]
+        self.assertUsesIndex(queryset, 'opp_stage_created_id_idx')
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingDecisionTests(APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client.force_authenticate(self.manager)
+        patcher = mock.patch('sales_pipeline.replicas.replica_available', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method='GET'):
+        return SimpleNamespace(method=method, user=self.manager)
+
+    def test_only_safe_requests_read_replica(self):
+        self.assertEqual(replicas.read_db(self.request()), 'replica')
+        self.assertEqual(replicas.read_db(self.request('POST')), 'default')
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(replicas.read_db(self.request()), 'default')
+
+    def test_writes_go_to_primary_and_pin_user(self):
+        router = replicas.ReplicaRouter()
+        self.assertEqual(router.db_for_write(Customer), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'sales_pipeline'))
+
+        response = self.client.post('/api/customers/', {'name': 'Khách mới', 'email': 'moi@test.com'})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(replicas.is_pinned(self.manager.pk))
+        self.assertEqual(replicas.read_db(self.request()), 'default')
+
+    def test_pin_expires(self):
+        with override_settings(READ_YOUR_WRITES_SECONDS=0.1):
+            replicas.pin_to_primary(self.manager.pk)
+            self.assertEqual(replicas.read_db(self.request()), 'default')
+            time.sleep(0.2)
+        self.assertEqual(replicas.read_db(self.request()), 'replica')
+
+
+@skipUnless('replica' in settings.DATABASES, "Cần alias 'replica' (TEST MIRROR của 'default') trong DATABASES")
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # Bản sao là kết nối riêng: chỉ thấy dữ liệu đã commit
+    databases = '__all__'
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['dashboard'].clear()
+        replicas._unavailable.clear()
+        self.manager = CustomUser.objects.create_user(username='manager', password='password123', role='MANAGER')
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+        self.opps = seed_pipeline(5, self.manager)
+
+    def queries_on(self, alias, *urls):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            for url in urls:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+        return len(queries)
+
+    def test_reporting_and_list_reads_use_replica(self):
+        urls = ['/api/opportunities/', '/api/customers/', '/api/dashboard/stats/', '/api/opportunities/export/']
+        self.assertGreaterEqual(self.queries_on('replica', *urls), len(urls))
+        caches['dashboard'].clear()
+        self.assertEqual(self.queries_on('default', *urls), 0)
+        # Chi tiết một deal (thường mở ngay sau khi sửa) vẫn đọc từ 'default'
+        self.assertEqual(self.queries_on('replica', f'/api/opportunities/{self.opps[0].pk}/'), 0)
+
+    def test_read_your_writes(self):
+        response = self.client.patch(f'/api/opportunities/{self.opps[0].pk}/', {'title': 'Deal đã sửa'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.queries_on('replica', '/api/opportunities/'), 0)
+
+        other = CustomUser.objects.create_user(username='sales_x', password='password123', role='MANAGER')
+        self.client.force_authenticate(other)
+        self.assertGreater(self.queries_on('replica', '/api/opportunities/'), 0)
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        connections['replica'].close()
+        with mock.patch.object(connections['replica'], 'ensure_connection', side_effect=OperationalError):
+            self.assertGreater(self.queries_on('default', '/api/opportunities/'), 0)
+        self.assertIn('replica', replicas._unavailable)
@@ -2,8 +2,9 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     CustomerViewSet, PipelineStageViewSet, OpportunityViewSet, 
-    ActivityViewSet, DashboardStatsView, TaskViewSet,
-    ExportOpportunityView, ImportCustomerView, ProductViewSet, OpportunityItemViewSet
+    ActivityViewSet, DashboardStatsView, AsyncDashboardStatsView, TaskViewSet,
+    ExportOpportunityView, ImportCustomerView, ProductViewSet, OpportunityItemViewSet,
+    KanbanBoardView, DashboardCacheStatsView, OpportunityChangeViewSet, MetricsView
 )
 
 # Router tự động sinh ra các đường dẫn như /opportunities/, /opportunities/1/ ...
@@ -15,11 +16,16 @@ router.register(r'activities', ActivityViewSet)
 router.register(r'tasks', TaskViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'opportunity-items', OpportunityItemViewSet)
+router.register(r'opportunity-changes', OpportunityChangeViewSet)
 
 urlpatterns = [
     # Ưu tiên các đường dẫn cụ thể lên trước router
     path('opportunities/export/', ExportOpportunityView.as_view(), name='opportunity_export'),
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard_stats'),
+    path('dashboard/stats/async/', AsyncDashboardStatsView.as_view(), name='dashboard_stats_async'),
+    path('dashboard/cache-stats/', DashboardCacheStatsView.as_view(), name='dashboard_cache_stats'),
     path('customers/import/', ImportCustomerView.as_view(), name='customer_import'),
+    path('board/', KanbanBoardView.as_view(), name='kanban_board'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
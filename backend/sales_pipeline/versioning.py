@@ -0,0 +1,79 @@
+"""
+ETag / Last-Modified cho các danh sách dữ liệu tham chiếu (giai đoạn, sản phẩm, nhân viên).
+
+Mỗi bảng có một bộ đếm trong TableVersion, tăng trong cùng transaction với thao tác ghi
+(signal post_save/post_delete trong signals.py; bulk_create/update phải tự gọi bump()).
+Request list chỉ đọc bộ đếm (1 query theo khóa chính):
+- If-None-Match / If-Modified-Since khớp -> 304, không chạy queryset, không serialize;
+- nếu không, trả danh sách đã serialize lưu trong bộ nhớ process cho tới lần ghi tiếp theo.
+Bộ đếm nằm trong DB nên mọi worker thấy cùng một version.
+"""
+import zlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .models import TableVersion
+
+# (bảng, đường dẫn kèm query string) -> ((version, updated_at), dữ liệu đã serialize)
+_list_cache = {}
+MAX_CACHED_LISTS = 256
+
+
+def bump(*models):
+    now = timezone.now()
+    for table in sorted({model._meta.db_table for model in models}):
+        if TableVersion.objects.filter(table=table).update(version=F('version') + 1, updated_at=now):
+            continue
+        try:
+            with transaction.atomic():
+                TableVersion.objects.create(table=table, version=1, updated_at=now)
+        except IntegrityError:
+            # Request khác vừa tạo dòng này
+            TableVersion.objects.filter(table=table).update(version=F('version') + 1, updated_at=now)
+
+
+def get_version(model):
+    """(version, thời điểm ghi cuối) của bảng; (0, None) nếu chưa ghi lần nào kể từ khi có bộ đếm."""
+    row = TableVersion.objects.filter(table=model._meta.db_table).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+class VersionedListMixin:
+    """
+    Cho ViewSet: list() trả ETag/Last-Modified theo phiên bản bảng của model và 304 khi client đã có bản mới nhất.
+    Quyền vẫn được kiểm tra trước (DRF chạy initial() trước list()).
+    """
+
+    def list(self, request, *args, **kwargs):
+        model = self.get_queryset().model
+        version, modified = get_version(model)
+        # Kèm thời điểm ghi để version không bị trùng nếu bộ đếm quay lui (khôi phục DB, rollback)
+        stamp = (version, modified)
+        path = request.get_full_path()
+        # Cùng version nhưng khác trang/tham số là khác nội dung: thêm dấu của query string
+        etag = f'"{model._meta.db_table}-{version}.{int(modified.timestamp() * 1e6) if modified else 0}-{zlib.crc32(path.encode()):08x}"'
+
+        response = get_conditional_response(request._request, etag=etag, last_modified=modified and int(modified.timestamp()))
+        if response is None:
+            key = (model._meta.db_table, path)
+            cached = _list_cache.get(key)
+            if cached is not None and cached[0] == stamp:
+                data = cached[1]
+            else:
+                data = super().list(request, *args, **kwargs).data
+                if len(_list_cache) >= MAX_CACHED_LISTS:
+                    _list_cache.clear()
+                _list_cache[key] = (stamp, data)
+            response = Response(data)
+
+        response['ETag'] = etag
+        if modified:
+            response['Last-Modified'] = http_date(modified.timestamp())
+        # Trình duyệt lưu bản sao nhưng luôn hỏi lại server (If-None-Match) trước khi dùng
+        response['Cache-Control'] = 'private, no-cache'
+        return response
@@ -1,44 +1,60 @@
 from rest_framework import viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Q
-from django.db.models.functions import TruncMonth
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import validate_email
+from django.db import connections, transaction, DatabaseError
+from django.db.models import Sum, Count, Q, F, Prefetch, Window
+from django.db.models.functions import Lower, RowNumber
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_datetime
+from django.urls import reverse
+from urllib.parse import urlencode
+import base64
 from users.permissions import IsManagerOrAdmin
 import csv
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 import io
+import zlib
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.pagination import PageNumberPagination
-from django.core.mail import send_mail # <--- Import để gửi mail
-
-from .models import Customer, PipelineStage, Opportunity, Activity, Task, Product, OpportunityItem
+from asgiref.sync import sync_to_async
+
+from .models import Customer, PipelineStage, Opportunity, Activity, Task, Product, OpportunityItem, OpportunityChange
+from . import audit, metrics
+from .pagination import FlexiblePagination, KeysetOnlyPagination, KeysetPagination
+from .search import search_customers, search_opportunities
+from .items import apply_value_deltas, item_deltas, lock_opportunities
+from .outbox import enqueue_mail
+from .versioning import VersionedListMixin
+from .replicas import ReplicaReadMixin
+from .dashboard import aget_dashboard_stats, get_dashboard_stats, get_cache_stats, invalidate_new_customers, invalidate_opportunity_owners, parse_months
 from .serializers import (
     CustomerSerializer, PipelineStageSerializer, 
     OpportunitySerializer, ActivitySerializer, TaskSerializer, ProductSerializer,
-    OpportunityItemSerializer
+    OpportunityItemSerializer, OpportunityItemLineSerializer, OpportunityChangeSerializer
 )
 
-class FlexiblePagination(PageNumberPagination):
-    page_size = 10                  # Mặc định là 10
-    page_size_query_param = 'page_size' # Cho phép client chỉnh qua ?page_size=...
-    max_page_size = 1000            # Giới hạn tối đa 1000
+CUSTOMER_NAME_MAX_LENGTH = Customer._meta.get_field('name').max_length
+CUSTOMER_PHONE_MAX_LENGTH = Customer._meta.get_field('phone').max_length
+
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = FlexiblePagination
+    ordering = ['-created_at']
     
     def get_queryset(self):
         queryset = Customer.objects.all()
         query = self.request.query_params.get('search')
         if query:
-            queryset = queryset.filter(Q(name__icontains=query) | Q(email__icontains=query) | Q(phone__icontains=query))
+            queryset = search_customers(queryset, query)
         return queryset
 
-class PipelineStageViewSet(viewsets.ModelViewSet):
+class PipelineStageViewSet(VersionedListMixin, viewsets.ModelViewSet):
     queryset = PipelineStage.objects.all()
     serializer_class = PipelineStageSerializer
     
@@ -53,7 +69,7 @@ class PipelineStageViewSet(viewsets.ModelViewSet):
 
 
 
-class OpportunityViewSet(viewsets.ModelViewSet):
+class OpportunityViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Opportunity.objects.all()
     serializer_class = OpportunitySerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -66,54 +82,224 @@ class OpportunityViewSet(viewsets.ModelViewSet):
 
     # --- [NÂNG CẤP] AUDIT LOG & AUTO STATUS ---
     def perform_update(self, serializer):
-        # 1. Lấy dữ liệu cũ trước khi lưu
-        old_instance = self.get_object()
-        old_status = old_instance.status
-        old_stage = old_instance.stage
-        old_value = old_instance.value
-
-        # 2. Lưu dữ liệu mới
-        instance = serializer.save()
-        
-        # 3. Ghi Log thay đổi (Audit Log)
-        changes = []
-        if old_status != instance.status:
-            changes.append(f"Trạng thái: {old_status} -> {instance.status}")
-        if old_stage != instance.stage:
-            changes.append(f"Giai đoạn: {old_stage.name} -> {instance.stage.name}")
-        if old_value != instance.value:
-            changes.append(f"Giá trị: {old_value:,.0f} -> {instance.value:,.0f}")
-
-        if changes:
-            Activity.objects.create(
-                opportunity=instance,
-                user=self.request.user,
-                type='NOTE', # Dùng loại NOTE để ghi log hệ thống
-                summary=f"🔴 Cập nhật hệ thống: {'; '.join(changes)}"
+        # serializer.instance đã được get_object() load: chụp giá trị cũ từ đó, không SELECT lại
+        instance = serializer.instance
+        before = audit.snapshot(instance)
+
+        # Trạng thái tự động theo loại giai đoạn (OPEN/WON/LOST), lưu cùng một lần save()
+        stage = serializer.validated_data.get('stage', instance.stage)
+        with transaction.atomic():
+            instance = serializer.save(status=stage.type)
+            audit.record_changes(instance, self.request.user, before)
+
+    @action(detail=True, methods=['post'], url_path='items/bulk')
+    def bulk_items(self, request, pk=None):
+        """
+        Thêm/sửa/xóa nhiều dòng sản phẩm của deal trong một transaction:
+        {"create": [{product, quantity, unit_price}], "update": [{id, ...}], "delete": [id, ...]}.
+        Kiểm tra toàn bộ trước khi ghi, có dòng lỗi thì không ghi gì và trả lỗi theo từng dòng.
+        Giá trị deal được cập nhật một lần cho cả lô.
+        """
+        opportunity = self.get_object()
+        payload = {op: request.data.get(op) or [] for op in ('create', 'update', 'delete')}
+        if not all(isinstance(lines, list) for lines in payload.values()):
+            return Response({"error": "create, update, delete phải là danh sách"}, status=400)
+
+        errors = []
+        lines = {'create': [], 'update': []}
+        for op in lines:
+            for index, data in enumerate(payload[op]):
+                serializer = OpportunityItemLineSerializer(data=data, partial=op == 'update')
+                if not serializer.is_valid():
+                    errors.append({"op": op, "index": index, "errors": serializer.errors})
+                elif op == 'update' and 'id' not in serializer.validated_data:
+                    errors.append({"op": op, "index": index, "errors": {"id": ["Trường này là bắt buộc."]}})
+                else:
+                    lines[op].append((index, serializer.validated_data))
+        delete_ids = []
+        for index, item_id in enumerate(payload['delete']):
+            if isinstance(item_id, int) and not isinstance(item_id, bool):
+                delete_ids.append((index, item_id))
+            else:
+                errors.append({"op": 'delete', "index": index, "errors": {"id": ["Id không hợp lệ."]}})
+
+        with transaction.atomic():
+            manual = lock_opportunities([opportunity.pk])
+            touched_ids = [data['id'] for _, data in lines['update']] + [item_id for _, item_id in delete_ids]
+            existing = OpportunityItem.objects.select_for_update().filter(opportunity=opportunity).in_bulk(touched_ids)
+            products = Product.objects.in_bulk(
+                {data['product'] for op in lines for _, data in lines[op] if 'product' in data}
             )
 
-        # 4. Logic tự động cập nhật Status theo Stage (như cũ)
-        if instance.stage:
-            stage_type = instance.stage.type
-            if stage_type == 'WON' and instance.status != 'WON':
-                instance.status = 'WON'
-                instance.save()
-            elif stage_type == 'LOST' and instance.status != 'LOST':
-                instance.status = 'LOST'
-                instance.save()
-            elif stage_type == 'OPEN' and instance.status in ['WON', 'LOST']:
-                instance.status = 'OPEN'
-                instance.save()
+            seen = set()
+            for op, entries in [('update', [(i, d['id']) for i, d in lines['update']]), ('delete', delete_ids)]:
+                for index, item_id in entries:
+                    if item_id not in existing:
+                        errors.append({"op": op, "index": index, "errors": {"id": ["Không tìm thấy dòng sản phẩm của deal này."]}})
+                    elif item_id in seen:
+                        errors.append({"op": op, "index": index, "errors": {"id": ["Dòng sản phẩm bị lặp trong yêu cầu."]}})
+                    seen.add(item_id)
+            for op in lines:
+                for index, data in lines[op]:
+                    if 'product' in data and data['product'] not in products:
+                        errors.append({"op": op, "index": index, "errors": {"product": ["Sản phẩm không tồn tại."]}})
+
+            if errors:
+                return Response({"error": "Dữ liệu không hợp lệ, chưa lưu dòng nào", "errors": errors}, status=400)
+
+            before = [(item.opportunity_id, item.quantity, item.unit_price) for item in existing.values()]
+            created = [
+                OpportunityItem(opportunity=opportunity, product_id=data['product'], quantity=data['quantity'], unit_price=data['unit_price'])
+                for _, data in lines['create']
+            ]
+            updated = []
+            for _, data in lines['update']:
+                item = existing[data['id']]
+                item.product_id = data.get('product', item.product_id)
+                item.quantity = data.get('quantity', item.quantity)
+                item.unit_price = data.get('unit_price', item.unit_price)
+                updated.append(item)
+
+            OpportunityItem.objects.bulk_create(created)
+            OpportunityItem.objects.bulk_update(updated, ['product', 'quantity', 'unit_price'])
+            OpportunityItem.objects.filter(pk__in=[item_id for _, item_id in delete_ids]).delete()
+            apply_value_deltas(item_deltas(
+                before=before,
+                after=[(item.opportunity_id, item.quantity, item.unit_price) for item in created + updated],
+            ), manual, request.user)
+
+        opportunity.refresh_from_db(fields=['value'])
+        items = opportunity.items.select_related('product').order_by('id')
+        return Response({
+            "value": opportunity.value,
+            "items": OpportunityItemSerializer(items, many=True).data,
+        })
+
+    @action(detail=False, methods=['post'], url_path='bulk-move')
+    def bulk_move(self, request):
+        """
+        Chuyển nhiều deal sang một giai đoạn: {"ids": [...], "stage": id}.
+        Trạng thái theo loại giai đoạn như khi sửa từng deal, ghi bằng một UPDATE,
+        lịch sử thay đổi (OpportunityChange) ghi bằng một bulk_create.
+        REP chỉ chuyển được deal của mình: có id không hợp lệ thì không chuyển deal nào.
+        """
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return Response({"error": "ids phải là danh sách id deal"}, status=400)
+        try:
+            stage = PipelineStage.objects.get(pk=int(request.data.get('stage')))
+        except (TypeError, ValueError, PipelineStage.DoesNotExist):
+            return Response({"error": "Giai đoạn không tồn tại"}, status=400)
+        ids = set(ids)
+
+        with transaction.atomic():
+            scope = Opportunity.objects.filter(owner=request.user) if request.user.role == 'REP' else Opportunity.objects.all()
+            rows = list(
+                scope.filter(pk__in=ids).select_for_update()
+                .values('id', 'status', 'stage_id', 'owner_id').order_by('id')
+            )
+            missing = sorted(ids - {row['id'] for row in rows})
+            if missing:
+                return Response({"error": "Không tìm thấy deal hoặc không có quyền", "ids": missing}, status=400)
+
+            # Loại giai đoạn quyết định trạng thái: OPEN -> OPEN, WON -> WON, LOST -> LOST
+            new_status = stage.type
+            changed = [row for row in rows if row['stage_id'] != stage.pk or row['status'] != new_status]
+            if changed:
+                Opportunity.objects.filter(pk__in=[row['id'] for row in changed]).update(
+                    stage=stage, status=new_status, updated_at=timezone.now(),
+                )
+                after = {'stage': stage.pk, 'status': new_status}
+                changes = []
+                for row in changed:
+                    before = {'stage': row['stage_id'], 'status': row['status']}
+                    changes += audit.build_changes(row['id'], request.user, audit.diff(before, after))
+                OpportunityChange.objects.bulk_create(changes)
+                # queryset.update() không phát signal
+                owner_ids = [row['owner_id'] for row in changed]
+                transaction.on_commit(lambda: invalidate_opportunity_owners(owner_ids))
+
+        return Response({
+            "stage": stage.pk,
+            "status": new_status,
+            "moved": len(changed),
+            "unchanged": len(rows) - len(changed),
+        })
+
+    # Các phần của trang chi tiết deal (?include=), mặc định lấy tất cả
+    detail_sections = ('activities', 'tasks', 'items', 'changes')
+    detail_page_size = 20
+    detail_max_page_size = 100
+
+    @action(detail=True, methods=['get'], url_path='detail', url_name='full-detail')
+    def full_detail(self, request, pk=None):
+        """
+        Deal kèm hoạt động, công việc, dòng sản phẩm và lịch sử thay đổi trong một request
+        (thay cho 5 request của trang chi tiết): mỗi phần là một Prefetch, 1 query/phần.
+        Hoạt động và lịch sử chỉ lấy trang đầu (?limit=, mặc định 20); `next` trỏ tới API
+        danh sách tương ứng (phân trang cursor) để tải thêm. ?include=items,tasks để chọn phần.
+        """
+        include = request.query_params.get('include')
+        sections = [name.strip() for name in include.split(',') if name.strip()] if include else list(self.detail_sections)
+        unknown = sorted(set(sections) - set(self.detail_sections))
+        if unknown:
+            return Response({"error": f"include không hợp lệ: {', '.join(unknown)}"}, status=400)
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.detail_page_size)), 1), self.detail_max_page_size)
+        except ValueError:
+            return Response({"error": "limit phải là số nguyên"}, status=400)
+
+        prefetches, pagers = [], {}
+        if 'activities' in sections:
+            pagers['activities'], prefetch = self.first_page_prefetch(
+                'activities', Activity.objects.select_related('user'), ActivityViewSet, limit,
+            )
+            prefetches.append(prefetch)
+        if 'changes' in sections:
+            pagers['changes'], prefetch = self.first_page_prefetch(
+                'changes', OpportunityChange.objects.select_related('user'), OpportunityChangeViewSet, limit,
+            )
+            prefetches.append(prefetch)
+        if 'tasks' in sections:
+            # Như TaskViewSet: mỗi người chỉ thấy công việc của mình
+            prefetches.append(Prefetch('tasks', queryset=Task.objects.filter(assigned_to=request.user), to_attr='tasks_list'))
+        if 'items' in sections:
+            prefetches.append(Prefetch('items', queryset=OpportunityItem.objects.select_related('product').order_by('id'), to_attr='items_list'))
+
+        # get_queryset() đã giới hạn REP trong deal của mình: deal của người khác trả 404
+        opportunity = get_object_or_404(self.get_queryset().prefetch_related(*prefetches), pk=pk)
+        self.check_object_permissions(request, opportunity)
+
+        data = {'opportunity': self.get_serializer(opportunity).data}
+        if 'activities' in sections:
+            data['activities'] = self.first_page_payload(pagers['activities'], opportunity.activities_page, ActivitySerializer, 'activity-list', opportunity.pk)
+        if 'tasks' in sections:
+            data['tasks'] = TaskSerializer(opportunity.tasks_list, many=True).data
+        if 'items' in sections:
+            data['items'] = OpportunityItemSerializer(opportunity.items_list, many=True).data
+        if 'changes' in sections:
+            data['changes'] = self.first_page_payload(pagers['changes'], opportunity.changes_page, OpportunityChangeSerializer, 'opportunitychange-list', opportunity.pk)
+        return Response(data)
+
+    def first_page_prefetch(self, lookup, queryset, list_view, limit):
+        """Prefetch trang đầu (limit + 1 dòng để biết còn trang sau) theo đúng thứ tự cursor của list_view."""
+        pager = KeysetPagination(limit)
+        ordering = pager.prepare(queryset, list_view)
+        return pager, Prefetch(lookup, queryset=queryset.order_by(*ordering)[:limit + 1], to_attr=f'{lookup}_page')
+
+    def first_page_payload(self, pager, rows, serializer_class, url_name, opportunity_id):
+        next_link = None
+        if len(rows) > pager.page_size:
+            query = urlencode({'opportunity': opportunity_id, 'page_size': pager.page_size, 'cursor': pager.encode_cursor(rows[pager.page_size - 1])})
+            next_link = f"{self.request.build_absolute_uri(reverse(url_name))}?{query}"
+        return {'next': next_link, 'results': serializer_class(rows[:pager.page_size], many=True).data}
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Opportunity.objects.all()
+        queryset = Opportunity.objects.select_related('stage', 'owner', 'customer')
         if user.role == 'REP':
             queryset = queryset.filter(owner=user)
         
-        query = self.request.query_params.get('search')
-        if query:
-            queryset = queryset.filter(Q(title__icontains=query) | Q(customer__name__icontains=query))
         status = self.request.query_params.get('status')
         if status:
             queryset = queryset.filter(status=status)
@@ -126,19 +312,24 @@ class OpportunityViewSet(viewsets.ModelViewSet):
         owner = self.request.query_params.get('owner')
         if owner:
             queryset = queryset.filter(owner_id=owner)
+        # Sau các bộ lọc: giới hạn xếp hạng tính trên kết quả đã lọc
+        query = self.request.query_params.get('search')
+        if query:
+            queryset = search_opportunities(queryset, query)
         return queryset
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FlexiblePagination
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
     
     def get_queryset(self):
         user = self.request.user
-        queryset = Activity.objects.all()
+        queryset = Activity.objects.select_related('user')
         opportunity_id = self.request.query_params.get('opportunity')
         if opportunity_id:
             queryset = queryset.filter(opportunity_id=opportunity_id)
@@ -149,35 +340,31 @@ class ActivityViewSet(viewsets.ModelViewSet):
              return queryset.filter(opportunity__owner=user)
         return queryset
 
-class TaskViewSet(viewsets.ModelViewSet):
+class TaskViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Task.objects.all()
     serializer_class = TaskSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FlexiblePagination
 
     # --- [NÂNG CẤP] GỬI EMAIL THÔNG BÁO ---
     def perform_create(self, serializer):
         task = serializer.save(assigned_to=self.request.user)
-        
-        # Gửi email thông báo
-        try:
-            send_mail(
-                subject=f"Công việc mới: {task.title}",
-                message=f"Bạn vừa tạo một công việc mới trên CRM.\nHạn chót: {task.due_date}\nƯu tiên: {task.get_priority_display()}",
-                from_email=None, # Dùng mặc định trong settings
-                recipient_list=[self.request.user.email],
-                fail_silently=True
-            )
-        except Exception as e:
-            print("Lỗi gửi mail:", e)
+
+        # Chỉ đưa vào hàng đợi, lệnh run_mail_worker sẽ gửi (không chờ SMTP trong request)
+        enqueue_mail(
+            subject=f"Công việc mới: {task.title}",
+            message=f"Bạn vừa tạo một công việc mới trên CRM.\nHạn chót: {task.due_date}\nƯu tiên: {task.get_priority_display()}",
+            recipient_list=[self.request.user.email],
+        )
 
     def get_queryset(self):
-        queryset = Task.objects.filter(assigned_to=self.request.user)
+        queryset = Task.objects.filter(assigned_to=self.request.user).select_related('opportunity')
         opp_id = self.request.query_params.get('opportunity')
         if opp_id:
             queryset = queryset.filter(opportunity_id=opp_id)
         return queryset
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(VersionedListMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     
@@ -188,223 +375,399 @@ class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
-class OpportunityItemViewSet(viewsets.ModelViewSet):
+class OpportunityItemViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = OpportunityItem.objects.all()
     serializer_class = OpportunityItemSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        queryset = OpportunityItem.objects.all()
+        queryset = OpportunityItem.objects.select_related('product')
         opp_id = self.request.query_params.get('opportunity')
         if opp_id:
             queryset = queryset.filter(opportunity_id=opp_id)
         return queryset
 
-    def update_opportunity_value(self, opportunity):
-        total = opportunity.items.aggregate(
-            total=Sum(F('quantity') * F('unit_price'), output_field=models.DecimalField())
-        )['total'] or 0
-        opportunity.value = total
-        opportunity.save()
+    # Giá trị deal được cộng/trừ phần chênh lệch của dòng vừa ghi (xem sales_pipeline/items.py)
+    def locked_line(self, pk):
+        # Khóa dòng và đọc giá trị đang lưu trong DB, không dùng bản đã load trước đó
+        return OpportunityItem.objects.select_for_update().filter(pk=pk).values_list('opportunity_id', 'quantity', 'unit_price').first()
 
     def perform_create(self, serializer):
-        item = serializer.save()
-        self.update_opportunity_value(item.opportunity)
+        with transaction.atomic():
+            manual = lock_opportunities([serializer.validated_data['opportunity'].pk])
+            item = serializer.save()
+            apply_value_deltas(item_deltas(after=[(item.opportunity_id, item.quantity, item.unit_price)]), manual, self.request.user)
 
     def perform_update(self, serializer):
-        item = serializer.save()
-        self.update_opportunity_value(item.opportunity)
+        with transaction.atomic():
+            # Dòng có thể được chuyển sang deal khác: khóa cả deal cũ và deal mới
+            target = serializer.validated_data.get('opportunity')
+            manual = lock_opportunities([serializer.instance.opportunity_id, target and target.pk])
+            old_line = self.locked_line(serializer.instance.pk)
+            item = serializer.save()
+            apply_value_deltas(item_deltas(
+                before=[old_line] if old_line else [],
+                after=[(item.opportunity_id, item.quantity, item.unit_price)],
+            ), manual, self.request.user)
 
     def perform_destroy(self, instance):
-        opportunity = instance.opportunity
-        instance.delete()
-        self.update_opportunity_value(opportunity)
+        with transaction.atomic():
+            lock_opportunities([instance.opportunity_id])
+            old_line = self.locked_line(instance.pk)
+            instance.delete()
+            if old_line:
+                apply_value_deltas(item_deltas(before=[old_line]), user=self.request.user)
+
+class OpportunityChangeViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Lịch sử thay đổi deal, mới nhất trước: ?opportunity=, ?user=, ?field=.
+    Luôn phân trang keyset (?cursor=) vì bảng chỉ ghi thêm và lớn dần.
+    """
+    queryset = OpportunityChange.objects.all()
+    serializer_class = OpportunityChangeSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetOnlyPagination
+
+    def get_queryset(self):
+        queryset = OpportunityChange.objects.select_related('user')
+        for param, lookup in [('opportunity', 'opportunity_id'), ('user', 'user_id'), ('field', 'field')]:
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        if self.request.user.role == 'REP':
+            queryset = queryset.filter(opportunity__owner=self.request.user)
+        return queryset
 
-class DashboardStatsView(APIView):
+class DashboardStatsView(ReplicaReadMixin, APIView):
+    """
+    Số liệu Dashboard: KPI gộp trong 1 query aggregate có điều kiện, 3 biểu đồ
+    gộp trong 1 query GROUP BY, kết quả được cache theo phạm vi (xem sales_pipeline/dashboard.py).
+    """
     permission_classes = [permissions.IsAuthenticated]
-    
+
     def get(self, request):
-        user = request.user
-        
-        if user.role == 'REP':
-            opps = Opportunity.objects.filter(owner=user)
-        else:
-            opps = Opportunity.objects.all()
+        # Lấy số tháng từ tham số URL (mặc định 6 tháng)
+        months = parse_months(request.query_params.get('months'))
+        return Response(get_dashboard_stats(request.user, months, self.read_db))
+
+
+class AsyncDashboardStatsView(DashboardStatsView):
+    """
+    Biến thể async của DashboardStatsView (chạy dưới ASGI): các nhóm query độc lập
+    (KPI, biểu đồ + lý do thua, deal sắp chốt, khách hàng mới, việc của tôi) chạy song song,
+    độ trễ xấp xỉ query chậm nhất. DRF chưa hỗ trợ view async nên dispatch() tự làm các bước
+    của APIView: xác thực/quyền/throttle (đồng bộ, có thể query DB) chạy qua sync_to_async.
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
 
-        # KPIs
-        revenue_deals = opps.filter(status__in=['OPEN', 'WON'])
-        expected_revenue = revenue_deals.aggregate(total=Sum('value'))['total'] or 0
-        open_deals_count = opps.filter(status='OPEN').count()
-        
-        last_30_days = timezone.now() - timedelta(days=30)
-        new_customers_count = Customer.objects.filter(created_at__gte=last_30_days).count()
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method != 'GET':
+                self.http_method_not_allowed(request, *args, **kwargs)
+            months = parse_months(request.query_params.get('months'))
+            response = Response(await aget_dashboard_stats(request.user, months, self.read_db))
+        except Exception as exc:
+            response = self.handle_exception(exc)
 
-        won_count = opps.filter(status='WON').count()
-        closed_count = won_count + opps.filter(status='LOST').count()
-        win_rate = round((won_count / closed_count) * 100, 1) if closed_count > 0 else 0
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
 
-        # Chart Data (Manager) - Doanh thu theo Giai đoạn
-        chart_data = opps.filter(status='OPEN').values('stage__name').annotate(total=Sum('value')).order_by('total')
-        revenue_by_stage = [{"name": i['stage__name'], "value": i['total']} for i in chart_data]
 
-        # Upcoming Deals
-        upcoming_deals = opps.filter(status='OPEN', expected_close_date__gte=timezone.now().date()).order_by('expected_close_date')[:5].values('id', 'title', 'expected_close_date', 'value')
+class DashboardCacheStatsView(APIView):
+    """Số lần hit/miss của cache Dashboard (để chọn kích thước cache)."""
+    permission_classes = [IsManagerOrAdmin]
 
-        # My Tasks
-        my_tasks = Task.objects.filter(assigned_to=user, is_completed=False).order_by('due_date')[:5]
-        tasks_data = TaskSerializer(my_tasks, many=True).data
+    def get(self, request):
+        return Response(get_cache_stats())
 
-        # --- [CẬP NHẬT] BIỂU ĐỒ HIỆU SUẤT (CÓ BỘ LỌC THÁNG) ---
-        # Lấy số tháng từ tham số URL (mặc định 6 tháng)
-        try:
-            months = int(request.query_params.get('months', 6))
-        except ValueError:
-            months = 6
-            
-        start_date = timezone.now() - timedelta(days=months * 30)
-        
-        monthly_sales = opps.filter(status='WON', updated_at__gte=start_date)\
-            .annotate(month=TruncMonth('updated_at'))\
-            .values('month')\
-            .annotate(total=Sum('value'))\
-            .order_by('month')
-        
-        rep_performance = [
-            {"month": m['month'].strftime('%m/%Y'), "sales": m['total']} 
-            for m in monthly_sales
-        ]
-
-        lost_analysis = opps.filter(status='LOST')\
-            .values('lost_reason_code')\
-            .annotate(count=Count('id'))\
-            .order_by('-count')
-        
-        lost_reason_data = []
-        # Map từ mã code sang tên hiển thị tiếng Việt
-        reason_dict = dict(Opportunity.LostReason.choices) 
-
-        for item in lost_analysis:
-            code = item['lost_reason_code']
-            # Nếu code rỗng (do dữ liệu cũ) hoặc OTHER thì gom vào nhóm 'Khác'
-            label = reason_dict.get(code, "Chưa phân loại/Khác")
-            
-            lost_reason_data.append({
-                "name": label, 
-                "value": item['count']
-            })
+class MetricsView(APIView):
+    """Metrics theo định dạng text của Prometheus (request rate, lỗi, histogram latency theo view)."""
+    permission_classes = [IsManagerOrAdmin]
 
-        return Response({
-            "expected_revenue": expected_revenue,
-            "open_deals_count": open_deals_count,
-            "new_customers_count": new_customers_count,
-            "win_rate": win_rate,
-            "revenue_by_stage": revenue_by_stage,
-            "upcoming_deals": upcoming_deals,
-            "my_tasks": tasks_data,
-            "rep_performance": rep_performance,
-            "lost_reason_data": lost_reason_data,
-        })
-    permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        user = request.user
-        
-        # 1. Scope dữ liệu
-        if user.role == 'REP':
-            opps = Opportunity.objects.filter(owner=user)
-        else:
-            opps = Opportunity.objects.all()
+        return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        # 2. KPIs
-        revenue_deals = opps.filter(status__in=['OPEN', 'WON'])
-        expected_revenue = revenue_deals.aggregate(total=Sum('value'))['total'] or 0
-        open_deals_count = opps.filter(status='OPEN').count()
-        
-        last_30_days = timezone.now() - timedelta(days=30)
-        new_customers_count = Customer.objects.filter(created_at__gte=last_30_days).count()
-
-        won_count = opps.filter(status='WON').count()
-        closed_count = won_count + opps.filter(status='LOST').count()
-        win_rate = round((won_count / closed_count) * 100, 1) if closed_count > 0 else 0
-
-        # 3. Chart Data (Manager) - Doanh thu theo Giai đoạn
-        chart_data = opps.filter(status='OPEN').values('stage__name').annotate(total=Sum('value')).order_by('total')
-        revenue_by_stage = [{"name": i['stage__name'], "value": i['total']} for i in chart_data]
-
-        # 4. Upcoming Deals
-        upcoming_deals = opps.filter(status='OPEN', expected_close_date__gte=timezone.now().date()).order_by('expected_close_date')[:5].values('id', 'title', 'expected_close_date', 'value')
-
-        # 5. My Tasks
-        my_tasks = Task.objects.filter(assigned_to=user, is_completed=False).order_by('due_date')[:5]
-        tasks_data = TaskSerializer(my_tasks, many=True).data
-
-        # --- [MỚI] BIỂU ĐỒ HIỆU SUẤT CÁ NHÂN (REP PERFORMANCE) ---
-        # Thống kê doanh số WON trong 6 tháng gần nhất
-        six_months_ago = timezone.now() - timedelta(days=180)
-        monthly_sales = opps.filter(status='WON', updated_at__gte=six_months_ago)\
-            .annotate(month=TruncMonth('updated_at'))\
-            .values('month')\
-            .annotate(total=Sum('value'))\
-            .order_by('month')
-        
-        rep_performance = [
-            {"month": m['month'].strftime('%m/%Y'), "sales": m['total']} 
-            for m in monthly_sales
-        ]
+class Echo:
+    """File-like giả cho csv.writer: write() trả lại chính dòng vừa ghi."""
+    def write(self, value):
+        return value
 
-        return Response({
-            "expected_revenue": expected_revenue,
-            "open_deals_count": open_deals_count,
-            "new_customers_count": new_customers_count,
-            "win_rate": win_rate,
-            "revenue_by_stage": revenue_by_stage,
-            "upcoming_deals": upcoming_deals,
-            "my_tasks": tasks_data,
-            "rep_performance": rep_performance, # <--- Dữ liệu mới
-        })
-    
-class ExportOpportunityView(APIView):
+
+class ExportOpportunityView(ReplicaReadMixin, APIView):
+    """
+    Xuất CSV dạng stream: đọc theo từng lô qua server-side cursor (iterator),
+    mỗi dòng là một tuple phẳng (JOIN trong SQL), nên bộ nhớ không tăng theo số dòng.
+    ?gzip=1 để nén trực tiếp khi stream.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    chunk_size = 2000
+    header = ['ID', 'Tên Giao dịch', 'Khách hàng', 'Giá trị', 'Ngày đóng', 'Giai đoạn', 'Trạng thái', 'Người phụ trách', 'Ngày tạo']
+    columns = ('id', 'title', 'customer__name', 'value', 'expected_close_date', 'stage__name', 'status', 'owner__username', 'created_at')
+
     def get(self, request):
         user = request.user
         if user.role == 'REP':
             queryset = Opportunity.objects.filter(owner=user)
         else:
             queryset = Opportunity.objects.all()
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="opportunities_export.csv"'
-        response.write(u'\ufeff'.encode('utf8')) 
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Tên Giao dịch', 'Khách hàng', 'Giá trị', 'Ngày đóng', 'Giai đoạn', 'Trạng thái', 'Người phụ trách', 'Ngày tạo'])
-        for opp in queryset:
-            writer.writerow([
-                str(opp.id), opp.title, opp.customer.name if opp.customer else '', opp.value,
-                opp.expected_close_date, opp.stage.name if opp.stage else '',
-                opp.get_status_display(), opp.owner.username if opp.owner else '',
-                opp.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            ])
+        rows = queryset.using(self.read_db).order_by('id').values_list(*self.columns).iterator(chunk_size=self.chunk_size)
+
+        content = self.iter_csv(rows)
+        filename = 'opportunities_export.csv'
+        if request.query_params.get('gzip') in ('1', 'true'):
+            content = self.iter_gzip(content)
+            filename += '.gz'
+            response = StreamingHttpResponse(content, content_type='application/gzip')
+        else:
+            response = StreamingHttpResponse(content, content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
-    
+
+    def iter_csv(self, rows):
+        status_labels = dict(Opportunity.Status.choices)
+        writer = csv.writer(Echo())
+        yield (u'\ufeff' + writer.writerow(self.header)).encode('utf8')
+        batch = []
+        for opp_id, title, customer_name, value, close_date, stage_name, status, owner_name, created_at in rows:
+            batch.append(writer.writerow([
+                str(opp_id), title, customer_name or '', value,
+                close_date, stage_name or '',
+                status_labels.get(status, status), owner_name or '',
+                created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            ]))
+            if len(batch) >= self.chunk_size:
+                yield ''.join(batch).encode('utf8')
+                batch = []
+        if batch:
+            yield ''.join(batch).encode('utf8')
+
+    def iter_gzip(self, chunks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: định dạng gzip
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+# --- KANBAN BOARD: cột theo giai đoạn + phân trang keyset từng cột ---
+BOARD_CARD_FIELDS = ('id', 'title', 'value', 'expected_close_date', 'status', 'stage', 'customer_name', 'owner_name')
+BOARD_CARD_ORDERING = ('-created_at', '-id')
+
+
+def encode_board_cursor(card):
+    raw = f"{card['created_at'].isoformat()}|{card['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_board_cursor(cursor):
+    """Trả về (created_at, id) của thẻ cuối trang trước, ValueError nếu cursor hỏng."""
+    try:
+        created_at, opp_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        opp_id = int(opp_id)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Cursor không hợp lệ")
+    if created_at is None:
+        raise ValueError("Cursor không hợp lệ")
+    return created_at, opp_id
+
+
+class KanbanBoardView(APIView):
+    """
+    Trả về toàn bộ Pipeline theo cột (mỗi giai đoạn một cột) với số query cố định:
+    - 1 query lấy giai đoạn, 1 query tổng hợp count/sum theo giai đoạn,
+      1 query lấy `limit` thẻ đầu mỗi cột: UNION ALL các lát LIMIT theo từng giai đoạn,
+      mỗi lát là một lần quét index (stage, created_at, id) / (owner, stage, created_at, id).
+    - ?stage=<id>&cursor=<...>: tải thêm thẻ của một cột (keyset trên cùng index, không OFFSET/COUNT).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_limit = 20
+    max_limit = 200
+
+    def get_base_queryset(self, request):
+        user = request.user
+        queryset = Opportunity.objects.all()
+        if user.role == 'REP':
+            queryset = queryset.filter(owner=user)
+        owner = request.query_params.get('owner')
+        if owner:
+            queryset = queryset.filter(owner_id=owner)
+        return queryset
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def card_values(self, queryset):
+        return queryset.annotate(
+            customer_name=F('customer__name'),
+            owner_name=F('owner__username'),
+        ).values(*BOARD_CARD_FIELDS, 'created_at')
+
+    def first_page(self, queryset, stage_ids, limit):
+        """Queryset `limit + 1` thẻ mới nhất của mỗi giai đoạn (thẻ dư để biết còn trang sau)."""
+        slices = [self.card_values(queryset.filter(stage_id=stage_id)).order_by(*BOARD_CARD_ORDERING) for stage_id in stage_ids]
+        if not connections[queryset.db].features.supports_slicing_ordering_in_compound:
+            # SQLite không cho LIMIT trong từng vế UNION: đánh số trong cột (quét cả bảng, chỉ dùng khi dev)
+            return self.card_values(queryset).annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=[F('stage')],
+                    order_by=[F('created_at').desc(), F('id').desc()],
+                )
+            ).filter(row_number__lte=limit + 1)
+        first, *rest = [part[:limit + 1] for part in slices]
+        return first.union(*rest, all=True)
+
+    def build_page(self, cards, limit):
+        """Cắt về `limit` thẻ (đã lấy dư 1 để biết còn trang sau) và sinh next_cursor."""
+        has_more = len(cards) > limit
+        cards = cards[:limit]
+        next_cursor = encode_board_cursor(cards[-1]) if has_more else None
+        for card in cards:
+            card.pop('created_at', None)
+            card.pop('row_number', None)
+        return cards, next_cursor
+
+    def get(self, request):
+        queryset = self.get_base_queryset(request)
+        limit = self.get_limit(request)
+
+        stage_id = request.query_params.get('stage')
+        if stage_id:
+            if not stage_id.isdigit():
+                return Response({"error": "Giai đoạn không hợp lệ"}, status=400)
+            return self.get_column_page(request, queryset, stage_id, limit)
+
+        stages = list(PipelineStage.objects.values('id', 'name', 'order', 'type'))
+
+        totals = {
+            row['stage']: row
+            for row in queryset.order_by().values('stage').annotate(count=Count('id'), total_value=Sum('value'))
+        }
+
+        cards_by_stage = {}
+        if stages:
+            for card in self.first_page(queryset, [stage['id'] for stage in stages], limit):
+                cards_by_stage.setdefault(card['stage'], []).append(card)
+        for cards in cards_by_stage.values():
+            # UNION ALL không giữ thứ tự của từng lát
+            cards.sort(key=lambda card: (card['created_at'], card['id']), reverse=True)
+
+        columns = []
+        for stage in stages:
+            cards, next_cursor = self.build_page(cards_by_stage.get(stage['id'], []), limit)
+            stage_totals = totals.get(stage['id'], {})
+            columns.append({
+                "stage": stage,
+                "count": stage_totals.get('count', 0),
+                "total_value": stage_totals.get('total_value') or 0,
+                "cards": cards,
+                "next_cursor": next_cursor,
+            })
+
+        return Response({"columns": columns})
+
+    def get_column_page(self, request, queryset, stage_id, limit):
+        queryset = queryset.filter(stage_id=stage_id)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                created_at, opp_id = decode_board_cursor(cursor)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=opp_id))
+
+        cards = list(self.card_values(queryset).order_by(*BOARD_CARD_ORDERING)[:limit + 1])
+        cards, next_cursor = self.build_page(cards, limit)
+        return Response({"stage": int(stage_id), "cards": cards, "next_cursor": next_cursor})
+
+
 class ImportCustomerView(APIView):
+    """
+    Nhập khách hàng từ CSV theo lô: đọc file từng dòng (không nạp cả file vào bộ nhớ),
+    mỗi lô `batch_size` dòng kiểm tra email đã tồn tại bằng 1 query IN
+    và ghi bằng bulk_create trong một transaction riêng.
+    """
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    batch_size = 1000
+
     def post(self, request):
         if 'file' not in request.FILES: return Response({"error": "Chưa chọn file"}, status=400)
         file = request.FILES['file']
         if not file.name.endswith('.csv'): return Response({"error": "Vui lòng upload file định dạng .csv"}, status=400)
+        count = 0
+        errors = []
         try:
-            decoded_file = file.read().decode('utf-8-sig')
-            io_string = io.StringIO(decoded_file)
-            reader = csv.DictReader(io_string)
-            count = 0
-            errors = []
+            reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+            seen_emails = set()
+            batch = []
             for index, row in enumerate(reader):
                 try:
-                    name = row.get('Tên Khách hàng') or row.get('name')
-                    email = row.get('Email') or row.get('email')
-                    phone = row.get('SĐT') or row.get('phone')
-                    if not name: continue
-                    obj, created = Customer.objects.get_or_create(email=email, defaults={'name': name, 'phone': phone})
-                    if created: count += 1
-                except Exception as e: errors.append(f"Dòng {index + 2}: {str(e)}")
-            return Response({"message": f"Đã nhập thành công {count} khách hàng.", "errors": errors})
-        except Exception as e: return Response({"error": f"Lỗi đọc file: {str(e)}"}, status=400)
\ No newline at end of file
+                    customer = self.parse_row(row)
+                except ValueError as e:
+                    errors.append(f"Dòng {index + 2}: {str(e)}")
+                    continue
+                if customer is None: continue
+                # Email trùng trong cùng file: chỉ tạo dòng đầu tiên
+                if customer.email:
+                    if customer.email in seen_emails: continue
+                    seen_emails.add(customer.email)
+                batch.append((index, customer))
+                if len(batch) >= self.batch_size:
+                    count += self.write_batch(batch, errors)
+                    batch = []
+            if batch:
+                count += self.write_batch(batch, errors)
+        except Exception as e:
+            return Response({"error": f"Lỗi đọc file: {str(e)}", "imported": count}, status=400)
+        finally:
+            if count:
+                invalidate_new_customers()
+        return Response({"message": f"Đã nhập thành công {count} khách hàng.", "errors": errors})
+
+    def parse_row(self, row):
+        """Trả về Customer chưa lưu (hoặc None nếu dòng không có tên), ValueError nếu dữ liệu sai."""
+        name = (row.get('Tên Khách hàng') or row.get('name') or '').strip()
+        email = (row.get('Email') or row.get('email') or '').strip().lower() or None
+        phone = (row.get('SĐT') or row.get('phone') or '').strip() or None
+        if not name: return None
+        if len(name) > CUSTOMER_NAME_MAX_LENGTH:
+            raise ValueError(f"Tên khách hàng dài quá {CUSTOMER_NAME_MAX_LENGTH} ký tự")
+        if phone and len(phone) > CUSTOMER_PHONE_MAX_LENGTH:
+            raise ValueError(f"SĐT dài quá {CUSTOMER_PHONE_MAX_LENGTH} ký tự")
+        if email:
+            try:
+                validate_email(email)
+            except DjangoValidationError:
+                raise ValueError(f"Email không hợp lệ: {email}")
+        return Customer(name=name, email=email, phone=phone)
+
+    def write_batch(self, batch, errors):
+        emails = [customer.email for _, customer in batch if customer.email]
+        try:
+            with transaction.atomic():
+                existing = set(
+                    Customer.objects.annotate(email_lower=Lower('email'))
+                    .filter(email_lower__in=emails)
+                    .values_list('email_lower', flat=True)
+                ) if emails else set()
+                new_customers = [customer for _, customer in batch if customer.email not in existing]
+                Customer.objects.bulk_create(new_customers)
+        except DatabaseError as e:
+            first, last = batch[0][0] + 2, batch[-1][0] + 2
+            errors.append(f"Dòng {first}-{last}: {str(e)}")
+            return 0
+        return len(new_customers)
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser
+from .authentication import revoke_tokens
+from .models import AuthToken, CustomUser
 
 # Đăng ký CustomUser để hiển thị trong Admin
 class CustomUserAdmin(UserAdmin):
@@ -12,4 +13,20 @@ class CustomUserAdmin(UserAdmin):
     )
     list_display = ('username', 'email', 'role', 'is_staff')
 
-admin.site.register(CustomUser, CustomUserAdmin)
\ No newline at end of file
+admin.site.register(CustomUser, CustomUserAdmin)
+
+@admin.register(AuthToken)
+class AuthTokenAdmin(admin.ModelAdmin):
+    # Chỉ lưu hash: không tạo/sửa token ở đây, chỉ xem và thu hồi
+    list_display = ('user', 'name', 'created_at', 'expires_at', 'revoked_at')
+    list_filter = ('revoked_at',)
+    search_fields = ('user__username', 'name')
+    readonly_fields = ('user', 'key_hash', 'name', 'created_at', 'expires_at', 'revoked_at')
+    actions = ['revoke']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Thu hồi token đã chọn")
+    def revoke(self, request, queryset):
+        self.message_user(request, f"Đã thu hồi {revoke_tokens(queryset)} token.")
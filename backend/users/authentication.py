@@ -0,0 +1,138 @@
+"""
+Xác thực bằng token (thay cho BasicAuthentication: Basic chạy lại PBKDF2 ở mỗi request,
+tốn hàng trăm ms CPU một lần). Mật khẩu chỉ được kiểm tra một lần khi cấp token.
+
+Token được tra theo SHA-256 và giữ trong bộ nhớ process AUTH_TOKEN_CACHE_SECONDS giây:
+request trong khoảng đó không query DB. Mỗi user có một dấu (stamp) trong cache dùng chung
+AUTH_USER_CACHE_ALIAS, đổi mỗi khi token của user bị thu hồi hoặc user thay đổi; mỗi request so dấu
+lưu kèm token với dấu hiện tại (một lần đọc cache, không query DB), khác thì đọc lại từ DB.
+Nhờ vậy thu hồi có hiệu lực ngay ở mọi process. Hạn dùng được kiểm tra ở mọi request.
+"""
+import copy
+import hashlib
+import secrets
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .backends import get_user_cache
+from .models import AuthToken
+
+DEFAULT_TOKEN_TTL = timedelta(days=7)
+DEFAULT_CACHE_SECONDS = 60
+MAX_CACHED_TOKENS = 10000
+
+# key_hash -> (token, user, hết hạn cache theo time.monotonic(), dấu của user lúc đọc)
+_token_cache = {}
+
+
+def hash_token(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue_token(user, name=''):
+    """Tạo token mới; trả về (chuỗi token gửi cho client, AuthToken). Chuỗi token không được lưu lại."""
+    key = secrets.token_urlsafe(32)
+    token = AuthToken.objects.create(
+        user=user, key_hash=hash_token(key), name=name,
+        expires_at=timezone.now() + getattr(settings, 'AUTH_TOKEN_TTL', DEFAULT_TOKEN_TTL),
+    )
+    return key, token
+
+
+def stamp_key(user_id):
+    return f'auth:tokens:{user_id}'
+
+
+def get_stamp(user_id):
+    return get_user_cache().get(stamp_key(user_id))
+
+
+def bump_stamps(user_ids):
+    """Đổi dấu của các user: mọi process đọc lại token của các user này từ DB ở request sau."""
+    # Dấu hết hạn (hoặc bị cache loại) cũng chỉ làm token được đọc lại: chỉ cần sống lâu bằng bản trong process
+    ttl = getattr(settings, 'AUTH_TOKEN_CACHE_SECONDS', DEFAULT_CACHE_SECONDS)
+    stamp = secrets.token_hex(8)
+    get_user_cache().set_many({stamp_key(user_id): stamp for user_id in user_ids}, ttl)
+
+
+def revoke_tokens(tokens):
+    """Thu hồi các token (queryset AuthToken): xóa ngay khỏi cache của process này, các process khác sau khi commit."""
+    revoked = list(tokens.filter(revoked_at__isnull=True).values_list('key_hash', 'user_id'))
+    AuthToken.objects.filter(key_hash__in=[key_hash for key_hash, _ in revoked]).update(revoked_at=timezone.now())
+    for key_hash, _ in revoked:
+        _token_cache.pop(key_hash, None)
+    user_ids = {user_id for _, user_id in revoked}
+    if user_ids:
+        # Đổi dấu trước khi commit thì process khác có thể đọc lại bản chưa thu hồi và giữ với dấu mới
+        transaction.on_commit(lambda: bump_stamps(user_ids))
+    return len(revoked)
+
+
+def forget_user_tokens(user_id):
+    """User vừa đổi (role, mật khẩu, khóa tài khoản...): mọi process đọc lại token của user từ DB."""
+    for key_hash, (token, *_) in list(_token_cache.items()):
+        if token.user_id == user_id:
+            _token_cache.pop(key_hash, None)
+    bump_stamps([user_id])
+
+
+def clear_token_cache():
+    _token_cache.clear()
+
+
+class CachedTokenAuthentication(BaseAuthentication):
+    keywords = (b'bearer', b'token')
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() not in self.keywords:
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed("Header Authorization không hợp lệ")
+        try:
+            key_hash = hash_token(auth[1].decode())
+        except UnicodeError:
+            raise AuthenticationFailed("Token không hợp lệ")
+
+        cached = _token_cache.get(key_hash)
+        if cached is None or cached[2] < time.monotonic():
+            cached = self.load(key_hash)
+        else:
+            stamp = get_stamp(cached[0].user_id)
+            if stamp != cached[3]:
+                cached = self.load(key_hash, stamp)
+        token, user, *_ = cached
+
+        if token.expires_at <= timezone.now():
+            _token_cache.pop(key_hash, None)
+            raise AuthenticationFailed("Token đã hết hạn")
+        if not user.is_active:
+            raise AuthenticationFailed("Tài khoản đã bị khóa")
+        # Bản sao: view có thể sửa request.user, không được làm đổi bản trong cache dùng chung giữa các request
+        return copy.copy(user), token
+
+    def load(self, key_hash, stamp=None):
+        # Dấu phải đọc trước DB (dấu đổi sau khi thu hồi commit); token chưa có trong cache thì chưa biết user,
+        # đọc dấu ngay sau: chỉ lệch nếu việc thu hồi commit đúng giữa hai lần đọc
+        token = AuthToken.objects.select_related('user').filter(key_hash=key_hash, revoked_at__isnull=True).first()
+        if token is None:
+            _token_cache.pop(key_hash, None)
+            raise AuthenticationFailed("Token không hợp lệ hoặc đã bị thu hồi")
+        if stamp is None:
+            stamp = get_stamp(token.user_id)
+        if len(_token_cache) >= MAX_CACHED_TOKENS:
+            _token_cache.clear()
+        # Dùng lại tới hết TTL: không cho lưu cả dòng từ bản đã cũ (CustomUser.save)
+        token.user._cached_snapshot = True
+        ttl = getattr(settings, 'AUTH_TOKEN_CACHE_SECONDS', DEFAULT_CACHE_SECONDS)
+        cached = _token_cache[key_hash] = (token, token.user, time.monotonic() + ttl, stamp)
+        return cached
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,52 @@
+"""
+Backend xác thực có cache cho request dùng session.
+
+Mỗi request dùng session, AuthenticationMiddleware gọi get_user(): mặc định là một SELECT
+bảng user. Ở đây chỉ giữ một bản tóm tắt (các trường USER_CACHE_FIELDS: id, username,
+email, role, quyền, hash mật khẩu để Django đối chiếu session) trong cache AUTH_USER_CACHE_ALIAS
+(dùng chung giữa các process: xóa ở một worker là mọi worker đọc lại từ DB), nên kiểm tra quyền/role (IsManagerOrAdmin, user.role == 'REP') không cần đọc DB khi session đã ấm.
+User dựng từ bản tóm tắt qua from_db(): các trường còn lại là deferred (đọc lười nếu có code cần).
+Bản tóm tắt có thể đã cũ nên user này chỉ lưu được với update_fields (CustomUser.save).
+Bản tóm tắt bị xóa khi user được lưu/xóa (users/signals.py).
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import router
+
+UserModel = get_user_model()
+
+DEFAULT_CACHE_SECONDS = 60
+# Theo thứ tự khai báo trong model (from_db cần đúng thứ tự này)
+USER_CACHE_FIELDS = tuple(
+    field.attname for field in UserModel._meta.concrete_fields
+    if field.attname in {'id', 'password', 'username', 'email', 'role', 'is_active', 'is_staff', 'is_superuser'}
+)
+
+
+def get_user_cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_user(user_id):
+    get_user_cache().delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        cache = get_user_cache()
+        key = user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            values = UserModel._default_manager.filter(pk=user_id).values_list(*USER_CACHE_FIELDS).first()
+            if values is None:
+                return None
+            cache.set(key, values, getattr(settings, 'AUTH_USER_CACHE_SECONDS', DEFAULT_CACHE_SECONDS))
+        user = UserModel.from_db(router.db_for_read(UserModel), USER_CACHE_FIELDS, values)
+        user._cached_snapshot = True
+        return user if self.user_can_authenticate(user) else None
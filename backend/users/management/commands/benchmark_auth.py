@@ -0,0 +1,54 @@
+import base64
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.test import APIRequestFactory
+from users.authentication import CachedTokenAuthentication, clear_token_cache, issue_token
+from users.models import CustomUser
+from users.views import CurrentUserView
+
+PASSWORD = 'benchmark-password-123'
+
+
+class Command(BaseCommand):
+    help = (
+        'So sánh số request/giây trên một core của GET /api/auth/me/ khi xác thực bằng Basic Auth '
+        '(PBKDF2 mỗi request) và bằng token (tra cache trong process). Dữ liệu tạm được rollback.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=3.0, help='Số giây đo cho mỗi kiểu xác thực')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = CustomUser.objects.create_user(username='__benchmark_auth__', password=PASSWORD)
+            key, _ = issue_token(user, 'benchmark')
+            basic = base64.b64encode(f'{user.username}:{PASSWORD}'.encode()).decode()
+            clear_token_cache()
+            results = [
+                self.measure('basic', BasicAuthentication, f'Basic {basic}', options['duration']),
+                self.measure('token', CachedTokenAuthentication, f'Bearer {key}', options['duration']),
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{'Kiểu':<8}{'Request':>10}{'CPU (s)':>10}{'Req/s/core':>14}{'Trung bình':>14}")
+        for name, count, cpu in results:
+            self.stdout.write(f"{name:<8}{count:>10}{cpu:>10.2f}{count / cpu:>14.0f}{cpu / count * 1000:>12.3f}ms")
+        speedup = (results[1][1] / results[1][2]) / (results[0][1] / results[0][2])
+        self.stdout.write(self.style.SUCCESS(f"Token nhanh hơn Basic {speedup:.0f} lần trên mỗi core"))
+
+    def measure(self, name, authentication_class, header, duration):
+        """Gọi view thật qua APIRequestFactory trên một luồng; CPU time của process = thời gian của một core."""
+        view = CurrentUserView.as_view(authentication_classes=[authentication_class])
+        request_factory = APIRequestFactory()
+        count = 0
+        started = time.process_time()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            response = view(request_factory.get('/api/auth/me/', HTTP_AUTHORIZATION=header))
+            if response.status_code != 200:
+                raise CommandError(f"{name}: HTTP {response.status_code} {response.data}")
+            count += 1
+        return name, count, time.process_time() - started
@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser
+from django.conf import settings
 from django.db import models
 
 class CustomUser(AbstractUser):
@@ -12,5 +13,29 @@ class CustomUser(AbstractUser):
         default=Role.SALES_REP
     )
 
+    # User dựng từ cache xác thực (users/backends.py, users/authentication.py) có thể đã cũ
+    # tới vài chục giây: chỉ được lưu các trường chỉ định rõ, không ghi đè cả dòng
+    _cached_snapshot = False
+
+    def save(self, *args, **kwargs):
+        if self._cached_snapshot and kwargs.get('update_fields') is None:
+            raise ValueError("User lấy từ cache xác thực: cần save(update_fields=[...]) hoặc đọc lại user từ DB")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.username} ({self.get_role_display()})"
+
+class AuthToken(models.Model):
+    """
+    Token API (header `Authorization: Bearer <token>`). Chỉ lưu SHA-256 của token:
+    token là chuỗi ngẫu nhiên 256 bit nên không cần hàm băm chậm như mật khẩu.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='auth_tokens')
+    key_hash = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=100, blank=True, verbose_name="Tên (ứng dụng/thiết bị)")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name="Hết hạn lúc")
+    revoked_at = models.DateTimeField(null=True, blank=True, verbose_name="Thu hồi lúc")
+
     def __str__(self):
-        return f"{self.username} ({self.get_role_display()})"
\ No newline at end of file
+        return f"{self.user} - {self.name or self.pk}"
@@ -0,0 +1,22 @@
+"""Xóa bản tóm tắt user đã cache (session và token) khi user được lưu/xóa, sau khi transaction commit."""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_user_tokens
+from .backends import USER_CACHE_FIELDS, forget_user
+from .models import CustomUser
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidate_cached_user(sender, instance, update_fields=None, **kwargs):
+    # Đăng nhập chỉ ghi last_login (không có trong bản tóm tắt): không cần xóa
+    if update_fields and not set(update_fields) & set(USER_CACHE_FIELDS):
+        return
+    user_id = instance.pk
+
+    def invalidate():
+        forget_user(user_id)
+        forget_user_tokens(user_id)
+
+    transaction.on_commit(invalidate)
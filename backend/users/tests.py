@@ -1,3 +1,197 @@
-from django.test import TestCase
+import base64
+import io
+import subprocess
+import sys
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from .authentication import CachedTokenAuthentication, bump_stamps, clear_token_cache, hash_token, issue_token
+from .backends import CachedModelBackend, forget_user, get_user_cache, user_cache_key
+from .models import AuthToken, CustomUser
+
+
+class TokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        clear_token_cache()
+        get_user_cache().clear()
+        self.addCleanup(get_user_cache().clear)
+        self.user = CustomUser.objects.create_user(username='sales_a', password='password123', role='REP')
+
+    def login(self, password='password123'):
+        return self.client.post('/api/auth/token/', {'username': 'sales_a', 'password': password, 'name': 'script'})
+
+    def use(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_issue_and_use_token_without_db_hit(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 201)
+        token = response.data['token']
+        # Chỉ lưu hash
+        self.assertTrue(AuthToken.objects.filter(key_hash=hash_token(token), user=self.user).exists())
+        self.assertFalse(AuthToken.objects.filter(key_hash=token).exists())
+
+        self.use(token)
+        self.assertEqual(self.client.get('/api/auth/me/').data['username'], 'sales_a')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_wrong_password(self):
+        self.assertEqual(self.login('sai-mat-khau').status_code, 400)
+
+    def test_revoke(self):
+        token = self.login().data['token']
+        self.use(token)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.assertEqual(self.client.post('/api/auth/token/revoke/').data['revoked'], 1)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 403)
+
+    def test_revoke_in_other_process(self):
+        token = self.login().data['token']
+        self.use(token)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        # Process khác thu hồi: ghi DB rồi đổi dấu trong cache dùng chung, không chạm tới bộ nhớ của process này
+        AuthToken.objects.update(revoked_at=timezone.now())
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        bump_stamps([self.user.pk])
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 403)
+
+    def test_unchanged_stamp_keeps_cache(self):
+        self.use(self.login().data['token'])
+        self.client.get('/api/auth/me/')
+        bump_stamps([self.user.pk + 1])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_expired_token_rejected_even_when_cached(self):
+        token = self.login().data['token']
+        self.use(token)
+        self.client.get('/api/auth/me/')
+        later = timezone.now() + timedelta(days=8)
+        with mock.patch('users.authentication.timezone.now', return_value=later):
+            self.assertEqual(self.client.get('/api/auth/me/').status_code, 403)
+
+    def test_password_change_revokes_other_tokens(self):
+        current, other = self.login().data['token'], self.login().data['token']
+        self.use(current)
+        response = self.client.put('/api/auth/change-password/', {'old_password': 'password123', 'new_password': 'matkhaumoi456'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.use(other)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 403)
+
+    def test_basic_auth_disabled(self):
+        basic = base64.b64encode(b'sales_a:password123').decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Basic {basic}')
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 403)
+
+
+class CachedSessionUserTests(APITestCase):
+    def setUp(self):
+        # Test được rollback, không có on_commit: bản tóm tắt user trong cache phải dọn tay
+        get_user_cache().clear()
+        self.addCleanup(get_user_cache().clear)
+        clear_token_cache()
+        self.manager = CustomUser.objects.create_user(username='manager_a', password='password123', role='MANAGER')
+        self.rep = CustomUser.objects.create_user(username='sales_b', password='password123', role='REP')
+
+    def test_warm_session_has_no_queries(self):
+        self.client.login(username='manager_a', password='password123')
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.data['role'], 'MANAGER')
+        self.assertEqual(len(queries), 0)
+
+    def test_snapshot_shared_between_processes(self):
+        def cached_in_other_process():
+            script = (
+                "from django.core.cache import caches; from django.conf import settings; "
+                f"print(caches[settings.AUTH_USER_CACHE_ALIAS].get({user_cache_key(self.rep.pk)!r}) is not None)"
+            )
+            result = subprocess.run([sys.executable, 'manage.py', 'shell', '-v', '0', '-c', script], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, check=True)
+            return result.stdout.strip() == 'True'
+
+        CachedModelBackend().get_user(self.rep.pk)
+        self.assertTrue(cached_in_other_process())
+        forget_user(self.rep.pk)
+        self.assertFalse(cached_in_other_process())
+
+    def test_role_change_applies_immediately(self):
+        rep = APIClient()
+        rep.login(username='sales_b', password='password123')
+        self.assertEqual(rep.get('/api/auth/users/').status_code, 403)
+
+        self.client.login(username='manager_a', password='password123')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/auth/users/{self.rep.pk}/', {'role': 'MANAGER'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(rep.get('/api/auth/users/').status_code, 200)
+
+    def test_profile_edit_refreshes_snapshot(self):
+        self.client.login(username='sales_b', password='password123')
+        self.client.get('/api/auth/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/auth/me/', {'email': 'moi@example.com'})
+        self.assertEqual(self.client.get('/api/auth/me/').data['email'], 'moi@example.com')
+        self.assertEqual(CustomUser.objects.get(pk=self.rep.pk).first_name, '')
+
+    def test_stale_snapshot_does_not_overwrite_row(self):
+        self.client.login(username='sales_b', password='password123')
+        self.client.get('/api/auth/me/')
+        # Đổi role ở nơi khác, bản tóm tắt trong cache chưa kịp xóa (process khác, chưa commit...)
+        CustomUser.objects.filter(pk=self.rep.pk).update(role='MANAGER', first_name='Bình')
+        self.client.put('/api/auth/change-password/', {'old_password': 'password123', 'new_password': 'matkhaumoi456'})
+        self.client.put('/api/auth/me/', {'email': 'moi@example.com'})
+        rep = CustomUser.objects.get(pk=self.rep.pk)
+        self.assertEqual((rep.role, rep.first_name, rep.email), ('MANAGER', 'Bình', 'moi@example.com'))
+        self.assertTrue(rep.check_password('matkhaumoi456'))
+
+    def test_cached_users_refuse_full_saves(self):
+        snapshot = CachedModelBackend().get_user(self.rep.pk)
+        key, _ = issue_token(self.rep)
+        token_user = CachedTokenAuthentication().authenticate(RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {key}'))[0]
+        for user in (snapshot, token_user):
+            with self.assertRaises(ValueError):
+                user.save()
+            user.save(update_fields=['email'])
+
+    def test_password_change_logs_out_other_sessions(self):
+        other = APIClient()
+        other.login(username='sales_b', password='password123')
+        self.assertEqual(other.get('/api/auth/me/').status_code, 200)
+
+        self.client.login(username='sales_b', password='password123')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/api/auth/change-password/', {'old_password': 'password123', 'new_password': 'matkhaumoi456'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(other.get('/api/auth/me/').status_code, 403)
+
+    def test_last_login_does_not_invalidate(self):
+        self.client.login(username='sales_b', password='password123')
+        self.client.get('/api/auth/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            APIClient().login(username='sales_b', password='password123')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/auth/me/')
+        self.assertEqual(len(queries), 0)
+
+
+class BenchmarkAuthTests(TestCase):
+    def test_reports_both_modes(self):
+        out = io.StringIO()
+        call_command('benchmark_auth', '--duration', '0.01', stdout=out)
+        self.assertIn('basic', out.getvalue())
+        self.assertIn('token', out.getvalue())
+        self.assertFalse(CustomUser.objects.filter(username='__benchmark_auth__').exists())
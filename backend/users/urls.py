@@ -2,7 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     RegisterView, CurrentUserView, UserViewSet, ChangePasswordView,
-    PasswordResetRequestView, PasswordResetConfirmView # <--- Đã import đầy đủ
+    PasswordResetRequestView, PasswordResetConfirmView, # <--- Đã import đầy đủ
+    IssueTokenView, RevokeTokenView,
 )
 
 router = DefaultRouter()
@@ -11,6 +12,8 @@ router.register(r'users', UserViewSet)
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='auth_register'),
     path('me/', CurrentUserView.as_view(), name='auth_me'),
+    path('token/', IssueTokenView.as_view(), name='auth_token'),
+    path('token/revoke/', RevokeTokenView.as_view(), name='auth_token_revoke'),
     path('change-password/', ChangePasswordView.as_view(), name='auth_change_password'),
     
     # URL Quên mật khẩu
@@ -4,12 +4,15 @@ from rest_framework.views import APIView
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
-from django.core.mail import send_mail
-from .models import CustomUser
+from sales_pipeline.outbox import enqueue_mail
+from sales_pipeline.versioning import VersionedListMixin
+from django.contrib.auth import authenticate
+from .authentication import issue_token, revoke_tokens
+from .models import AuthToken, CustomUser
 from .permissions import IsManagerOrAdmin
 from .serializers import (
     RegisterSerializer, UserSerializer, ChangePasswordSerializer,
-    PasswordResetRequestSerializer, PasswordResetConfirmSerializer
+    PasswordResetRequestSerializer, PasswordResetConfirmSerializer, TokenRequestSerializer
 )
 
 # 1. View Đăng ký (Register)
@@ -27,7 +30,8 @@ class CurrentUserView(APIView):
         return Response(serializer.data)
 
     def put(self, request):
-        user = request.user
+        # request.user có thể lấy từ cache xác thực (đã cũ): sửa trên bản đọc lại từ DB
+        user = CustomUser.objects.get(pk=request.user.pk)
         serializer = UserSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
@@ -35,7 +39,7 @@ class CurrentUserView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # 3. View Quản lý Nhân viên (User CRUD)
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(VersionedListMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     permission_classes = [IsManagerOrAdmin]
 
@@ -58,7 +62,13 @@ class ChangePasswordView(generics.UpdateAPIView):
             return Response({"old_password": ["Mật khẩu cũ không đúng."]}, status=status.HTTP_400_BAD_REQUEST)
 
         user.set_password(serializer.validated_data['new_password'])
-        user.save()
+        # request.user có thể lấy từ cache xác thực: chỉ ghi mật khẩu, không ghi đè các trường khác bằng bản cũ
+        user.save(update_fields=['password'])
+        # Thu hồi các token khác, giữ token đang dùng (nếu có)
+        other_tokens = user.auth_tokens.all()
+        if isinstance(request.auth, AuthToken):
+            other_tokens = other_tokens.exclude(pk=request.auth.pk)
+        revoke_tokens(other_tokens)
 
         return Response({"message": "Đổi mật khẩu thành công!"}, status=status.HTTP_200_OK)
 
@@ -82,10 +92,10 @@ class PasswordResetRequestView(APIView):
                 print(reset_link)
                 print("---------------------------------------\n")
                 
-                send_mail(
+                # Đưa vào hàng đợi email (run_mail_worker gửi), request không chờ SMTP
+                enqueue_mail(
                     subject="Yêu cầu đặt lại mật khẩu - Core CRM",
                     message=f"Link đặt lại mật khẩu: {reset_link}",
-                    from_email=None,
                     recipient_list=[email],
                 )
 
@@ -104,5 +114,33 @@ class PasswordResetConfirmView(APIView):
             new_password = serializer.validated_data['new_password']
             user.set_password(new_password)
             user.save()
+            revoke_tokens(user.auth_tokens.all())
             return Response({"message": "Đặt lại mật khẩu thành công!"}, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+# 7. Token API: kiểm tra mật khẩu một lần khi cấp, các request sau gửi `Authorization: Bearer <token>`
+class IssueTokenView(APIView):
+    permission_classes = [permissions.AllowAny]
+    # Không xác thực header cũ (token hết hạn) khi đăng nhập lại
+    authentication_classes = []
+
+    def post(self, request):
+        serializer = TokenRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = authenticate(request, username=serializer.validated_data['username'], password=serializer.validated_data['password'])
+        if user is None:
+            return Response({"error": "Sai tên đăng nhập hoặc mật khẩu"}, status=status.HTTP_400_BAD_REQUEST)
+        key, token = issue_token(user, serializer.validated_data.get('name', ''))
+        return Response({"token": key, "expires_at": token.expires_at}, status=status.HTTP_201_CREATED)
+
+class RevokeTokenView(APIView):
+    """Thu hồi token đang dùng (đăng xuất); ?all=1 để thu hồi mọi token của tài khoản."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if request.query_params.get('all') in ('1', 'true'):
+            revoked = revoke_tokens(request.user.auth_tokens.all())
+        elif isinstance(request.auth, AuthToken):
+            revoked = revoke_tokens(AuthToken.objects.filter(pk=request.auth.pk))
+        else:
+            return Response({"error": "Request không dùng token"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"revoked": revoked})
@@ -25,12 +25,12 @@ export const AuthProvider = ({ children }) => {
   // Hàm Đăng nhập
   const login = async (username, password) => {
     try {
-      // 1. Tạo Token Basic Auth
-      const token = btoa(`${username}:${password}`); 
-      
-      // 2. Lưu tạm token để axiosClient có thể dùng ngay
-      localStorage.setItem('access_token', token);
-      localStorage.setItem('auth_type', 'basic');
+      // 1. Đổi username/password lấy token (mật khẩu chỉ gửi một lần)
+      const res = await axiosClient.post('auth/token/', { username, password, name: 'web' });
+
+      // 2. Lưu token để axiosClient gửi kèm (Authorization: Bearer ...)
+      localStorage.setItem('access_token', res.data.token);
+      localStorage.setItem('auth_type', 'token');
 
       // 3. Gọi API /auth/me/ để kiểm tra token và lấy Role
       const success = await fetchUserInfo();
@@ -50,6 +50,11 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    // Thu hồi token phía server (không chờ kết quả). Gắn header trực tiếp vì token bị xóa khỏi localStorage ngay sau đây
+    const token = localStorage.getItem('access_token');
+    if (token && localStorage.getItem('auth_type') === 'token') {
+      axiosClient.post('auth/token/revoke/', null, { headers: { Authorization: `Bearer ${token}` } }).catch(() => {});
+    }
     localStorage.removeItem('access_token');
     localStorage.removeItem('auth_type');
     setUser(null);
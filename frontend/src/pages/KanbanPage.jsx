@@ -21,6 +21,7 @@ const hideScrollbarStyle = `
 const KanbanPage = () => {
   const [stages, setStages] = useState([]);
   const [opportunities, setOpportunities] = useState([]);
+  const [columnMeta, setColumnMeta] = useState({});
   const [loading, setLoading] = useState(true);
   const navigate = useNavigate();
 
@@ -32,18 +33,18 @@ const KanbanPage = () => {
   const fetchData = async () => {
     setLoading(true);
     try {
-      const [stageRes, oppRes] = await Promise.all([
-        axiosClient.get('stages/'),
-        axiosClient.get('opportunities/?page_size=1000') 
-      ]);
-      
-      const stagesData = Array.isArray(stageRes.data) ? stageRes.data : (stageRes.data.results || []);
-      const oppsData = Array.isArray(oppRes.data) ? oppRes.data : (oppRes.data.results || []);
-
-      stagesData.sort((a, b) => a.order - b.order);
-
-      setStages(stagesData);
-      setOpportunities(oppsData);
+      // Một request duy nhất: cột theo giai đoạn + tổng số/tổng tiền + trang thẻ đầu tiên
+      const res = await axiosClient.get('board/');
+      const columns = res.data.columns || [];
+
+      const meta = {};
+      columns.forEach(col => {
+        meta[col.stage.id] = { count: col.count, total: parseFloat(col.total_value), nextCursor: col.next_cursor };
+      });
+
+      setStages(columns.map(col => col.stage));
+      setColumnMeta(meta);
+      setOpportunities(columns.flatMap(col => col.cards));
     } catch (error) {
       console.error("Lỗi tải Kanban:", error);
       message.error('Không thể tải dữ liệu Pipeline');
@@ -52,6 +53,23 @@ const KanbanPage = () => {
     }
   };
 
+  // Tải thêm thẻ cho một cột (phân trang keyset)
+  const loadMore = async (stageId) => {
+    const cursor = columnMeta[stageId]?.nextCursor;
+    if (!cursor) return;
+    try {
+      const res = await axiosClient.get(`board/?stage=${stageId}&cursor=${encodeURIComponent(cursor)}`);
+      // Bỏ thẻ đã có (vd. vừa kéo sang cột này): giữ bản đang hiển thị, tránh trùng key của Draggable
+      setOpportunities(prev => {
+        const loaded = new Set(prev.map(opp => opp.id));
+        return [...prev, ...res.data.cards.filter(card => !loaded.has(card.id))];
+      });
+      setColumnMeta(prev => ({ ...prev, [stageId]: { ...prev[stageId], nextCursor: res.data.next_cursor } }));
+    } catch (error) {
+      message.error('Không thể tải thêm deal');
+    }
+  };
+
   const onDragEnd = async (result) => {
     const { destination, source, draggableId } = result;
 
@@ -59,6 +77,8 @@ const KanbanPage = () => {
     if (destination.droppableId === source.droppableId && destination.index === source.index) return;
 
     const newStageId = parseInt(destination.droppableId);
+    const oldStageId = parseInt(source.droppableId);
+    const movedOpp = opportunities.find(opp => opp.id === parseInt(draggableId));
     
     // Optimistic Update
     const updatedOpps = opportunities.map(opp => {
@@ -69,6 +89,15 @@ const KanbanPage = () => {
     });
     setOpportunities(updatedOpps);
 
+    if (movedOpp && oldStageId !== newStageId) {
+      const value = parseFloat(movedOpp.value);
+      setColumnMeta(prev => ({
+        ...prev,
+        [oldStageId]: { ...prev[oldStageId], count: prev[oldStageId].count - 1, total: prev[oldStageId].total - value },
+        [newStageId]: { ...prev[newStageId], count: prev[newStageId].count + 1, total: prev[newStageId].total + value },
+      }));
+    }
+
     // API Call
     try {
       await axiosClient.patch(`opportunities/${draggableId}/`, { stage: newStageId });
@@ -81,8 +110,6 @@ const KanbanPage = () => {
 
   const getOppsByStage = (stageId) => opportunities.filter(op => op.stage === stageId);
 
-  const calculateTotal = (opps) => opps.reduce((sum, item) => sum + parseFloat(item.value), 0);
-
   if (loading) return <Spin tip="Đang tải Pipeline..." style={{ display: 'block', margin: '50px auto' }} />;
 
   return (
@@ -110,7 +137,8 @@ const KanbanPage = () => {
         >
           {stages.map(stage => {
             const stageOpps = getOppsByStage(stage.id);
-            const totalValue = calculateTotal(stageOpps);
+            const meta = columnMeta[stage.id] || { count: 0, total: 0, nextCursor: null };
+            const totalValue = meta.total;
 
             return (
               <div key={stage.id} style={{ 
@@ -126,7 +154,7 @@ const KanbanPage = () => {
                 <div style={{ marginBottom: 12, paddingBottom: 8, borderBottom: '2px solid #d9d9d9' }}>
                   <h4 style={{ margin: 0, textTransform: 'uppercase', fontSize: 13, color: '#5e6c84' }}>{stage.name}</h4>
                   <div style={{ display: 'flex', justifyContent: 'space-between', marginTop: 6, fontSize: 12 }}>
-                    <span style={{ fontWeight: 600 }}>{stageOpps.length} deals</span>
+                    <span style={{ fontWeight: 600 }}>{meta.count} deals</span>
                     <span style={{ color: '#3f8600', fontWeight: 'bold' }}>
                         {new Intl.NumberFormat('vi-VN', { compactDisplay: 'short', notation: 'compact' }).format(totalValue)}
                     </span>
@@ -212,6 +240,11 @@ const KanbanPage = () => {
                           </div>
                       )}
                       {provided.placeholder}
+                      {meta.nextCursor && (
+                          <Button type="link" block size="small" onClick={() => loadMore(stage.id)}>
+                              Tải thêm
+                          </Button>
+                      )}
                     </div>
                   )}
                 </Droppable>
@@ -22,10 +22,13 @@ const OpportunityDetailPage = () => {
 
   const [opportunity, setOpportunity] = useState(null);
   const [activities, setActivities] = useState([]);
+  const [activitiesNext, setActivitiesNext] = useState(null);
   const [stages, setStages] = useState([]);
   const [tasks, setTasks] = useState([]);
   
   const [items, setItems] = useState([]); 
+  const [changes, setChanges] = useState([]);
+  const [changesNext, setChangesNext] = useState(null);
   const [productsList, setProductsList] = useState([]); 
   
   const [loading, setLoading] = useState(false);
@@ -57,19 +60,16 @@ const OpportunityDetailPage = () => {
   const fetchDetail = async () => {
     setLoading(true);
     try {
-      const [oppRes, actRes, taskRes, itemRes] = await Promise.all([
-        axiosClient.get(`opportunities/${id}/`),
-        axiosClient.get(`activities/?opportunity=${id}`),
-        axiosClient.get(`tasks/?opportunity=${id}`),
-        axiosClient.get(`opportunity-items/?opportunity=${id}`) 
-      ]);
-      
-      setOpportunity(oppRes.data);
-      setActivities(Array.isArray(actRes.data) ? actRes.data : (actRes.data.results || []));
-      const taskList = Array.isArray(taskRes.data) ? taskRes.data : (taskRes.data.results || []);
-      setTasks(taskList.filter(t => !t.is_completed));
-      const itemList = Array.isArray(itemRes.data) ? itemRes.data : (itemRes.data.results || []);
-      setItems(itemList);
+      // Một request lấy deal + hoạt động + công việc + sản phẩm + lịch sử (trang đầu)
+      const { data } = await axiosClient.get(`opportunities/${id}/detail/`);
+
+      setOpportunity(data.opportunity);
+      setActivities(data.activities.results);
+      setActivitiesNext(data.activities.next);
+      setTasks(data.tasks.filter(t => !t.is_completed));
+      setItems(data.items);
+      setChanges(data.changes.results);
+      setChangesNext(data.changes.next);
     } catch (error) {
       message.error('Không tìm thấy giao dịch!');
       navigate(-1);
@@ -197,6 +197,36 @@ const OpportunityDetailPage = () => {
     } catch (error) { message.error('Lỗi khi lưu hoạt động'); } finally { setLogging(false); }
   };
 
+  const loadMoreActivities = async () => {
+    try {
+      const res = await axiosClient.get(activitiesNext);
+      setActivities(prev => [...prev, ...res.data.results]);
+      setActivitiesNext(res.data.next);
+    } catch (error) { message.error('Lỗi tải hoạt động'); }
+  };
+
+  // Lịch sử thay đổi: phân trang bằng cursor (link `next` do API trả về)
+  const loadMoreChanges = async () => {
+    try {
+      const res = await axiosClient.get(changesNext);
+      setChanges(prev => [...prev, ...res.data.results]);
+      setChangesNext(res.data.next);
+    } catch (error) { message.error('Lỗi tải lịch sử'); }
+  };
+
+  const CHANGE_FIELD_LABELS = {
+    title: 'Tên giao dịch', value: 'Giá trị', expected_close_date: 'Ngày đóng dự kiến',
+    stage: 'Giai đoạn', status: 'Trạng thái', lost_reason_code: 'Mã lý do thua',
+    lost_reason: 'Lý do thua', owner: 'Người phụ trách', customer: 'Khách hàng',
+  };
+
+  const formatChangeValue = (field, value) => {
+    if (value === null) return '—';
+    if (field === 'stage') return stages.find(s => String(s.id) === value)?.name || value;
+    if (field === 'value') return new Intl.NumberFormat('vi-VN').format(value);
+    return value;
+  };
+
   const handleCreateTask = async (values) => {
     setCreatingTask(true);
     try {
@@ -342,6 +372,7 @@ const OpportunityDetailPage = () => {
                                             </Timeline.Item>
                                         ))}
                                     </Timeline>
+                                    {activitiesNext && <Button block onClick={loadMoreActivities}>Tải thêm</Button>}
                                 </div>
                             </div>
                         )
@@ -376,6 +407,30 @@ const OpportunityDetailPage = () => {
                             </div>
                         )
                     },
+                    {
+                        label: <span><ScheduleOutlined /> Lịch sử</span>,
+                        key: 'HISTORY',
+                        children: (
+                            <div style={{ padding: 20, maxHeight: 500, overflowY: 'auto' }}>
+                                {changes.length === 0 ? <Empty description="Chưa có thay đổi" /> : (
+                                    <Timeline>
+                                        {changes.map(change => (
+                                            <Timeline.Item key={change.id} color="gray">
+                                                <p style={{ margin: 0, fontSize: 13 }}>
+                                                    <b>{change.user_name || 'Hệ thống'}</b> đổi <b>{CHANGE_FIELD_LABELS[change.field] || change.field}</b>
+                                                </p>
+                                                <p style={{ margin: '4px 0', color: '#333' }}>
+                                                    {formatChangeValue(change.field, change.old_value)} <RightOutlined style={{ fontSize: 10 }} /> {formatChangeValue(change.field, change.new_value)}
+                                                </p>
+                                                <small style={{ color: '#999' }}>{dayjs(change.created_at).format('DD/MM/YYYY - HH:mm')}</small>
+                                            </Timeline.Item>
+                                        ))}
+                                    </Timeline>
+                                )}
+                                {changesNext && <Button block onClick={loadMoreChanges}>Tải thêm</Button>}
+                            </div>
+                        )
+                    },
                 ]}
             />
           </Card>